@@ -4,8 +4,11 @@ PEP8
 """
 
 import os
+import functools
+import ticdat
+import ticdat.utils as utils
 from ticdat.utils import DataFrame, create_generic_free, numericish, case_space_to_pretty
-from ticdat.utils import freezable_factory, TicDatError, verify, containerish, dictish
+from ticdat.utils import freezable_factory, TicDatError, verify, containerish, dictish, count_duplicate_keys
 from collections import defaultdict
 from itertools import product
 
@@ -16,6 +19,13 @@ except:
 
 _can_unit_test = csv
 
+def _create_table_in_process(full_schema, dir_path, dialect, headers_present, encoding, table):
+    # reads a single table in a worker process, using a TicDatFactory rebuilt from a picklable full schema
+    duplicates = {}
+    tdf = ticdat.TicDatFactory.create_from_full_schema(full_schema)
+    return tdf.csv._create_table(dir_path, table, dialect, headers_present, encoding, duplicates), \
+           duplicates.get(table)
+
 class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
     """
     Primary class for reading/writing csv files with TicDat objects.
@@ -37,11 +47,12 @@ class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
         self._dv_dt = {}
         self._isFrozen = True
     def create_tic_dat(self, dir_path, dialect='excel', headers_present = True,
-                       freeze_it = False, encoding=None):
+                       freeze_it = False, encoding=None, max_workers=None, use_processes=False):
         """
         Create a TicDat object from the csv files in a directory
 
-        :param dir_path: the directory containing the .csv files.
+        :param dir_path: the directory containing the .csv files. Files ending in .csv.gz, .csv.bz2, .csv.xz
+                         or .csv.zst are decompressed as they are read.
 
         :param dialect: the csv dialect. Consult csv documentation for details.
 
@@ -52,6 +63,16 @@ class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
 
         :param freeze_it: boolean. should the returned object be frozen?
 
+        :param max_workers: optional. If provided, the files are read concurrently by a pool of this many
+                            threads. (Generator tables are still read lazily by the calling thread).
+                            Since the cells are parsed in pure Python, the threads mostly help by overlapping
+                            the file reads (and decompression) rather than the parsing.
+
+        :param use_processes: boolean. If truthy (and max_workers is provided), the pool is one of processes
+                              rather than threads, so that the parsing runs in parallel as well. On platforms that
+                              spawn rather than fork new processes, the calling script needs the
+                              usual if __name__ == "__main__": guard.
+
         :return: a TicDat object populated by the matching files.
 
         caveats: Missing files resolve to an empty table, but missing fields on
@@ -76,7 +97,9 @@ class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
         verify(DataFrame or not tdf.generic_tables,
                "Strange absence of pandas despite presence of generic tables")
         rtn = self.tic_dat_factory.TicDat(**self._create_tic_dat(dir_path, dialect,
-                                                                  headers_present, encoding))
+                                                                  headers_present, encoding,
+                                                                  max_workers=max_workers,
+                                                                  use_processes=use_processes))
         rtn = self.tic_dat_factory._parameter_table_post_read_adjustment(rtn)
         if freeze_it:
             return self.tic_dat_factory.freeze_me(rtn)
@@ -108,16 +131,52 @@ class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
                     return x
             return x
         return self.tic_dat_factory._general_read_cell(table, field, _inner_rtn(x))
-    def _create_tic_dat(self, dir_path, dialect, headers_present, encoding):
+    def _create_tic_dat(self, dir_path, dialect, headers_present, encoding, duplicates=None, max_workers=None,
+                        use_processes=False):
         verify(dialect in csv.list_dialects(), "Invalid dialect %s"%dialect)
         verify(os.path.isdir(dir_path), "Invalid directory path %s"%dir_path)
-        rtn =  {t : self._create_table(dir_path, t, dialect, headers_present, encoding)
-                for t in self.tic_dat_factory.all_tables}
+        tdf = self.tic_dat_factory
+        in_pool = [] if max_workers is None else [t for t in tdf.all_tables if t not in tdf.generator_tables]
+        if use_processes and in_pool:
+            read_table = functools.partial(_create_table_in_process, self._picklable_full_schema(), dir_path,
+                                           dialect, headers_present, encoding)
+        else:
+            def read_table(t):
+                table_duplicates = {}
+                return self._create_table(dir_path, t, dialect, headers_present, encoding, table_duplicates), \
+                       table_duplicates.get(t)
+        read = utils._map_tables(read_table, in_pool, max_workers, processes=use_processes)
+        rtn = {}
+        for t in tdf.all_tables:
+            if t in read:
+                rtn[t], dups = read[t]
+                if dups and duplicates is not None:
+                    duplicates[t] = dups
+            else:
+                rtn[t] = self._create_table(dir_path, t, dialect, headers_present, encoding, duplicates)
         missing_tables = {t for t in self.tic_dat_factory.all_tables if not rtn[t]}
         if missing_tables:
             print ("The following table names could not be found (or were empty) in the %s directory.\n%s\n"%
                    (dir_path,"\n".join(missing_tables)))
         return {k:v for k,v in rtn.items() if v}
+    def _picklable_full_schema(self):
+        # the parts of the full schema that matter for reading, in a form that can be sent to a worker process
+        full_schema = self.tic_dat_factory.schema(include_ancillary_info=True)
+        return dict(full_schema, foreign_keys=[], tooltips={},
+                    data_types={t: {f: tuple(dt) for f, dt in dts.items()}
+                                for t, dts in full_schema["data_types"].items()},
+                    default_values={t: dict(dvs) for t, dvs in full_schema["default_values"].items()},
+                    parameters={k: (None if v.type_dictionary is None else tuple(v.type_dictionary),
+                                    v.default_value) for k, v in full_schema["parameters"].items()})
+    def _find_duplicates_and_create_tic_dat(self, dir_path):
+        # a single read of the directory that serves both find_duplicates and create_tic_dat (for standard_main)
+        verify(csv, "csv needs to be installed to use this subroutine")
+        duplicates = {}
+        tic_dat_dict = self._create_tic_dat(dir_path, 'excel', True, None, duplicates)
+        if duplicates:
+            return duplicates, None
+        return {}, self.tic_dat_factory._parameter_table_post_read_adjustment(
+            self.tic_dat_factory.TicDat(**tic_dat_dict))
     def find_duplicates(self, dir_path, dialect='excel', headers_present = True, encoding=None):
         """
         Find the row counts for duplicated rows.
@@ -145,24 +204,20 @@ class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
         verify(dialect in csv.list_dialects(), "Invalid dialect %s"%dialect)
         verify(os.path.isdir(dir_path), "Invalid directory path %s"%dir_path)
         tdf = self.tic_dat_factory
-        rtn = {t:defaultdict(int) for t,_ in tdf.primary_key_fields.items()
-               if _ and self._get_file_path(dir_path, t)}
-        for t in rtn:
-            with open(self._get_file_path(dir_path, t), encoding=encoding) as csvfile:
-                for r in self._get_data(csvfile, t, dialect, headers_present):
-                    p_key = r[tdf.primary_key_fields[t][0]] \
-                            if len(tdf.primary_key_fields[t])==1 else \
-                            tuple(r[_] for _ in tdf.primary_key_fields[t])
-                    rtn[t][p_key] += 1
-        for t in list(rtn.keys()):
-            rtn[t] = {k:v for k,v in rtn[t].items() if v > 1}
-            if not rtn[t]:
-                del(rtn[t])
+        rtn = {}
+        for t, pks in tdf.primary_key_fields.items():
+            file_path = self._get_file_path(dir_path, t) if pks else None
+            if file_path:
+                with utils._open_file(file_path, encoding=encoding) as csvfile:
+                    rtn[t] = count_duplicate_keys(r[pks[0]] if len(pks) == 1 else tuple(r[_] for _ in pks)
+                                                  for r in self._get_data(csvfile, t, dialect, headers_present))
+                if not rtn[t]:
+                    del(rtn[t])
         return rtn
     def _get_file_path(self, dir_path, table):
         rtn = [path for f in os.listdir(dir_path) for path in [os.path.join(dir_path, f)]
                if os.path.isfile(path) and
-               f.lower().replace(" ", "_") == "%s.csv"%table.lower()]
+               utils._uncompressed_name(f).lower().replace(" ", "_") == "%s.csv"%table.lower()]
         verify(len(rtn) <= 1, "duplicate .csv files found for %s"%table)
         if rtn:
             return rtn[0]
@@ -170,47 +225,63 @@ class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
         tdf = self.tic_dat_factory
         fieldnames=tdf.primary_key_fields.get(table, ()) + tdf.data_fields.get(table, ())
         assert fieldnames or table in self.tic_dat_factory.generic_tables
-        for row in csv.DictReader(csvfile, dialect = dialect,
-                            **({"fieldnames":fieldnames} if not headers_present else {})):
+        reader = csv.reader(csvfile, dialect = dialect)
+        header = next(reader, None) if headers_present else None
+        field_positions = None
+        for row in reader:
+            if not row:
+                continue # consistent with csv.DictReader, which skips empty rows
+            if field_positions is None:
+                field_positions = self._field_positions(table, fieldnames, header) if headers_present else \
+                                  tuple((f, i) for i, f in enumerate(fieldnames))
+                width = len(header) if headers_present else len(fieldnames)
             if not headers_present:
-                verify(len(row) == len(fieldnames),
-                   "Need %s columns for table %s"%(len(fieldnames), table))
-                yield {f: self._read_cell(table, f, row[f]) for f in fieldnames}
-            else:
-                key_matching = defaultdict(list)
-                for k,f in product(row.keys(), fieldnames or row.keys()):
-                    if k.lower() ==f.lower():
-                        key_matching[f].append(k)
-                fieldnames = fieldnames or row.keys()
-                for f in fieldnames:
-                    verify(f in key_matching, "Unable to find field name %s for table %s"%(f, table))
-                    verify(len(key_matching[f]) <= 1,
-                           "Duplicate field names found for field %s table %s"%(f, table))
-                yield {f: self._read_cell(table, f, row[key_matching[f][0]]) for f in fieldnames}
-
-    def _create_table(self, dir_path, table, dialect, headers_present, encoding):
+                verify(len(row) <= len(fieldnames),
+                       "Need %s columns for table %s"%(len(fieldnames), table))
+            if len(row) < width: # short rows are padded with None, as per csv.DictReader
+                row += [None] * (width - len(row))
+            yield {f: self._read_cell(table, f, row[i]) for f, i in field_positions}
+    def _field_positions(self, table, fieldnames, header):
+        # resolves the (case insensitive) mapping from the header to the fields, once per file
+        column = {k: i for i, k in enumerate(header)} # like csv.DictReader, the last of a repeated header wins
+        key_matching = defaultdict(list)
+        for k, f in product(column, fieldnames or column):
+            if k.lower() == f.lower():
+                key_matching[f].append(k)
+        for f in fieldnames or column:
+            verify(f in key_matching, "Unable to find field name %s for table %s"%(f, table))
+            verify(len(key_matching[f]) <= 1,
+                   "Duplicate field names found for field %s table %s"%(f, table))
+        return tuple((f, column[key_matching[f][0]]) for f in fieldnames or column)
+
+    def _create_table(self, dir_path, table, dialect, headers_present, encoding, duplicates=None):
         file_path = self._get_file_path(dir_path, table)
         if not (file_path and  os.path.isfile(file_path)) :
             return
         tdf = self.tic_dat_factory
         if table in tdf.generator_tables:
             def rtn() :
-                with open(file_path, encoding=encoding) as csvfile:
+                with utils._open_file(file_path, encoding=encoding) as csvfile:
                     for r in self._get_data(csvfile, table, dialect, headers_present):
                         yield tuple(r[_] for _ in tdf.data_fields[table])
         else:
             rtn = {} if tdf.primary_key_fields.get(table) else []
-            with open(file_path, encoding=encoding) as csvfile:
+            dups = {}
+            with utils._open_file(file_path, encoding=encoding) as csvfile:
                 for r in self._get_data(csvfile, table, dialect, headers_present) :
                     if tdf.primary_key_fields.get(table) :
                         p_key = r[tdf.primary_key_fields[table][0]] \
                                 if len(tdf.primary_key_fields[table]) == 1 else \
                                 tuple(r[_] for _ in tdf.primary_key_fields[table])
+                        if p_key in rtn:
+                            dups[p_key] = dups.get(p_key, 1) + 1
                         rtn[p_key] = tuple(r[_] for _ in tdf.data_fields.get(table,()))
                     elif table in tdf.generic_tables:
                         rtn.append(r)
                     else:
                         rtn.append(tuple(r[_] for _ in tdf.data_fields[table]))
+            if dups and duplicates is not None:
+                duplicates[table] = dups
         return rtn
 
     def write_directory(self, tic_dat, dir_path, allow_overwrite = False, dialect='excel',
@@ -258,17 +329,7 @@ class CsvTicFactory(freezable_factory(object, "_isFrozen")) :
         for t in tdf.all_tables :
             f = os.path.join(dir_path, (case_space_to_pretty(t) if case_space_table_names else t) + ".csv")
             with open(f, 'w', newline='') as csvfile:
-                 writer = csv.DictWriter(csvfile,dialect=dialect, fieldnames=
-                        tdf.primary_key_fields.get(t, ()) + tdf.data_fields.get(t, ()) )
-                 writer.writeheader() if write_header else None
-                 def infinty_io_dict(d):
-                     return {f: self.tic_dat_factory._infinity_flag_write_cell(t, f, x) for f,x in d.items()}
-                 _t =  getattr(tic_dat, t)
-                 if dictish(_t) :
-                     for p_key, data_row in _t.items() :
-                         primaryKeyDict = {f:v for f,v in zip(tdf.primary_key_fields[t],
-                                            p_key if containerish(p_key) else (p_key,))}
-                         writer.writerow(infinty_io_dict(dict(data_row, **primaryKeyDict)))
-                 else :
-                     for data_row in (_t if containerish(_t) else _t()) :
-                         writer.writerow(infinty_io_dict(data_row))
\ No newline at end of file
+                 writer = csv.writer(csvfile, dialect=dialect)
+                 writer.writerow(tdf.primary_key_fields.get(t, ()) + tdf.data_fields.get(t, ())) \
+                     if write_header else None
+                 writer.writerows(tdf._write_rows(t, getattr(tic_dat, t)))
@@ -3,6 +3,7 @@ Read/write ticDat objects from json files. Requires the json module
 PEP8
 """
 import os
+import ticdat.utils as utils
 from collections import defaultdict
 from ticdat.utils import freezable_factory, TicDatError, verify, stringish, dictish, containerish
 from ticdat.utils import find_duplicates_from_dict_ticdat
@@ -69,7 +70,8 @@ class JsonTicFactory(freezable_factory(object, "_isFrozen")) :
         Create a TicDat object from a json file
 
         :param json_file_path: A json file path. It should encode a dictionary
-                               with table names as keys. Could also be an actual JSON string
+                               with table names as keys. Could also be an actual JSON string.
+                               A path ending in .gz, .bz2, .xz or .zst is decompressed as it is read.
 
         :param freeze_it: boolean. should the returned object be frozen?
 
@@ -94,16 +96,37 @@ class JsonTicFactory(freezable_factory(object, "_isFrozen")) :
         jdict = self._create_jdict(json_file_path)
         if self._looks_pandas(jdict):
             return self.create_tic_dat(json_file_path, freeze_it=freeze_it, from_pandas=True)
-        tic_dat_dict = self._create_tic_dat_dict(jdict)
+        rtn = self._create_tic_dat_from_dict(self._create_tic_dat_dict(jdict))
+        if freeze_it:
+            return self.tic_dat_factory.freeze_me(rtn)
+        return rtn
+    def _create_tic_dat_from_dict(self, tic_dat_dict):
         missing_tables = set(self.tic_dat_factory.all_tables).difference(tic_dat_dict)
         if missing_tables:
             print ("The following table names could not be found in the json file/string\n%s\n"%
                    "\n".join(missing_tables))
         rtn = self.tic_dat_factory.TicDat(**tic_dat_dict)
-        rtn = self.tic_dat_factory._parameter_table_post_read_adjustment(rtn)
-        if freeze_it:
-            return self.tic_dat_factory.freeze_me(rtn)
-        return rtn
+        return self.tic_dat_factory._parameter_table_post_read_adjustment(rtn)
+    def _find_duplicates_and_create_tic_dat(self, json_file_path):
+        # a single read of the file that serves both find_duplicates and create_tic_dat (for standard_main)
+        _standard_verify(self.tic_dat_factory)
+        jdict = self._create_jdict(json_file_path)
+        if self._looks_pandas(jdict):
+            pdf, pan_dat = self._create_pan_dat(json_file_path)
+            duplicates = find_duplicates_from_dict_ticdat(self.tic_dat_factory, self._pan_dat_rows(pdf, pan_dat))
+            return (duplicates, None) if duplicates else ({}, pdf.copy_to_tic_dat(pan_dat))
+        tic_dat_dict = self._create_tic_dat_dict(jdict)
+        # the keys are counted before TicDat.__init__ can collapse (or assert on) the duplicated rows
+        duplicates = find_duplicates_from_dict_ticdat(self.tic_dat_factory, tic_dat_dict)
+        if duplicates:
+            return duplicates, None
+        return {}, self._create_tic_dat_from_dict(tic_dat_dict)
+    def _create_pan_dat(self, json_file_path):
+        from ticdat import PanDatFactory
+        pdf = PanDatFactory.create_from_full_schema(self.tic_dat_factory.schema(include_ancillary_info=True))
+        return pdf, pdf.json.create_pan_dat(json_file_path)
+    def _pan_dat_rows(self, pdf, pan_dat):
+        return {t: [tuple(_) for _ in getattr(pan_dat, t).itertuples(index=False)] for t in pdf.all_tables}
     def find_duplicates(self, json_file_path, from_pandas = False):
         """
         Find the row counts for duplicated rows.
@@ -122,10 +145,7 @@ class JsonTicFactory(freezable_factory(object, "_isFrozen")) :
         """
         _standard_verify(self.tic_dat_factory)
         if from_pandas:
-            from ticdat import PanDatFactory
-            pdf = PanDatFactory.create_from_full_schema(self.tic_dat_factory.schema(include_ancillary_info=True))
-            _rtn = pdf.json.create_pan_dat(json_file_path)
-            jdict = {t: [tuple(_) for _ in getattr(_rtn, t).itertuples(index=False)] for t in pdf.all_tables}
+            jdict = self._pan_dat_rows(*self._create_pan_dat(json_file_path))
         else:
             jdict = self._create_jdict(json_file_path)
             if self._looks_pandas(jdict):
@@ -137,7 +157,7 @@ class JsonTicFactory(freezable_factory(object, "_isFrozen")) :
             reasonble_string = path_or_buf
             verify(os.path.isfile(path_or_buf), "json_file_path is not a valid file path.")
             try :
-                with open(path_or_buf, "r") as fp:
+                with utils._open_file(path_or_buf, "r") as fp:
                     jdict = json.load(fp)
             except Exception as e:
                 raise TicDatError("Unable to interpret %s as json file : %s" %
@@ -185,6 +205,7 @@ class JsonTicFactory(freezable_factory(object, "_isFrozen")) :
         :param tic_dat: the data object to write (typically a TicDat)
 
         :param json_file_path: The file path of the json file to create. If empty string, then return a JSON string.
+                               A path ending in .gz, .bz2, .xz or .zst is compressed as it is written.
 
         :param allow_overwrite: boolean - are we allowed to overwrite an
                                 existing file?
@@ -211,5 +232,5 @@ class JsonTicFactory(freezable_factory(object, "_isFrozen")) :
         jdict = make_json_dict(self.tic_dat_factory, tic_dat, verbose, use_infinity_io_flag_if_provided=True)
         if not json_file_path:
             return json.dumps(jdict, sort_keys=True, indent=2)
-        with open(json_file_path, "w") as fp:
+        with utils._open_file(json_file_path, "w") as fp:
             json.dump(jdict, fp, sort_keys=True, indent=2)
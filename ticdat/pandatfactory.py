@@ -10,6 +10,9 @@ import ticdat.pandatio as pandatio
 from itertools import count
 import inspect
 import math
+import time
+import hashlib
+import warnings
 try:
     from pandas import isnull
     import numpy
@@ -29,6 +32,24 @@ def _safe_any(s):
         return False
     return s.any()
 
+def _failure_count(failures):
+    # the number of rows represented by a value of a find_data_type_failures or find_data_row_failures dictionary
+    if isinstance(failures, DataFrame):
+        return len(failures)
+    if isinstance(failures, pd.Series):
+        return int(failures.sum())
+    return float("inf") # a predicate_kwargs_maker failure applies to every row
+
+def _number_other_columns(column):
+    # a (number, other) pair of Series that represents column independently of its dtype. The former has the numbers
+    # (as floats), the latter everything else (with None for the nulls)
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        return column.astype(float), pd.Series(None, index=column.index, dtype=object)
+    column = column.astype(object)
+    is_number = column.map(utils.numericish).astype(bool)
+    return pd.to_numeric(column.where(is_number), errors="coerce").astype(float), \
+           column.where(~is_number & column.notnull(), None)
+
 def _is_last_rows_all_nan(df, last_rows):
     assert last_rows > 0
     # quick last row check to make faster
@@ -218,6 +239,10 @@ class PanDatFactory(object):
                         rtn.add_data_row_predicate(tbl, predicate=rpi.predicate, predicate_name=pn,
                                                    predicate_kwargs_maker=rpi.predicate_kwargs_maker,
                                                    predicate_failure_response=rpi.predicate_failure_response)
+        for tbl, checks in self._aggregate_checks.items(): # copied over as-is, like the row predicates
+            for cn, ac in checks.items():
+                if table_restrictions is None or {tbl, ac.parent_table}.difference([None]).issubset(table_restrictions):
+                    rtn._aggregate_checks[tbl][cn] = ac
         if convert_dat: # this function is effectively a constructor so _ reference is ok
             assert callable(convert_dat) and len(inspect.getfullargspec(convert_dat).args) >= 1
             rtn._convert_dat[:] = [convert_dat,
@@ -446,6 +471,17 @@ class PanDatFactory(object):
                                              about type that might need to be undone
         :param json_read: special 'None'->None override needed for pandas json reader
         '''
+        for t in self.all_tables:
+            self._post_read_table_adjustment(t, getattr(dat, t), push_parameters_to_be_valid, json_read)
+        return dat
+    def _post_read_table_adjustment(self, t, df, push_parameters_to_be_valid=False, json_read=False):
+        '''
+        we expect other routines inside ticdat to access this routine, even though it starts with _
+        performs the _general_post_read_adjustment for a single table (or a chunk of rows from a single table)
+        :param t: table name
+        :param df: DataFrame that was just read from an external data source. df will be side-effected
+        :return: df
+        '''
         assert push_parameters_to_be_valid or not json_read, "json_read should always push_parameters_to_be_valid"
         def _multitype_cell_adj(x):
             _x = safe_apply(float)(x)
@@ -462,8 +498,7 @@ class PanDatFactory(object):
                 return x
             return float("inf") if x >= self.infinity_io_flag else \
                 (-float("inf") if x <= -self.infinity_io_flag else x)
-        for t in set(self.all_tables).difference(["parameters"]): # parameters table is handled differently
-            df = getattr(dat, t)
+        if t != "parameters": # parameters table is handled differently
             all_fields = tuple(self.primary_key_fields.get(t, ()) + self.data_fields.get(t, ()))
             if utils.numericish(self.infinity_io_flag):
                 fields_w_issues = set()
@@ -492,7 +527,7 @@ class PanDatFactory(object):
 
         # this is the logic that is used in lieu of infinity_io_flag logic for the parameters table
         # it is predicated on the assumption that the parameters table will be serialized to a string/string table
-        if self.parameters:
+        if t == "parameters" and self.parameters:
             [key_fld], [val_fld] = self.schema()["parameters"]
             td = lambda k : getattr(self.parameters.get(k, None), "type_dictionary", None)
             _can_parameter_have_number = lambda k : False if td(k) and not td(k).number_allowed else True
@@ -516,8 +551,8 @@ class PanDatFactory(object):
                 if number_v is not None and safe_apply(int)(number_v) == number_v:
                     number_v = int(number_v)
                 return value if number_v is None else number_v
-            dat.parameters[val_fld] = utils.faster_df_apply(dat.parameters, lambda row: fix_value(row))
-        return dat
+            df[val_fld] = utils.faster_df_apply(df, lambda row: fix_value(row))
+        return df
     def _pre_write_adjustment(self, dat):
         '''
         we expect other routines inside ticdat to access this routine, even though it starts with _
@@ -667,6 +702,11 @@ class PanDatFactory(object):
                           maps field name to data value for all fields (both primary key and data field) in the table.
                           Note - if None is passed as a predicate, then any previously added
                           predicate matching (table, predicate_name) will be removed.
+                          Alternately, predicate can be an expression string over the fields of the table, such
+                          as "Min Nutrition <= Max Nutrition" or "Quantity > 0 or Quantity is None". See
+                          utils.RowPredicateExpression for the supported expressions. Expressions can't be combined
+                          with predicate_kwargs_maker or an "Error Message" predicate_failure_response.
+                          Expressions are evaluated as a single vectorized mask over the table.
 .
 
         :param predicate_name: The name of the predicate. If omitted, the smallest non-colliding
@@ -694,7 +734,13 @@ class PanDatFactory(object):
                 self._data_row_predicates[table].pop(predicate_name, None)
             return
 
-        verify(callable(predicate), "predicate should be a one argument function")
+        if utils.stringish(predicate):
+            verify(table not in self.generic_tables, "expression predicates can't be used with generic tables")
+            verify(not predicate_kwargs_maker and predicate_failure_response == "Boolean",
+                   "expression predicates can't be used with predicate_kwargs_maker or an Error Message response")
+            predicate = utils.RowPredicateExpression(predicate, self.primary_key_fields.get(table, ()) +
+                                                                self.data_fields.get(table, ()))
+        verify(callable(predicate), "predicate should be a one argument function or an expression string")
         verify(not predicate_kwargs_maker or callable(predicate_kwargs_maker),
                "predicate_kwargs_maker should be a one argument function")
         verify(predicate_failure_response in ["Boolean", "Error Message"],
@@ -714,6 +760,60 @@ class PanDatFactory(object):
         '''
         verify(table in self.all_tables, "Unrecognized table name %s"%table)
         return {k: v for k, v in self._data_row_predicates.get(table, {}).items()}
+    def add_aggregate_check(self, child_table, group_by, agg, parent_table=None, comparison="> 0",
+                            check_name=None, parent_group_by=None):
+        """
+        The purpose of calling add_aggregate_check is to prepare for a future call to find_aggregate_check_failures.
+
+        Adds a check that groups the rows of a table, aggregates each group, and compares the aggregate to a bound.
+        For example, the total demand for each commodity can be verified to be no larger than the supply of that
+        commodity, or each parent row can be verified to have at least one child row. The bound can also aggregate
+        the parent table, so that the total demand for each commodity can be verified to be no larger than the total
+        supply of that commodity (summed over a supply table with a row for each warehouse and commodity).
+
+        :param child_table: the table whose rows are grouped and aggregated
+
+        :param group_by: a field (or a tuple of fields) of child_table to group by
+
+        :param agg: Either "count" (the number of rows in the group) or a (aggregation, field) pair, where
+                    aggregation is one of "sum", "min", "max", "mean". Null values are skipped by the aggregation.
+
+        :param parent_table: optional. If provided, then there is a group for each row of parent_table, and the
+                             group_by fields are matched to the primary key fields of parent_table (in order). Parent
+                             rows without child rows have a count or sum of 0 (and a null min, max or mean).
+
+        :param comparison: a string with a comparison operator (one of < <= > >= == !=) and a bound. The bound is
+                           either a number, a data field of parent_table, or an aggregation (one of "sum", "min",
+                           "max", "mean") of a field of parent_table, as in "<= 100", "<= Max Supply" or
+                           "<= sum(Supply)". A group whose aggregate is null fails the check.
+
+        :param check_name: The name of the check. If omitted, the smallest non-colliding number will be used.
+
+        :param parent_group_by: optional. A field (or a tuple of fields) of parent_table to use in place of its primary
+                                key fields. There is then a group for each distinct parent_group_by value of
+                                parent_table, and a bound that is a field of parent_table needs to be aggregated.
+
+        :return:
+        """
+        verify(not self._has_been_used,
+               "The aggregate checks can't be changed after a PanDatFactory has been used.")
+        aggregate_check = utils.AggregateCheck(self, child_table, group_by, agg, parent_table, comparison,
+                                               parent_group_by)
+        if check_name is None:
+            check_name = next(i for i in count() if i not in self._aggregate_checks[child_table])
+        self._aggregate_checks[child_table][check_name] = aggregate_check
+    def get_aggregate_checks(self, table):
+        '''
+        return all the aggregate checks for a given (child) table
+
+        :param table: a table in the schema
+
+        :return: a dictionary mapping check_name to utils.AggregateCheck objects (based on the prior call to
+                 add_aggregate_check). The sql method of these objects renders the check as a GROUP BY query that
+                 can be run against a database.
+        '''
+        verify(table in self.all_tables, "Unrecognized table name %s"%table)
+        return {k: v for k, v in self._aggregate_checks.get(table, {}).items()}
 
     def add_parameter(self, name, default_value, number_allowed = True,
                       inclusive_min = True, inclusive_max = False, min = 0, max = float("inf"),
@@ -962,6 +1062,7 @@ class PanDatFactory(object):
                 self._default_values[tbl][fld] = 0
         self._data_types = clt.defaultdict(dict)
         self._data_row_predicates = clt.defaultdict(dict)
+        self._aggregate_checks = clt.defaultdict(dict)
         self._tooltips = {}
         self._foreign_keys = clt.defaultdict(set)
         self._parameters = {}
@@ -1120,6 +1221,287 @@ class PanDatFactory(object):
         return tdf._same_data(self._copy_to_tic_dat(obj1, keep_generics_as_df=False),
                               self._copy_to_tic_dat(obj2, keep_generics_as_df=False), epsilon=epsilon,
                               nans_are_same_for_data_rows=nans_are_same_for_data_rows)
+    def diff(self, pan_dat_1, pan_dat_2, epsilon=0, nans_are_same_for_data_rows=False):
+        """
+        Find the differences between two PanDat objects. Each table is compared with a single merge
+        on the primary key fields (or, for tables without primary keys, on all the fields), so no row by row
+        searching is performed.
+
+        :param pan_dat_1: the "old" PanDat object
+
+        :param pan_dat_2: the "new" PanDat object
+
+        :param epsilon: data field values whose percent error (see utils.per_error) is less than epsilon are
+                        considered the same
+
+        :param nans_are_same_for_data_rows: if truthy, then two null data field values are considered the same
+
+        :return: A dictionary keyed by the names of the tables that differ. The values are namedtuples with
+                 attributes "added", "removed", "changed".
+                 "added" is a DataFrame of the rows of pan_dat_2 that are missing from pan_dat_1, and
+                 "removed" is a DataFrame of the rows of pan_dat_1 that are missing from pan_dat_2.
+                 For tables with primary keys, rows are matched by primary key, and "changed" is a DataFrame
+                 with the primary key fields and the columns "field", "old", "new", with one row for each
+                 data field value that differs.
+                 For tables without primary keys, duplicated rows are matched one for one, and "changed" is
+                 always empty.
+        """
+        for pdt in (pan_dat_1, pan_dat_2):
+            msg = []
+            verify(self.good_pan_dat_object(pdt, msg.append),
+                   "pan_dat not a good object for this factory : %s"%"\n".join(msg))
+        verify(not self.generic_tables, "diff is not implemented for generic tables")
+        assert epsilon >= 0
+        TableDiff = clt.namedtuple("TableDiff", ["added", "removed", "changed"])
+        def same_values(old, new):
+            rtn = old == new
+            both_null = ~rtn & old.isnull() & new.isnull()
+            if not nans_are_same_for_data_rows and both_null.any():
+                # consistent with TicDat.diff, None is always the same as None
+                both_null[both_null] = [x is None and y is None for x, y in zip(old[both_null], new[both_null])]
+            rtn |= both_null
+            if epsilon > 0 and not rtn.all():
+                rtn[~rtn] = [bool(safe_apply(utils.nearly_same)(x, y, epsilon))
+                             for x, y in zip(old[~rtn], new[~rtn])]
+            return rtn
+        rtn = {}
+        for t in self.all_tables:
+            pks, dfs = list(self.primary_key_fields.get(t, ())), list(self.data_fields.get(t, ()))
+            if not pks + dfs:
+                continue
+            old_flds, new_flds = ([f"_{prefix}_{i}" for i in range(len(dfs))] for prefix in ["old", "new"])
+            df1 = getattr(pan_dat_1, t)[pks + dfs].reset_index(drop=True).rename(columns=dict(zip(dfs, old_flds)))
+            df2 = getattr(pan_dat_2, t)[pks + dfs].reset_index(drop=True).rename(columns=dict(zip(dfs, new_flds)))
+            on = pks
+            if not pks:
+                # match duplicated rows one for one by numbering the repeats
+                on = old_flds + ["_repeat"]
+                df1 = df1.assign(_repeat=df1.groupby(old_flds, dropna=False).cumcount())
+                df2 = df2.assign(_repeat=df2.groupby(new_flds, dropna=False).cumcount()).\
+                      rename(columns=dict(zip(new_flds, old_flds)))
+            merged = df1.merge(df2, on=on, how="outer", indicator=True)
+            added = merged[merged["_merge"] == "right_only"][pks + (new_flds if pks else old_flds)].\
+                    rename(columns=dict(zip(new_flds if pks else old_flds, dfs))).reset_index(drop=True)
+            removed = merged[merged["_merge"] == "left_only"][pks + old_flds].\
+                      rename(columns=dict(zip(old_flds, dfs))).reset_index(drop=True)
+            both = merged[merged["_merge"] == "both"]
+            changed = [both.loc[~same_values(both[o], both[n]), pks + [o, n]].
+                       rename(columns={o: "old", n: "new"}).assign(field=f)
+                       for f, o, n in zip(dfs, old_flds, new_flds)] if pks else []
+            changed = pd.concat([_ for _ in changed if len(_)] or [DataFrame(columns=pks + ["old", "new", "field"])],
+                                ignore_index=True)[pks + ["field", "old", "new"]]
+            if len(added) or len(removed) or len(changed):
+                rtn[t] = TableDiff(added, removed, changed)
+        return rtn
+    def track_changes(self, pan_dat):
+        """
+        Take a snapshot of pan_dat, so that the rows inserted, updated and deleted afterwards can be found.
+        Unlike TicDatFactory.track_changes, the edits themselves aren't recorded. Instead, the snapshot holds
+        a hash of every row, keyed by the DataFrame index, and changes_since compares against it. (The snapshot also
+        holds a copy of the fields looked up by the foreign keys into each table).
+
+        :param pan_dat: a PanDat object. Each table needs a unique index (i.e. append new rows with
+                        pandas.concat(..., ignore_index=True) or with new index labels).
+
+        :return: a checkpoint token that can be passed to changes_since (and find_failures_since)
+        """
+        msg  = []
+        verify(self.good_pan_dat_object(pan_dat, msg.append),
+               "pan_dat not a good object for this factory : %s"%"\n".join(msg))
+        # the fields that foreign keys look up are copied as well, so that find_failures_since can find the
+        # native rows that referenced a deleted or updated row
+        look_up_fields = clt.defaultdict(set)
+        for fk in self.foreign_keys:
+            look_up_fields[fk.foreign_table].update(_.foreign_field for _ in self._fk_mappings(fk))
+        TableSnapshot = clt.namedtuple("TableSnapshot", ["row_hashes", "look_ups"])
+        return utils.FrozenDict({t: TableSnapshot(self._row_hashes(pan_dat, t),
+                                                  getattr(pan_dat, t)[sorted(look_up_fields[t])].copy()
+                                                  if t in look_up_fields else None)
+                                 for t in self.all_tables})
+    @staticmethod
+    def _fk_mappings(fk):
+        return (fk.mapping,) if hasattr(fk.mapping, "native_field") else tuple(fk.mapping)
+    def _row_hashes(self, pan_dat, table):
+        df = getattr(pan_dat, table)
+        verify(df.index.is_unique, f"{table} needs a unique index in order to track changes")
+        # hash normalized columns, so that a change of dtype (i.e. appending a float row to an int column)
+        # doesn't change the hashes of the existing rows
+        columns = {}
+        for i, f in enumerate(self._all_fields(table) or tuple(df.columns)):
+            columns[i, "number"], columns[i, "other"] = _number_other_columns(df[f])
+        return pd.util.hash_pandas_object(DataFrame(columns, index=df.index), index=False)
+    def changes_since(self, pan_dat, token):
+        """
+        Find the rows that have been edited since a checkpoint.
+
+        :param pan_dat: a PanDat object
+
+        :param token: a checkpoint token returned by track_changes
+
+        :return: A dictionary keyed by the names of the tables that have been edited since the checkpoint.
+                 The values are namedtuples with attributes "inserted", "updated", "deleted", each of which is
+                 a pandas Index of row labels. Rows are matched by index label, so a row whose index label is
+                 new is "inserted", even if it duplicates a deleted row.
+        """
+        msg  = []
+        verify(self.good_pan_dat_object(pan_dat, msg.append),
+               "pan_dat not a good object for this factory : %s"%"\n".join(msg))
+        verify(dictish(token) and set(token) == set(self.all_tables) and
+               all(hasattr(_, "row_hashes") for _ in token.values()), "bad token")
+        ChangedRows = clt.namedtuple("ChangedRows", ["inserted", "updated", "deleted"])
+        rtn = {}
+        for t in self.all_tables:
+            old, new = token[t].row_hashes, self._row_hashes(pan_dat, t)
+            common = new.index.intersection(old.index)
+            updated = common[new[common].values != old[common].values]
+            changes = ChangedRows(new.index.difference(old.index), updated, old.index.difference(new.index))
+            if any(map(len, changes)):
+                rtn[t] = changes
+        return rtn
+    def find_all_failures(self, pan_dat, as_table=True, exception_handling="__debug__"):
+        """
+        Finds all the integrity failures for a pandat object. This is a faster alternative to calling
+        find_duplicates, find_data_type_failures, find_data_row_failures and find_foreign_key_failures one
+        after the other, since the row predicates of each table are evaluated in a single pass over its rows.
+
+        :param pan_dat: a PanDat object
+
+        :param as_table: see find_data_row_failures
+
+        :param exception_handling: see find_data_row_failures
+
+        :return: A namedtuple with members "duplicates", "data_type", "data_row", "foreign_key". The values are
+                 the same dictionaries returned by find_duplicates, find_data_type_failures,
+                 find_data_row_failures and find_foreign_key_failures (with verbosity "High").
+        """
+        return self._find_all_failures(pan_dat, as_table, as_table, exception_handling)
+    def _find_all_failures(self, pan_dat, as_table, data_row_as_table, exception_handling):
+        msg = []
+        verify(self.good_pan_dat_object(pan_dat, msg.append),
+               "pan_dat not a good object for this factory : %s"%"\n".join(msg))
+        AllFailures = clt.namedtuple("AllFailures", ["duplicates", "data_type", "data_row", "foreign_key"])
+        return AllFailures(self.find_duplicates(pan_dat, as_table=as_table),
+                           self.find_data_type_failures(pan_dat, as_table=as_table),
+                           self._find_data_row_failures(pan_dat, pan_dat, data_row_as_table, exception_handling,
+                                                        float("inf")),
+                           self.find_foreign_key_failures(pan_dat, as_table=as_table))
+    def find_failures_since(self, pan_dat, token, exception_handling="__debug__"):
+        """
+        Finds the integrity failures for the rows of a pandat object that have been edited since a checkpoint.
+        The rows that were valid at the checkpoint and haven't been edited since aren't rechecked, so for a
+        small batch of new rows this is much faster than calling each of the find routines.
+
+        :param pan_dat: a PanDat object
+
+        :param token: a checkpoint token returned by track_changes
+
+        :param exception_handling: see find_data_row_failures
+
+        :return: A namedtuple with members "duplicates", "data_type", "data_row", "foreign_key". The values are
+                 the same dictionaries returned by find_duplicates, find_data_type_failures,
+                 find_data_row_failures and find_foreign_key_failures, restricted to the failures of the
+                 following rows.
+
+         --> the rows inserted or updated since the checkpoint. (For duplicates, every row sharing a primary
+             key with an edited row is considered).
+
+         --> for foreign keys into a table that has had rows deleted or updated since the checkpoint, the native
+             table rows that referenced those rows (as of the checkpoint) are checked (for that foreign key only),
+             since editing a parent row can orphan child rows that haven't themselves been edited.
+
+        caveats: Row predicates whose predicate_kwargs_maker depends on other tables can make an unedited row fail.
+                 Such failures are only found by find_data_row_failures.
+        """
+        changes = self.changes_since(pan_dat, token)
+        def edited_rows(t):
+            df = getattr(pan_dat, t)
+            if t not in changes:
+                return df.iloc[0:0]
+            return df[df.index.isin(changes[t].inserted.union(changes[t].updated))]
+        edited = {t: edited_rows(t) for t in self.all_tables}
+        edited_dat = self.PanDat(**edited)
+
+        duplicates = {}
+        for t, pks in self.primary_key_fields.items():
+            if pks and len(edited[t]):
+                df = getattr(pan_dat, t)
+                candidates = df[pd.MultiIndex.from_frame(df[list(pks)]).isin(
+                                pd.MultiIndex.from_frame(edited[t][list(pks)]))]
+                dups = candidates.duplicated(list(pks), keep="first")
+                if _safe_any(dups):
+                    duplicates[t] = candidates[dups]
+
+        child_tables = {}
+        for fk in self.foreign_keys:
+            native = getattr(pan_dat, fk.native_table)
+            candidates = native.index.isin(edited[fk.native_table].index)
+            foreign_changes = changes.get(fk.foreign_table)
+            if foreign_changes and (len(foreign_changes.deleted) or len(foreign_changes.updated)):
+                mappings = self._fk_mappings(fk)
+                lost = token[fk.foreign_table].look_ups.loc[foreign_changes.deleted.union(foreign_changes.updated),
+                                                            [_.foreign_field for _ in mappings]]
+                candidates |= pd.MultiIndex.from_frame(native[[_.native_field for _ in mappings]]).isin(
+                                  pd.MultiIndex.from_frame(lost))
+            if candidates.any():
+                child_tables[fk] = native[candidates]
+        foreign_key = {fk: child_tables[fk][rows] for fk, rows in
+                       self._find_foreign_key_failure_rows(pan_dat, child_tables=child_tables).items()}
+
+        AllFailures = clt.namedtuple("AllFailures", ["duplicates", "data_type", "data_row", "foreign_key"])
+        return AllFailures(duplicates, self.find_data_type_failures(edited_dat),
+                           self._find_data_row_failures(pan_dat, edited_dat, True, exception_handling,
+                                                        float("inf")),
+                           foreign_key)
+    def fingerprint(self, pan_dat):
+        """
+        Compute a digest of the data in a PanDat object. The digest doesn't depend on the order of the rows (or the
+        index of the DataFrames), and is stable across Python sessions, so it can be used to recognize previously
+        seen data. The rows are hashed with pandas.util.hash_pandas_object.
+
+        The columns are normalized prior to hashing. The infinity_io_flag is applied (so that two PanDat objects
+        that would write the same data have the same fingerprint), numbers are treated as floats, and the
+        values of datetime fields (and datetime columns) are converted to a canonical form, with timezone aware
+        datetimes converted to UTC.
+
+        :param pan_dat: pandat object
+
+        :return: a namedtuple with members "overall" and "tables". The former is a hex digest string for the
+                 entire data set, the latter is a dictionary mapping each table name to a hex digest string.
+        """
+        msg = []
+        verify(self.good_pan_dat_object(pan_dat, msg.append),
+               "pan_dat not a good object for this factory : %s"%"\n".join(msg))
+        table_digests = {}
+        for t in self.all_tables:
+            df = getattr(pan_dat, t)
+            fields = self._all_fields(t) or tuple(df.columns)
+            columns = {}
+            for i, f in enumerate(fields):
+                columns[i, "number"], columns[i, "other"] = self._fingerprint_columns(t, f, df[f])
+            row_hashes = pd.util.hash_pandas_object(DataFrame(columns, index=range(len(df))), index=False)
+            table_digests[t] = utils._fingerprint_table(fields, row_hashes.sort_values().values.tobytes())
+        return utils._fingerprint(table_digests)
+    def _fingerprint_columns(self, t, f, column):
+        """
+        :return: a (number, other) pair of Series that normalizes column for fingerprint. The former has the
+                 numbers (as floats), the latter everything else (with None for the nulls).
+        """
+        column = column.reset_index(drop=True)
+        dt = self.data_types.get(t, {}).get(f)
+        is_datetime = bool(dt and dt.datetime) or pd.api.types.is_datetime64_any_dtype(column)
+        number, other = _number_other_columns(column)
+        if is_datetime and other.notnull().any():
+            with warnings.catch_warnings(): # pandas can warn about inferring the format of datetime strings
+                warnings.simplefilter("ignore")
+                as_datetime = pd.to_datetime(other, errors="coerce", utc=True)
+            other = other.where(as_datetime.isnull(),
+                                as_datetime.dt.tz_convert(None).dt.strftime("%Y-%m-%d %H:%M:%S.%f"))
+        if t != "parameters": # as per set_infinity_io_flag, the parameters table isn't infinity flagged
+            if utils.numericish(self.infinity_io_flag):
+                number = number.clip(-self.infinity_io_flag, self.infinity_io_flag)
+            elif self.infinity_io_flag is None and utils.numericish(self._none_as_infinity_bias(t, f)):
+                number = number.mask(number == self._none_as_infinity_bias(t, f) * float("inf"))
+        return number, other
     def _true_data_types(self):
         '''
         See issue https://github.com/ticdat/ticdat/issues/46  and the doc string for find_data_type_failures
@@ -1134,7 +1516,8 @@ class PanDatFactory(object):
                       inclusive_min=True, inclusive_max=True, min=-float("inf"), max=float("inf"),
                       must_be_int=False, strings_allowed='*', nullable=False, datetime=False)
         return tmp_pdf.data_types
-    def find_data_type_failures(self, pan_dat, as_table=True, max_failures=float("inf")):
+    def find_data_type_failures(self, pan_dat, as_table=True, max_failures=float("inf"), sample=None,
+                                sample_seed=None):
         """
         Finds the data type failures for a pandat object
 
@@ -1147,6 +1530,19 @@ class PanDatFactory(object):
         :param max_failures: number. An upper limit on the number of failures to find. Will short circuit and return
                                      ASAP with a partial failure enumeration when this number is reached.
 
+        :param sample: optional. Either a float fraction in (0, 1], or a positive int row count (so 1.0 is every
+                       row, and 1 is a single row). If provided, only a random sample of the rows of each
+                       table is checked, and a namedtuple is returned with the following members.
+                       --> failures - the dictionary described below, restricted to the sampled rows. Since the
+                                      unsampled rows aren't checked, the failures may be undercounted.
+                       --> sample_sizes - a dictionary mapping each checked table to
+                                          (number of rows sampled, number of rows)
+                       --> estimated_failure_rates - a dictionary mapping each key of failures to the fraction
+                                                     of the sampled rows of the table that failed
+                       --> may_be_undercounted - True if any checked table wasn't fully sampled
+
+        :param sample_seed: optional. The random seed for choosing the sample.
+
         :return: A dictionary constructed as follow:
                  The keys are namedtuples with members "table", "field". Each (table,field) pair
                  has data values that are inconsistent with its data type. (table, field) pairs
@@ -1163,6 +1559,10 @@ class PanDatFactory(object):
         verify(self.good_pan_dat_object(pan_dat, msg.append),
                "pan_dat not a good object for this factory : %s"%"\n".join(msg))
         assert max_failures > 0, "max_failures should be a positive number"
+        if sample is not None:
+            sampled_dat, sample_sizes = self._sample_pan_dat(pan_dat, self._true_data_types(), sample, sample_seed)
+            return utils._sampled_failures(self.find_data_type_failures(sampled_dat, as_table, max_failures),
+                                           sample_sizes, _failure_count)
 
         rtn = {}
         TableField = clt.namedtuple("TableField", ["table", "field"])
@@ -1170,24 +1570,27 @@ class PanDatFactory(object):
         for table, type_row in self._true_data_types().items():
             _table = getattr(pan_dat, table)
             for field, data_type in type_row.items():
-                def _bad_row(data):
-                    return not data_type.valid_data(None if isnull(data) else data)
-                if max_failures == float("inf"):
-                    bad_row = _bad_row
-                else:
-                    def bad_row(data):
-                        if number_failures[0] >= max_failures:
-                            return False  # all future rows will be good (i.e. not bad, i.e. False)
-                        rtn = _bad_row(data)
-                        if rtn:
-                            number_failures[0] += 1
-                        return rtn
-                where_bad_rows = _table[field].apply(bad_row)
+                where_bad_rows = data_type._invalid_mask(_table[field])
+                if max_failures < float("inf"): # all the rows after the max_failures-th failure are good
+                    where_bad_rows &= where_bad_rows.cumsum() <= max_failures - number_failures[0]
+                    number_failures[0] += int(where_bad_rows.sum())
                 if _safe_any(where_bad_rows):
                     rtn[TableField(table, field)] = _table[where_bad_rows].copy() if as_table else where_bad_rows
                 if number_failures[0] >= max_failures:
                     return rtn
         return rtn
+    def _sample_pan_dat(self, pan_dat, tables, sample, sample_seed):
+        """
+        :return: a PanDat holding a random sample of the rows of each of the tables, and a dictionary mapping
+                 each of the tables to (number of rows sampled, number of rows)
+        """
+        random_state = numpy.random.RandomState(sample_seed)
+        sampled, sample_sizes = {}, {}
+        for t in sorted(tables):
+            df = getattr(pan_dat, t)
+            sampled[t] = df.sample(n=utils._sample_size(sample, len(df)), random_state=random_state)
+            sample_sizes[t] = (len(sampled[t]), len(df))
+        return self.PanDat(**sampled), sample_sizes
     def replace_data_type_failures(self, pan_dat, replacement_values=None):
         """
         Replace the data cells with data type failures with the default value for the appropriate field.
@@ -1220,7 +1623,12 @@ class PanDatFactory(object):
             verify(table in self.all_tables, "%s is not a table for this schema"%table)
             verify(field in self._all_fields(table), "%s is not a field for %s"%(field, table))
 
-        replacements_needed = self.find_data_type_failures(pan_dat, as_table=False)
+        replacements_needed = {}
+        for table, type_row in self._true_data_types().items():
+            for field, data_type in type_row.items():
+                where_bad_rows = data_type._invalid_mask(getattr(pan_dat, table)[field])
+                if where_bad_rows.any():
+                    replacements_needed[table, field] = where_bad_rows
         if not replacements_needed:
             return pan_dat
 
@@ -1235,18 +1643,31 @@ class PanDatFactory(object):
                 verify(self._true_data_types()[table][field].valid_data(value),
                        "The replacement value %s is not itself valid for %s : %s"%(value, table, field))
 
-        for table, field in replacements_needed:
+        for (table, field), where_bad_rows in replacements_needed.items():
             if (table, field) in real_replacements:
-                data_type = self._true_data_types()[table][field]
-                def bad_row(row):
-                    data = row[field]
-                    return not data_type.valid_data(None if isnull(data) else data)
-                getattr(pan_dat, table)[field] = utils.faster_df_apply(getattr(pan_dat, table), lambda row:
-                        real_replacements[table, field] if bad_row(row) else row[field])
+                _table = getattr(pan_dat, table)
+                _table[field] = _table[field].mask(where_bad_rows, real_replacements[table, field])
         assert not set(self.find_data_type_failures(pan_dat)).intersection(real_replacements)
         return pan_dat
+    def _content_stamp(self, pan_dat):
+        """
+        :return: a hashable summary of the contents of pan_dat that changes whenever the data changes (or None, if
+                 pan_dat has unhashable data)
+        """
+        rtn = []
+        for t in sorted(self.all_tables):
+            df = getattr(pan_dat, t)
+            try:
+                hashes = pd.util.hash_pandas_object(df, index=True)
+            except TypeError:
+                return None
+            rtn.append((tuple(df.columns), tuple(map(str, df.dtypes)), len(df),
+                        hashlib.sha1(hashes.values.tobytes()).hexdigest()))
+        return tuple(rtn)
+
     def find_data_row_failures(self, pan_dat, as_table=True, exception_handling="__debug__",
-                               max_failures=float("inf")):
+                               max_failures=float("inf"), sample=None, sample_seed=None, stats=None,
+                               order_by_stats=False, kwargs_cache=None):
         """
         Finds the data row failures for a ticdat object
 
@@ -1269,6 +1690,27 @@ class PanDatFactory(object):
         :param max_failures: number. An upper limit on the number of failures to find. Will short circuit and return
                                      ASAP with a partial failure enumeration when this number is reached.
 
+        :param sample: optional. Either a float fraction in (0, 1], or a positive int row count (so 1.0 is every
+                       row, and 1 is a single row). If provided, only a random sample of the rows of each
+                       table is checked, and a namedtuple is returned. See find_data_type_failures
+                       for details.
+
+        :param sample_seed: optional. The random seed for choosing the sample.
+
+        :param stats: optional. A dictionary that will be populated with statistics about each row predicate.
+                      The keys are (table, predicate name) pairs and the values are namedtuples with members
+                      "wall_time" (seconds), "calls", "failures" and "exceptions" (the exceptions handled as
+                      failures). Passing the same dictionary to subsequent calls accumulates the statistics.
+
+        :param order_by_stats: boolean. If truthy, the row predicates are evaluated in order of cost per failure,
+                               as measured by the stats argument (which is then required). Predicates that are
+                               cheap and fail often are evaluated first, which finds max_failures failures sooner.
+
+        :param kwargs_cache: optional. A dictionary used to remember the predicate_kwargs_maker results. Passing
+                             the same (initially empty) dictionary to subsequent calls will reuse these results
+                             so long as the contents of pan_dat haven't changed. The contents of this dictionary
+                             should be treated as opaque.
+
         :return: A dictionary constructed as follows:
 
         The keys are namedtuples with members "table", "predicate_name".
@@ -1285,7 +1727,24 @@ class PanDatFactory(object):
         with members "primary_key" and "error message". The former will be populated with '*' (indicating all the rows)
         and the latter will be a string describing the failure.
         """
+        if sample is not None:
+            msg = []
+            verify(self.good_pan_dat_object(pan_dat, msg.append),
+                   "pan_dat not a good object for this factory : %s"%"\n".join(msg))
+            sampled_dat, sample_sizes = self._sample_pan_dat(pan_dat, set(self._data_row_predicates).union(
+                                            ["parameters"] if self._parameters else []), sample, sample_seed)
+            return utils._sampled_failures(self._find_data_row_failures(pan_dat, sampled_dat, as_table,
+                                                                        exception_handling, max_failures,
+                                                                        stats, order_by_stats, kwargs_cache),
+                                           sample_sizes, _failure_count)
+        return self._find_data_row_failures(pan_dat, pan_dat, as_table, exception_handling, max_failures,
+                                            stats, order_by_stats, kwargs_cache)
+    def _find_data_row_failures(self, pan_dat, rows_dat, as_table, exception_handling, max_failures,
+                                stats=None, order_by_stats=False, kwargs_cache=None):
+        # the predicate_kwargs_maker functions are passed pan_dat, but only the rows of rows_dat are checked
         assert max_failures > 0, "max_failures should be a positive number"
+        utils._check_row_predicate_stats_args(stats, order_by_stats)
+        utils._check_kwargs_cache_arg(kwargs_cache)
         number_failures = [0]
         check_too_many_bool = check_too_many_msg = None
         if max_failures < float("inf"):
@@ -1328,12 +1787,62 @@ class PanDatFactory(object):
         TPN = clt.namedtuple("TablePredicateName", ["table", "predicate_name"])
         PKEM = clt.namedtuple("PrimaryKeyErrorMessage", ["primary_key", "error_message"])
         converted_dat = []
-        for tbl, row_predicates in data_row_predicates.items():
-            _table = getattr(pan_dat, tbl)
-            for pn, rpi in row_predicates.items():
-                uses_convert = self._convert_dat and (tbl, pn) in self._convert_dat[1]
-                predicate_kwargs = {}
-                if rpi.predicate_kwargs_maker:
+        stamp = []
+        def content_stamp():
+            if not stamp:
+                stamp.append(self._content_stamp(pan_dat))
+            return stamp[0]
+        predicate_order = [(tbl, pn) for tbl, row_predicates in data_row_predicates.items() for pn in row_predicates]
+        if order_by_stats:
+            predicate_order = utils._row_predicates_ordered_by_stats(predicate_order, stats)
+        # when every failure is to be found (and the time of each predicate isn't being measured) the row
+        # predicates of a table that aren't expressions are evaluated together, in a single pass over its rows
+        shared_pass = max_failures == float("inf") and stats is None
+        shared_pass_predicates = clt.defaultdict(list)
+        def shared_pass_function(predicate, predicate_kwargs, failure_response):
+            # returns a function of the row that returns True for a good row
+            if exception_handling == "Unhandled":
+                return lambda row: predicate(row, **predicate_kwargs)
+            if failure_response == "Boolean":
+                def _p(row):
+                    try:
+                        return predicate(row, **predicate_kwargs)
+                    except:
+                        return False
+                return _p
+            def _p(row):
+                try:
+                    return predicate(row, **predicate_kwargs)
+                except Exception as e:
+                    return f"Exception<{e}>"
+            return _p
+        def add_failures(tbl, pn, _table, where_bad_rows, predicate_result=None):
+            if _safe_any(where_bad_rows):
+                if as_table:
+                    rtn[TPN(tbl, pn)] = _df = _table[where_bad_rows].copy()
+                    if predicate_result is not None:
+                        err_column = "Error Message"
+                        _ = count(1)
+                        while err_column in _df.columns:
+                            err_column = f"Error Message ({next(_)})"
+                        _df[err_column] = predicate_result[where_bad_rows].copy()
+                else:
+                    rtn[TPN(tbl, pn)] = where_bad_rows
+        for tbl, pn in predicate_order:
+            _table, rpi = getattr(rows_dat, tbl), data_row_predicates[tbl][pn]
+            exceptions, calls = [0], [0]
+            def record_stats(where_bad_rows):
+                if stats is not None:
+                    utils._add_row_predicate_stats(stats, tbl, pn, time.perf_counter() - start, calls[0],
+                                                   int(where_bad_rows.sum()), exceptions[0])
+            def counted_predicate(row):
+                # once the trip wire of faster_df_apply is sprung, the remaining rows don't call the predicate
+                calls[0] += 1
+                return rpi.predicate(row, **predicate_kwargs)
+            uses_convert = self._convert_dat and (tbl, pn) in self._convert_dat[1]
+            predicate_kwargs = {}
+            if rpi.predicate_kwargs_maker:
+                def make_kwargs():
                     if uses_convert and not converted_dat:
                         if exception_handling == "Handled as Failure":
                             try:
@@ -1342,59 +1851,103 @@ class PanDatFactory(object):
                                 converted_dat.append(f"Exception<{e}>")
                         else:
                             converted_dat.append(self._convert_dat[0](pan_dat))
-                    if rpi.predicate_kwargs_maker not in predicate_kwargs_maker_results:
-                        __pan_dat = converted_dat[0] if uses_convert else pan_dat
-                        if uses_convert and isinstance(converted_dat[0], str):
-                            _predicate_kwargs = converted_dat[0]
-                        elif exception_handling == "Handled as Failure":
-                            try:
-                                _predicate_kwargs = rpi.predicate_kwargs_maker(__pan_dat)
-                            except Exception as e:
-                                _predicate_kwargs = f"Exception<{e}>"
-                        else:
-                            _predicate_kwargs = rpi.predicate_kwargs_maker(__pan_dat)
-                        predicate_kwargs_maker_results[rpi.predicate_kwargs_maker] = _predicate_kwargs
-                    predicate_kwargs = predicate_kwargs_maker_results[rpi.predicate_kwargs_maker]
-                if not isinstance(predicate_kwargs, dict):
-                    rtn[TPN(tbl, pn)] = PKEM('*', predicate_kwargs
-                                        if (isinstance(predicate_kwargs, str) and "Exception<" in predicate_kwargs)
-                                        else f"predicate_kwargs_maker failed to return a dict")
-                    number_failures[0] += 1
-                else:
-                    if rpi.predicate_failure_response == "Boolean":
-                        def _p(row):
-                            try:
-                                return rpi.predicate(row, **predicate_kwargs)
-                            except:
-                                return False
-                        bad_row = (lambda row: not rpi.predicate(row, **predicate_kwargs)) \
-                                  if exception_handling == "Unhandled" else (lambda row: not _p(row))
-
+                    __pan_dat = converted_dat[0] if uses_convert else pan_dat
+                    if uses_convert and isinstance(converted_dat[0], str):
+                        return converted_dat[0]
+                    if exception_handling == "Handled as Failure":
+                        try:
+                            return rpi.predicate_kwargs_maker(__pan_dat)
+                        except Exception as e:
+                            return f"Exception<{e}>"
+                    return rpi.predicate_kwargs_maker(__pan_dat)
+                if rpi.predicate_kwargs_maker not in predicate_kwargs_maker_results:
+                    predicate_kwargs_maker_results[rpi.predicate_kwargs_maker] = utils._cached_predicate_kwargs(
+                        kwargs_cache, content_stamp, (rpi.predicate_kwargs_maker, bool(uses_convert)), make_kwargs)
+                predicate_kwargs = predicate_kwargs_maker_results[rpi.predicate_kwargs_maker]
+            if not isinstance(predicate_kwargs, dict):
+                rtn[TPN(tbl, pn)] = PKEM('*', predicate_kwargs
+                                    if (isinstance(predicate_kwargs, str) and "Exception<" in predicate_kwargs)
+                                    else f"predicate_kwargs_maker failed to return a dict")
+                number_failures[0] += 1
+            else:
+                start = time.perf_counter()
+                if shared_pass and not isinstance(rpi.predicate, utils.RowPredicateExpression):
+                    shared_pass_predicates[tbl].append((pn, rpi.predicate_failure_response, shared_pass_function(
+                        rpi.predicate, predicate_kwargs, rpi.predicate_failure_response)))
+                elif rpi.predicate_failure_response == "Boolean":
+                    def _p(row):
+                        try:
+                            return counted_predicate(row)
+                        except:
+                            exceptions[0] += 1
+                            return False
+                    bad_row = (lambda row: not counted_predicate(row)) \
+                              if exception_handling == "Unhandled" else (lambda row: not _p(row))
+
+                    where_bad_rows = utils._expression_failures(rpi.predicate, _table,
+                                                                max_failures - number_failures[0])
+                    if where_bad_rows is None:
                         where_bad_rows = utils.faster_df_apply(_table, bad_row, trip_wire_check=check_too_many_bool)
-                        if _safe_any(where_bad_rows):
-                            rtn[TPN(tbl, pn)] = _table[where_bad_rows].copy() if as_table else where_bad_rows
                     else:
-                        def _p(row):
-                            try:
-                                return rpi.predicate(row, **predicate_kwargs)
-                            except Exception as e:
-                                return f"Exception<{e}>"
-                        predicate = (lambda row: rpi.predicate(row, **predicate_kwargs)) \
-                                    if exception_handling == "Unhandled" else (lambda row: _p(row))
-                        predicate_result = utils.faster_df_apply(_table, predicate, trip_wire_check=check_too_many_msg)
-                        where_bad_rows = predicate_result.apply(lambda x: x is not True)
-                        if _safe_any(where_bad_rows):
-                            if as_table:
-                                rtn[TPN(tbl, pn)] = _df = _table[where_bad_rows].copy()
-                                err_column = "Error Message"
-                                _ = count(1)
-                                while err_column in _df.columns:
-                                    err_column = f"Error Message ({next(_)})"
-                                _df[err_column] = predicate_result[where_bad_rows].copy()
-                            else:
-                                rtn[TPN(tbl, pn)] = where_bad_rows
-                if number_failures[0] >= max_failures:
-                    return rtn
+                        number_failures[0] += int(where_bad_rows.sum())
+                        calls[0] = len(_table) # the expression is evaluated for every row at once
+                    record_stats(where_bad_rows)
+                    add_failures(tbl, pn, _table, where_bad_rows)
+                else:
+                    def _p(row):
+                        try:
+                            return counted_predicate(row)
+                        except Exception as e:
+                            exceptions[0] += 1
+                            return f"Exception<{e}>"
+                    predicate = counted_predicate if exception_handling == "Unhandled" else _p
+                    predicate_result = utils.faster_df_apply(_table, predicate, trip_wire_check=check_too_many_msg)
+                    where_bad_rows = predicate_result.apply(lambda x: x is not True)
+                    record_stats(where_bad_rows)
+                    add_failures(tbl, pn, _table, where_bad_rows, predicate_result)
+            if number_failures[0] >= max_failures:
+                return rtn
+        for tbl, predicates in shared_pass_predicates.items():
+            _table = getattr(rows_dat, tbl)
+            cols, results = list(_table.columns), [[] for _ in predicates]
+            for row in _table.itertuples(index=False):
+                row_dict = {f:v for f,v in zip(cols, row)}
+                for result, (_, __, predicate) in zip(results, predicates):
+                    result.append(predicate(row_dict))
+            for result, (pn, failure_response, _) in zip(results, predicates):
+                where_bad_rows = pd.Series([_ is not True for _ in result] if failure_response != "Boolean" else
+                                           [not _ for _ in result], index=_table.index, dtype=bool)
+                add_failures(tbl, pn, _table, where_bad_rows, pd.Series(result, index=_table.index)
+                                                              if failure_response != "Boolean" else None)
+        if shared_pass_predicates:
+            # the failures are returned in the order of predicate_order, regardless of how they were found
+            rtn = {k: rtn[k] for k in (TPN(tbl, pn) for tbl, pn in predicate_order) if k in rtn}
+        return rtn
+    def find_aggregate_check_failures(self, pan_dat):
+        """
+        Finds the groups that fail the aggregate checks (see add_aggregate_check). Each check is evaluated with a
+        single groupby (and a merge with the parent table, if there is one).
+
+        :param pan_dat: pandat object
+
+        :return: A dictionary constructed as follows:
+
+        The keys are namedtuples with members "table", "check_name".
+
+        The values are DataFrames with the group_by fields and an "Aggregate Value" column, with a row for each
+        failing group.
+        """
+        msg = []
+        verify(self.good_pan_dat_object(pan_dat, msg.append),
+               "pan_dat not a good object for this factory : %s"%"\n".join(msg))
+        TCN = clt.namedtuple("TableCheckName", ["table", "check_name"])
+        rtn = {}
+        for tbl, checks in self._aggregate_checks.items():
+            for cn, ac in checks.items():
+                failures = ac.failures_df(getattr(pan_dat, tbl),
+                                          None if ac.parent_table is None else getattr(pan_dat, ac.parent_table))
+                if len(failures):
+                    rtn[TCN(tbl, cn)] = failures
         return rtn
     def find_foreign_key_failures(self, pan_dat, verbosity="High", as_table=True, max_failures=float("inf")):
         """
@@ -1438,7 +1991,8 @@ class PanDatFactory(object):
         if verbosity == "Low":
             rtn = {tuple(k[:2]) + (tuple(k[2]),): v for k,v in rtn.items()}
         return rtn
-    def _find_foreign_key_failure_rows(self, pan_dat, max_failures=float("inf")):
+    def _find_foreign_key_failure_rows(self, pan_dat, max_failures=float("inf"), child_tables=None):
+        # child_tables, if provided, maps each foreign key to be checked to the native table rows to check
         msg  = []
         verify(self.good_pan_dat_object(pan_dat, msg.append),
                "pan_dat not a good object for this factory : %s"%"\n".join(msg))
@@ -1453,8 +2007,10 @@ class PanDatFactory(object):
 
         rtn = {}
         for fk in self.foreign_keys:
+            if child_tables is not None and fk not in child_tables:
+                continue
             native, foreign, mappings, card = fk
-            child = getattr(pan_dat, native).copy(deep=True)
+            child = (getattr(pan_dat, native) if child_tables is None else child_tables[fk]).copy(deep=True)
             # makes sense to deep copy the possibly smaller drop_duplicates slice of the parent table
             parent = getattr(pan_dat, foreign)
             _ = 0
@@ -8,7 +8,8 @@ import uuid
 import os
 from ticdat.utils import freezable_factory, verify, case_space_to_pretty, pd, TicDatError, FrozenDict, all_fields
 from ticdat.utils import all_underscore_replacements, stringish, dictish, containerish, debug_break, faster_df_apply
-from ticdat.utils import safe_apply
+from ticdat.utils import safe_apply, lupish
+import ticdat.utils as utils
 from itertools import product, chain
 from collections import defaultdict
 import datetime
@@ -18,6 +19,10 @@ try:
     import numpy
 except:
     numpy = None
+try:
+    import xlsxwriter
+except:
+    xlsxwriter = None
 
 _longest_sheet = 30 # seems to be an Excel limit with pandas
 
@@ -34,9 +39,24 @@ class _DummyContextManager(object):
     def __exit__(self, *excinfo) :
         pass
 
-def _clean_pandat_creator(pdf, df_dict, push_parameters_to_be_valid=True, json_read=False):
+def _schema_columns(pdf, t):
+    # a usecols argument for the pandas readers that skips the columns outside of the schema (None for generic tables)
+    if t not in pdf.generic_tables:
+        fields = set(all_fields(pdf, t))
+        return lambda c: c in fields
+
+def _xlsx_cell(x):
+    # the cell adjustment of DataFrame.to_excel - missing values are left blank and infinity is written as text
+    if pd.api.types.is_scalar(x) and pd.isnull(x):
+        return None
+    if isinstance(x, float) and x in (float("inf"), -float("inf")):
+        return "inf" if x > 0 else "-inf"
+    return x
+
+def _clean_pandat_creator(pdf, df_dict, push_parameters_to_be_valid=True, json_read=False, post_read_adjusted=False):
     # note that pandas built in IO routines tend to be a bit overy pushy with the typing, hence
-    # the push_parameters_to_be_valid argument
+    # the push_parameters_to_be_valid argument. post_read_adjusted indicates the tables of df_dict have already
+    # been passed through _post_read_table_adjustment (as is done for chunked reads)
     pandat = pdf.PanDat(**df_dict)
     for t in set(pdf.all_tables).difference(pdf.generic_tables):
         flds = [f for f in chain(pdf.primary_key_fields[t], pdf.data_fields[t])]
@@ -44,6 +64,8 @@ def _clean_pandat_creator(pdf, df_dict, push_parameters_to_be_valid=True, json_r
     missing_tables = '\n'.join(sorted({t for t in pdf.all_tables if not len(getattr(pandat, t))}))
     msg = []
     assert pdf.good_pan_dat_object(pandat, msg.append), str(msg)
+    if post_read_adjusted:
+        return pandat
     return pdf._general_post_read_adjustment(pandat, json_read=json_read,
                                              push_parameters_to_be_valid=push_parameters_to_be_valid)
 
@@ -72,12 +94,14 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
         Create a PanDat object from a JSON file or string
 
         :param path_or_buf:  a valid JSON string or file-like
+                             A path ending in .gz, .bz2, .xz or .zst is decompressed as it is read.
 
         :param fill_missing_fields: boolean. If truthy, missing fields will be filled in
                                     with their default value. Otherwise, missing fields
                                     throw an Exception. Doesn't work with list-of-lists format.
 
         :param orient: Indication of expected JSON string format. See pandas.read_json for more details.
+                       For the "split" orient, columns that don't match schema fields are removed before parsing.
 
         :param kwargs: additional named arguments to pass to pandas.read_json
 
@@ -97,7 +121,7 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
         """
         if safe_apply(os.path.exists)(path_or_buf):
             verify(os.path.isfile(path_or_buf), "%s appears to be a directory and not a file." % path_or_buf)
-            with open(path_or_buf, "r") as f:
+            with utils._open_file(path_or_buf, "r") as f:
                 loaded_dict = json.load(f)
         else:
             verify(stringish(path_or_buf), "%s isn't a string" % path_or_buf)
@@ -119,7 +143,8 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
                 kwargs_ = dict(kwargs)
                 if "dtype" not in kwargs_:
                     kwargs_["dtype"] = self.pan_dat_factory._dtypes_for_pandas_read(t)
-                rtn[t] = pd.read_json(StringIO(json.dumps(loaded_dict[f])), orient=orient, **kwargs_)
+                table_dict = self._schema_columns_only(t, loaded_dict[f]) if orient == "split" else loaded_dict[f]
+                rtn[t] = pd.read_json(StringIO(json.dumps(table_dict)), orient=orient, **kwargs_)
             missing_fields = {(t, f) for t in rtn for f in all_fields(self.pan_dat_factory, t)
                               if f not in rtn[t].columns}
             if fill_missing_fields:
@@ -135,6 +160,16 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
                   "\n".join(missing_tables))
         return _clean_pandat_creator(self.pan_dat_factory, rtn, json_read=True)
 
+    def _schema_columns_only(self, t, split_dict):
+        # for the "split" orient, removes the columns that don't match schema fields prior to pandas.read_json
+        keep = _schema_columns(self.pan_dat_factory, t)
+        if not (keep and lupish(split_dict.get("columns")) and lupish(split_dict.get("data"))):
+            return split_dict
+        positions = [i for i, c in enumerate(split_dict["columns"]) if keep(c)]
+        if len(positions) == len(split_dict["columns"]):
+            return split_dict
+        return dict(split_dict, columns=[split_dict["columns"][i] for i in positions],
+                    data=[[row[i] for i in positions] for row in split_dict["data"]])
     def _get_table_names(self, loaded_dict):
         rtn = {}
         for table in self.pan_dat_factory.all_tables:
@@ -153,7 +188,7 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
         :param pan_dat: the PanDat object to write
 
         :param json_file_path: the json file into which the data is to be written. If falsey, will return a
-                               JSON string
+                               JSON string. A path ending in .gz, .bz2, .xz or .zst is compressed as it is written.
 
         :return: A JSON string if json_file_path is falsey, otherwise None
         """
@@ -176,7 +211,7 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
             faster_df_apply(getattr(pan_dat, t), append_row_list)
         if not json_file_path:
             return json.dumps(jdict, sort_keys=True, indent=2)
-        with open(json_file_path, "w") as fp:
+        with utils._open_file(json_file_path, "w") as fp:
             json.dump(jdict, fp, sort_keys=True, indent=2)
 
     def write_file_pd(self, pan_dat, json_file_path, case_space_table_names=False, orient='split',
@@ -190,7 +225,7 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
         :param pan_dat: the PanDat object to write
 
         :param json_file_path: the json file into which the data is to be written. If falsey, will return a
-                               JSON  string
+                               JSON  string. A path ending in .gz, .bz2, .xz or .zst is compressed as it is written.
 
         :param case_space_table_names: boolean - make best guesses how to add spaces and upper case
                                        characters to table names
@@ -247,7 +282,7 @@ class JsonPanFactory(freezable_factory(object, "_isFrozen")):
             if orient == 'split' and not index:
                 rtn[k].pop("index", None)
         if json_file_path:
-            with open(json_file_path, "w") as f:
+            with utils._open_file(json_file_path, "w") as f:
                 json.dump(rtn, f, indent=indent, sort_keys=sort_keys)
         else:
             return json.dumps(rtn, indent=indent, sort_keys=sort_keys)
@@ -271,17 +306,28 @@ class CsvPanFactory(freezable_factory(object, "_isFrozen")):
         """
         self.pan_dat_factory = pan_dat_factory
         self._isFrozen = True
-    def create_pan_dat(self, dir_path, fill_missing_fields=False, **kwargs):
+    def create_pan_dat(self, dir_path, fill_missing_fields=False, max_workers=None, chunksize=None, **kwargs):
         """
         Create a PanDat object from a directory of csv files.
 
-        :param db_file_path: the directory containing the .csv files.
+        :param db_file_path: the directory containing the .csv files. Files ending in .csv.gz, .csv.bz2, .csv.xz
+                             or .csv.zst are decompressed as they are read.
 
         :param fill_missing_fields: boolean. If truthy, missing fields will be filled in
                                     with their default value. Otherwise, missing fields
                                     throw an Exception.
 
-        :param kwargs: additional named arguments to pass to pandas.read_csv
+        :param max_workers: optional. If provided, the files are read concurrently by a pool of this many threads.
+                            (The default C engine of pandas.read_csv releases the GIL while parsing).
+
+        :param chunksize: optional. If provided, each file is read this many rows at a time. Each chunk is reduced
+                          to the schema fields and adjusted (i.e. the infinity_io_flag, datetime and parameters
+                          processing) before the chunks of a table are concatenated. This lowers the peak memory
+                          of reading a large file. See create_table_chunks to process chunks without
+                          concatenating them.
+
+        :param kwargs: additional named arguments to pass to pandas.read_csv. Unless usecols (or index_col) is
+                       specified, only the columns that match schema fields are read.
 
         :return: a PanDat object populated by the matching tables.
 
@@ -303,12 +349,13 @@ class CsvPanFactory(freezable_factory(object, "_isFrozen")):
         """
         verify(os.path.isdir(dir_path), "%s not a directory path"%dir_path)
         tbl_names = self._get_table_names(dir_path)
-        rtn = {}
-        for t, f in tbl_names.items():
-            kwargs_ = dict(kwargs)
-            if "dtype" not in kwargs_:
-                kwargs_["dtype"] = self.pan_dat_factory._dtypes_for_pandas_read(t)
-            rtn[t] = pd.read_csv(f, **kwargs_)
+        verify(chunksize is None or self._good_chunksize(chunksize), "chunksize should be a positive integer")
+        def read_table(t):
+            if chunksize is None:
+                return pd.read_csv(tbl_names[t], **self._read_csv_kwargs(t, kwargs))
+            return pd.concat(list(self._adjusted_chunks(t, tbl_names[t], chunksize, fill_missing_fields, kwargs)),
+                             ignore_index=True)
+        rtn = utils._map_tables(read_table, tbl_names, max_workers)
         missing_tables = {t for t in self.pan_dat_factory.all_tables if t not in rtn}
         if missing_tables:
             print ("The following table names could not be found in the %s directory.\n%s\n"%
@@ -323,21 +370,76 @@ class CsvPanFactory(freezable_factory(object, "_isFrozen")):
         verify(not missing_fields,
                "The following (table, file_name, field) triplets are missing fields.\n%s" %
                [(t, os.path.basename(tbl_names[t]), f) for t,f in missing_fields])
-        return _clean_pandat_creator(self.pan_dat_factory, rtn)
+        return _clean_pandat_creator(self.pan_dat_factory, rtn, post_read_adjusted=chunksize is not None)
+    def create_table_chunks(self, dir_path, chunksize, fill_missing_fields=False, **kwargs):
+        """
+        Read a directory of csv files a chunk of rows at a time, for processing data that is too large to fit
+        into memory.
+
+        :param dir_path: the directory containing the .csv files.
+
+        :param chunksize: the (positive integer) number of rows in each chunk
+
+        :param fill_missing_fields: see create_pan_dat
+
+        :param kwargs: additional named arguments to pass to pandas.read_csv
+
+        :return: a generator of (table name, DataFrame) pairs. Each DataFrame holds up to chunksize rows of
+                 the table, reduced to the schema fields and adjusted just as create_pan_dat would adjust them.
+                 The tables are read one at a time, in the order of all_tables. Tables that can't be found in
+                 dir_path are skipped.
+
+        caveats: Since each chunk is only a part of its table, checks that span rows (such as find_duplicates)
+                 won't give meaningful results for individual chunks.
+        """
+        verify(os.path.isdir(dir_path), "%s not a directory path"%dir_path)
+        verify(self._good_chunksize(chunksize), "chunksize should be a positive integer")
+        tbl_names = self._get_table_names(dir_path)
+        for t in self.pan_dat_factory.all_tables:
+            if t in tbl_names:
+                for chunk in self._adjusted_chunks(t, tbl_names[t], chunksize, fill_missing_fields, kwargs):
+                    yield t, chunk
+    @staticmethod
+    def _good_chunksize(chunksize):
+        return utils.numericish(chunksize) and int(chunksize) == chunksize > 0
+    def _read_csv_kwargs(self, t, kwargs):
+        rtn = dict(kwargs)
+        if "dtype" not in rtn:
+            rtn["dtype"] = self.pan_dat_factory._dtypes_for_pandas_read(t)
+        if not {"usecols", "index_col"}.intersection(rtn) and _schema_columns(self.pan_dat_factory, t):
+            rtn["usecols"] = _schema_columns(self.pan_dat_factory, t)
+        return rtn
+    def _adjusted_chunks(self, t, file_path, chunksize, fill_missing_fields, kwargs):
+        pdf = self.pan_dat_factory
+        fields = list(all_fields(pdf, t))
+        with pd.read_csv(file_path, chunksize=int(chunksize), **self._read_csv_kwargs(t, kwargs)) as reader:
+            for chunk in reader:
+                missing_fields = [f for f in fields if f not in chunk.columns]
+                if fill_missing_fields:
+                    for f in [_ for _ in missing_fields if _ in pdf.default_values.get(t, {})]:
+                        chunk[f] = pdf.default_values[t][f]
+                        missing_fields.remove(f)
+                verify(not missing_fields,
+                       "The following (table, file_name, field) triplets are missing fields.\n%s" %
+                       [(t, os.path.basename(file_path), f) for f in missing_fields])
+                if t not in pdf.generic_tables:
+                    chunk = chunk[fields].copy()
+                yield pdf._post_read_table_adjustment(t, chunk, push_parameters_to_be_valid=True)
 
     def _get_table_names(self, dir_path):
         rtn = {}
         for table in self.pan_dat_factory.all_tables:
             rtn[table] = [path for f in os.listdir(dir_path) for path in [os.path.join(dir_path, f)]
                           if os.path.isfile(path) and
-                          f.lower().replace(" ", "_") == "%s.csv"%table.lower()]
+                          utils._uncompressed_name(f).lower().replace(" ", "_") == "%s.csv"%table.lower()]
             verify(len(rtn[table]) <= 1, "Multiple possible csv files found for table %s" % table)
             if len(rtn[table]) == 1:
                 rtn[table] = rtn[table][0]
             else:
                 rtn.pop(table)
         return rtn
-    def write_directory(self, pan_dat, dir_path, case_space_table_names=False, index=False, **kwargs):
+    def write_directory(self, pan_dat, dir_path, case_space_table_names=False, index=False, max_workers=None,
+                        **kwargs):
         """
         write the PanDat data to a collection of csv files
 
@@ -351,6 +453,9 @@ class CsvPanFactory(freezable_factory(object, "_isFrozen")):
 
         :param index: boolean - whether or not to write the index.
 
+        :param max_workers: optional. If provided, the files are written concurrently by a pool of this many
+                            threads.
+
         :param kwargs: additional named arguments to pass to pandas.to_csv
 
         :return:
@@ -369,9 +474,10 @@ class CsvPanFactory(freezable_factory(object, "_isFrozen")):
                                  len(set(map(case_space_to_pretty, self.pan_dat_factory.all_tables)))
         if not os.path.isdir(dir_path) :
             os.mkdir(dir_path)
-        for t in self.pan_dat_factory.all_tables :
+        def write_table(t):
             f = os.path.join(dir_path, (case_space_to_pretty(t) if case_space_table_names else t) + ".csv")
             getattr(pan_dat, t).to_csv(f, **kwargs)
+        utils._map_tables(write_table, self.pan_dat_factory.all_tables, max_workers)
 
 class SqlPanFactory(freezable_factory(object, "_isFrozen")):
     """
@@ -403,7 +509,8 @@ class SqlPanFactory(freezable_factory(object, "_isFrozen")):
                                     with their default value. Otherwise, missing fields
                                     throw an Exception.
 
-        :return: a PanDat object populated by the matching tables.
+        :return: a PanDat object populated by the matching tables. Only the columns that match schema fields are
+                 selected.
 
         caveats: Missing tables always resolve to an empty table, but missing fields on matching tables throw
                  an exception (unless fill_missing_fields is truthy).
@@ -422,7 +529,7 @@ class SqlPanFactory(freezable_factory(object, "_isFrozen")):
         with con_maker() as _:
             con_ = con or _
             for t, s in self._get_table_names(con_).items():
-                rtn[t] = pd.read_sql(sql="Select * from [%s]"%s, con=con_)
+                rtn[t] = pd.read_sql(sql="Select %s from [%s]"%(self._select_list(con_, t, s), s), con=con_)
         missing_fields = {(t, f) for t in rtn for f in all_fields(self.pan_dat_factory, t)
                           if f not in rtn[t].columns}
         if fill_missing_fields:
@@ -438,6 +545,16 @@ class SqlPanFactory(freezable_factory(object, "_isFrozen")):
                   "\n".join(missing_tables))
         return _clean_pandat_creator(self.pan_dat_factory, rtn)
 
+    def _select_list(self, con, t, s):
+        # selects just the columns that match schema fields, so as to not read columns that will be dropped
+        if t in self.pan_dat_factory.generic_tables:
+            return "*"
+        description = con.execute("Select * from [%s] limit 0"%s).description
+        columns = [_[0] for _ in description or ()]
+        selected = [f for f in all_fields(self.pan_dat_factory, t) if f in columns]
+        if not selected or len(selected) == len(columns):
+            return "*"
+        return ", ".join("[%s]"%f for f in selected)
     def _get_table_names(self, con):
         rtn = {}
         def try_name(name):
@@ -529,7 +646,8 @@ class XlsPanFactory(freezable_factory(object, "_isFrozen")):
                                     with their default value. Otherwise, missing fields
                                     throw an Exception.
 
-        :return: a PanDat object populated by the matching sheets.
+        :return: a PanDat object populated by the matching sheets. Only the columns that match schema fields are
+                 read.
 
         caveats: Missing sheets resolve to an empty table, but missing fields
                  on matching sheets throw an Exception (unless fill_missing_fields is truthy).
@@ -555,7 +673,8 @@ class XlsPanFactory(freezable_factory(object, "_isFrozen")):
         except Exception as e:
             raise TicDatError("Unable to open %s as xls file : %s"%(xls_file_path, e))
         for t, s in self._get_sheet_names(xl).items():
-            rtn[t] = pd.read_excel(xl, s, dtype=self.pan_dat_factory._dtypes_for_pandas_read(t))
+            rtn[t] = pd.read_excel(xl, s, dtype=self.pan_dat_factory._dtypes_for_pandas_read(t),
+                                   usecols=_schema_columns(self.pan_dat_factory, t))
         missing_tables = {t for t in self.pan_dat_factory.all_tables if t not in rtn}
         if missing_tables:
             print ("The following table names could not be found in the %s file.\n%s\n"%
@@ -608,6 +727,8 @@ class XlsPanFactory(freezable_factory(object, "_isFrozen")):
         :return:
 
         caveats: The row names (index) isn't written.
+                 If xlsxwriter is installed, .xlsx files are written row by row in constant_memory mode,
+                 so that memory use doesn't grow with the size of the tables.
         """
         self._verify_differentiable_sheet_names()
         msg = []
@@ -618,8 +739,32 @@ class XlsPanFactory(freezable_factory(object, "_isFrozen")):
         case_space_sheet_names = case_space_sheet_names and \
                                  len(set(self.pan_dat_factory.all_tables)) == \
                                  len(set(map(case_space_to_pretty, self.pan_dat_factory.all_tables)))
+        sheet_name = lambda t: (case_space_to_pretty(t) if case_space_sheet_names else t)[:_longest_sheet]
+        if xlsxwriter and file_path.endswith(".xlsx"):
+            return self._xlsx_write(pan_dat, file_path, sheet_name)
         with pd.ExcelWriter(file_path) as writer:
             for t in self.pan_dat_factory.all_tables:
-                getattr(pan_dat, t).to_excel \
-                    (writer, sheet_name=(case_space_to_pretty(t) if case_space_sheet_names else t)[:_longest_sheet],
-                     index=False)
+                getattr(pan_dat, t).to_excel(writer, sheet_name=sheet_name(t), index=False)
+    def _xlsx_write(self, pan_dat, file_path, sheet_name):
+        # DataFrame.to_excel writes column by column, which constant_memory mode can't accommodate (each row is
+        # flushed to disk once the next row is started). Instead, write each table row by row, with the header
+        # and date formatting that to_excel would use.
+        book = xlsxwriter.Workbook(file_path, {"constant_memory": True,
+                                               "default_date_format": "YYYY-MM-DD HH:MM:SS"})
+        header_format = book.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        try:
+            for t in self.pan_dat_factory.all_tables:
+                df = getattr(pan_dat, t)
+                sheet = book.add_worksheet(sheet_name(t))
+                sheet.write_row(0, 0, tuple(df.columns), header_format)
+                # integer and boolean columns never need the _xlsx_cell adjustment
+                clean = [i for i, dt in enumerate(df.dtypes)
+                         if not (isinstance(dt, numpy.dtype) and dt.kind in "iub")]
+                for row_ind, row in enumerate(df.itertuples(index=False, name=None)):
+                    if clean:
+                        row = list(row)
+                        for i in clean:
+                            row[i] = _xlsx_cell(row[i])
+                    sheet.write_row(row_ind + 1, 0, row)
+        finally:
+            book.close()
@@ -2,10 +2,10 @@
 Read/write ticDat objects from PostGres database. Requires the sqlalchemy module
 """
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import math
-from ticdat.utils import freezable_factory, TicDatError, verify, stringish, FrozenDict, find_duplicates
-from ticdat.utils import create_duplicate_focused_tdf, dictish, numericish, safe_apply
+from ticdat.utils import freezable_factory, TicDatError, verify, stringish, FrozenDict, RowPredicateExpression
+from ticdat.utils import dictish, numericish, safe_apply
 try:
     import sqlalchemy as sa
     saxt = sa.text
@@ -276,7 +276,6 @@ class PostgresTicFactory(_PostgresFactory):
 
         :return:
         """
-        self._duplicate_focused_tdf = create_duplicate_focused_tdf(tic_dat_factory)
         super().__init__(tic_dat_factory)
 
     def _read_data_cell(self, t, f, x):
@@ -370,22 +369,131 @@ class PostgresTicFactory(_PostgresFactory):
                  Row counts smaller than 2 are pruned off, as they aren't duplicates
         """
         verify(sa, "sqlalchemy needs to be installed to use this subroutine")
+        verify(_pg_name(active_fld) ==  active_fld, "active_fld needs to be compliant with PG naming conventions")
         self._check_good_pgtd_compatible_table_field_names()
-        if not self._duplicate_focused_tdf:
+        tdf = self.tdf
+        pk_tables = [t for t,_ in tdf.primary_key_fields.items() if _]
+        if not pk_tables:
             return {}
+        active_fld_tables = _active_fld_tables(engine, schema, active_fld) if active_fld else set()
+        missing_tables = self.check_tables_fields(engine, schema)
+        rtn = {}
+        for table in set(pk_tables).difference(missing_tables):
+            pkfs = tdf.primary_key_fields[table]
+            pk_sql = ', '.join(map(_pg_name, pkfs))
+            # the counting is pushed down to postgres, so only the duplicated keys come back
+            counts = defaultdict(int)
+            for row in engine.execute(saxt(f"Select {pk_sql}, count(*) from {schema}.{table}" +
+                                           (f" where {active_fld} is True" if table in active_fld_tables else "") +
+                                           f" group by {pk_sql} having count(*) > 1")):
+                pk = tuple(self._read_data_cell(table, f, x) for f, x in zip(pkfs, row[:-1]))
+                counts[pk[0] if len(pk) == 1 else pk] += row[-1]
+            if counts:
+                rtn[table] = dict(counts)
+        return rtn
 
-        return find_duplicates(PostgresTicFactory(self._duplicate_focused_tdf).create_tic_dat(
-                                engine, schema, active_fld=active_fld), self._duplicate_focused_tdf)
+    def find_data_row_failures(self, engine, schema, max_failures=float("inf"), active_fld=""):
+        """
+        Finds the data row failures for the row predicates that are expression strings (see
+        TicDatFactory.add_data_row_predicate). The failing rows are selected by postgres with a WHERE NOT (...) clause,
+        so only their primary keys are read from the database.
+
+        :param engine: has an .execute method. LEGACY NAME. With modern sqlalchemy, pass a connection
 
+        :param schema: Name of the schema within the engine's database to use
+
+        :param max_failures: number. An upper limit on the number of failures to find.
 
-    def _get_data(self, tic_dat, schema, active_fld, active_fld_tables, dump_format="list"):
+        :param active_fld: if provided, a string for a boolean filter field.
+                           Must be compliant w PG naming conventions, which are different from ticdat field naming
+                           conventions. Typically developer can ignore this argument, designed for expert support.
+
+        :return: A dictionary constructed as for TicDatFactory.find_data_row_failures.
+
+        caveats : Row predicates that aren't expression strings can't be evaluated by postgres, and are not checked
+                  (use TicDatFactory.find_data_row_failures on the result of create_tic_dat for those).
+                  The expressions are evaluated on the values as they are stored in the database.
+        """
+        verify(sa, "sqlalchemy needs to be installed to use this subroutine")
+        verify(_pg_name(active_fld) ==  active_fld, "active_fld needs to be compliant with PG naming conventions")
+        assert max_failures > 0, "max_failures should be a positive number"
+        self._check_good_pgtd_compatible_table_field_names()
+        tdf = self.tdf
+        expressions = [(t, pn, rpi.predicate) for t, rpis in tdf._data_row_predicates.items()
+                       for pn, rpi in rpis.items() if isinstance(rpi.predicate, RowPredicateExpression)]
+        if not expressions:
+            return {}
+        active_fld_tables = _active_fld_tables(engine, schema, active_fld) if active_fld else set()
+        missing_tables = self.check_tables_fields(engine, schema)
+        TPN = namedtuple("TablePredicateName", ["table", "predicate_name"])
+        rtn, found = {}, 0
+        for table, pn, predicate in expressions:
+            if table in missing_tables or found >= max_failures:
+                continue
+            pkfs = tdf.primary_key_fields.get(table, ())
+            # the rows of a table without a primary key are identified by their position
+            source = f"Select {'' if pkfs else 'row_number() over () - 1 as _position, '}* from {schema}.{table}" + \
+                     (f" where {active_fld} is True" if table in active_fld_tables else "")
+            condition = predicate.sql({f: _pg_name(f) for f in pkfs + tdf.data_fields.get(table, ())})
+            limit = f" limit {math.ceil(max_failures - found)}" if max_failures < float("inf") else ""
+            query = f"Select {', '.join(map(_pg_name, pkfs)) or '_position'} from ({source}) as t " \
+                    f"where not ({condition}){limit}"
+            failures = []
+            for row in engine.execute(saxt(query.replace(":", "\\:"))): # string constants aren't bind parameters
+                pk = tuple(self._read_data_cell(table, f, x) for f, x in zip(pkfs, row)) if pkfs else tuple(row)
+                failures.append(pk[0] if len(pk) == 1 else pk)
+            if failures:
+                rtn[TPN(table, pn)] = tuple(failures)
+                found += len(failures)
+        return rtn
+
+    def find_aggregate_check_failures(self, engine, schema):
+        """
+        Finds the groups that fail the aggregate checks (see TicDatFactory.add_aggregate_check). The grouping,
+        aggregation and comparison are pushed down to postgres, so only the failing groups are read from the database.
+
+        :param engine: has an .execute method. LEGACY NAME. With modern sqlalchemy, pass a connection
+
+        :param schema: Name of the schema within the engine's database to use
+
+        :return: A dictionary constructed as for TicDatFactory.find_aggregate_check_failures.
+        """
+        verify(sa, "sqlalchemy needs to be installed to use this subroutine")
+        self._check_good_pgtd_compatible_table_field_names()
+        tdf = self.tdf
+        checks = [(t, cn, ac) for t, acs in tdf._aggregate_checks.items() for cn, ac in acs.items()]
+        if not checks:
+            return {}
+        missing_tables = set(self.check_tables_fields(engine, schema)).intersection(
+            t for _, _, ac in checks for t in [ac.child_table, ac.parent_table])
+        verify(not missing_tables, "The following tables could not be found in the %s schema\n%s"%
+               (schema, "\n".join(sorted(missing_tables))))
+        field_names = {f: _pg_name(f) for t in tdf.all_tables
+                       for f in tdf.primary_key_fields.get(t, ()) + tdf.data_fields.get(t, ())}
+        TCN = namedtuple("TableCheckName", ["table", "check_name"])
+        rtn = {}
+        for table, cn, ac in checks:
+            failures = []
+            for row in engine.execute(saxt(ac.sql(field_names=field_names, schema=schema).replace(":", "\\:"))):
+                group = tuple(self._read_data_cell(table, f, x) for f, x in zip(ac.group_by, row[:-1]))
+                failures.append(group[0] if len(group) == 1 else group)
+            if failures:
+                rtn[TCN(table, cn)] = tuple(failures)
+        return rtn
+
+
+    def _get_data(self, tic_dat, schema, active_fld, active_fld_tables, dump_format="list", keys=None):
         """This function creates sql for writing data to postgres"""
+        # keys, if provided, restricts the rows to the tables it maps to primary key containers (or None for all)
         assert dump_format in ["list", "dict"]
         rtn = [] if dump_format == "list" else defaultdict(list)
         for t in self._ordered_tables():
+            if keys is not None and t not in keys:
+                continue
             _t = getattr(tic_dat, t)
             primarykeys = tuple(self.tdf.primary_key_fields.get(t, ()))
-            for the_data in (_t.items() if primarykeys else _t):
+            for the_data in ((_t.items() if keys is None or keys[t] is None else ((k, _t[k]) for k in keys[t]))
+                             if primarykeys else _t):
                 if primarykeys:
                     pkrow, sqldatarow = the_data
                     # sqldatarow will always yield keys, values in TicDatFactory defined order
@@ -409,7 +517,8 @@ class PostgresTicFactory(_PostgresFactory):
                     rtn[str].append(datarow)
         return tuple(rtn) if dump_format == "list" else dict(rtn)
 
-    def write_data(self, tic_dat, engine, schema, dsn=None, pre_existing_rows=None, active_fld=""):
+    def write_data(self, tic_dat, engine, schema, dsn=None, pre_existing_rows=None, active_fld="",
+                   changes_since=None):
         """
         write the ticDat data to a PostGres database
 
@@ -429,6 +538,11 @@ class PostgresTicFactory(_PostgresFactory):
         :param active_fld: if provided, a string for a boolean filter field which will be populated with True.
                            Must be compliant w PG naming conventions, which are different from ticdat field naming
                            conventions. Typically developer can ignore this argument, designed for expert support.
+
+        :param changes_since: optional. A checkpoint token from TicDatFactory.track_changes. If provided, then the
+                              schema is assumed to already hold the tic_dat data as of that checkpoint, and only the
+                              rows edited since then are deleted, updated or inserted. Inconsistent with
+                              pre_existing_rows and dsn.
         :return:
         """
         verify(sa, "sqalchemy needs to be installed to use this subroutine")
@@ -446,6 +560,9 @@ class PostgresTicFactory(_PostgresFactory):
         verify(not self.tdf.generic_tables,
                "TicDat for postgres does not yet support generic tables")
         self.check_tables_fields(engine, schema, error_on_missing_table=True) # call self.write_schema as needed
+        if changes_since is not None:
+            verify(not (dsn or pre_existing_rows), "changes_since is inconsistent with dsn and pre_existing_rows")
+            return self._write_data_changes(tic_dat, engine, schema, active_fld, active_f_tables, changes_since)
         self._handle_prexisting_rows(engine, schema, pre_existing_rows or {})
         if dsn:
             connect_kwargs = dsn if dsn and dictish(dsn) else {}
@@ -463,6 +580,37 @@ class PostgresTicFactory(_PostgresFactory):
         engine.commit() if hasattr(engine, "commit") else None
 
 
+    def _write_data_changes(self, tic_dat, engine, schema, active_fld, active_fld_tables, changes_since):
+        changes = self.tdf.changes_since(tic_dat, changes_since)
+        active_where = lambda t: f" and {active_fld} is True" if t in active_fld_tables else ""
+        pk_where = lambda t: " and ".join(f"{_pg_name(f)} is not distinct from :{_pg_name(f)}"
+                                          for f in self.tdf.primary_key_fields[t])
+        def key_dict(t, k):
+            pks = self.tdf.primary_key_fields[t]
+            return {_pg_name(f): self._write_data_cell(t, f, x) for f, x in zip(pks, k if len(pks) > 1 else (k,))}
+        # deletes go from the children upwards, so as to not break foreign keys
+        for t in reversed(self._ordered_tables()):
+            if t not in changes:
+                continue
+            if not self.tdf.primary_key_fields.get(t): # no keys to go on, so the whole table is rewritten
+                engine.execute(saxt(f"DELETE FROM {schema}.{t} WHERE True" + active_where(t)))
+                continue
+            for k in changes[t].deleted:
+                engine.execute(saxt(f"DELETE FROM {schema}.{t} WHERE {pk_where(t)}" + active_where(t)),
+                               key_dict(t, k))
+        # updates are done in place, so that the child rows referencing the updated rows aren't disturbed
+        for t, changed in changes.items():
+            if changed.updated and self.tdf.data_fields.get(t):
+                set_str = ", ".join(f"{_pg_name(f)} = :{_pg_name(f)}" for f in self.tdf.data_fields[t])
+                for k in changed.updated:
+                    engine.execute(saxt(f"UPDATE {schema}.{t} SET {set_str} WHERE {pk_where(t)}" + active_where(t)),
+                                   dict(key_dict(t, k), **{_pg_name(f): self._write_data_cell(t, f, x)
+                                                           for f, x in getattr(tic_dat, t)[k].items()}))
+        keys = {t: changed.inserted for t, changed in changes.items()}
+        for sql_str, data in self._get_data(tic_dat, schema, active_fld, active_fld_tables, keys=keys):
+            engine.execute(saxt(sql_str), data)
+        engine.commit() if hasattr(engine, "commit") else None
+
 class PostgresPanFactory(_PostgresFactory):
     """
     Primary class for reading/writing PostGres databases with PanDat objects.
@@ -3,11 +3,13 @@ Read/write ticDat objects from SQLite files. Requires the sqlite3 module
 PEP8
 """
 import os
-from collections import defaultdict
+import ticdat.utils as utils
+from collections import defaultdict, namedtuple
 from ticdat.utils import freezable_factory, TicDatError, verify, stringish, dictish, containerish, numericish
-from ticdat.utils import FrozenDict, all_underscore_replacements, find_duplicates
-from ticdat.utils import create_duplicate_focused_tdf, create_generic_free, safe_apply
+from ticdat.utils import FrozenDict, all_underscore_replacements
+from ticdat.utils import create_generic_free, safe_apply
 import datetime
+import math
 try:
     import sqlite3 as sql
 except:
@@ -65,7 +67,6 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
         :return:
         """
         self.tic_dat_factory = tic_dat_factory
-        self._duplicate_focused_tdf = create_duplicate_focused_tdf(tic_dat_factory)
         self._isFrozen = True
     def _Rtn(self, freeze_it):
         def rtn(*args, **kwargs):
@@ -99,6 +100,7 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
         Create a TicDat object from an SQLite sql text file
 
         :param sql_file_path: A text file containing SQLite compatible SQL statements delimited by ;
+                              A path ending in .gz, .bz2, .xz or .zst is decompressed as it is read.
 
         :param includes_schema: boolean - does the sql_file_path contain schema generating SQL?
 
@@ -122,10 +124,100 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
                  Row counts smaller than 2 are pruned off, as they aren't duplicates
         """
         verify(sql, "sqlite3 needs to be installed to use this subroutine")
-        if not self._duplicate_focused_tdf:
+        tdf = self.tic_dat_factory
+        pk_tables = tuple(t for t,_ in tdf.primary_key_fields.items() if _)
+        if not pk_tables:
+            return {}
+        table_names = self._check_tables_fields(db_file_path, pk_tables)
+        rtn = {}
+        with sql.connect(db_file_path) as con:
+            for table, sql_table in table_names.items():
+                pkfs = tdf.primary_key_fields[table]
+                pk_sql = ", ".join(_brackets(pkfs))
+                # the counting is pushed down to SQLite, so only the duplicated keys come back
+                counts = defaultdict(int)
+                for row in con.execute("Select %s, count(*) from [%s] group by %s having count(*) > 1"%
+                                       (pk_sql, sql_table, pk_sql)):
+                    pk = tuple(self._read_data_cell(table, f, x) for f, x in zip(pkfs, row[:-1]))
+                    counts[pk[0] if len(pk) == 1 else pk] += row[-1]
+                if counts:
+                    rtn[table] = dict(counts)
+        return rtn
+    def find_data_row_failures(self, db_file_path, max_failures=float("inf")):
+        """
+        Finds the data row failures for the row predicates that are expression strings (see
+        TicDatFactory.add_data_row_predicate). The failing rows are selected by SQLite with a WHERE NOT (...) clause,
+        so only their primary keys are read from the database.
+
+        :param db_file_path: A SQLite db with a consistent schema.
+
+        :param max_failures: number. An upper limit on the number of failures to find.
+
+        :return: A dictionary constructed as for TicDatFactory.find_data_row_failures.
+
+        caveats : Row predicates that aren't expression strings can't be evaluated by SQLite, and are not checked
+                  (use TicDatFactory.find_data_row_failures on the result of create_tic_dat for those).
+                  The expressions are evaluated on the values as they are stored in the database, and thus
+                  don't see the read adjustments described in create_tic_dat.
+        """
+        verify(sql, "sqlite3 needs to be installed to use this subroutine")
+        assert max_failures > 0, "max_failures should be a positive number"
+        tdf = self.tic_dat_factory
+        expressions = [(t, pn, rpi.predicate) for t, rpis in tdf._data_row_predicates.items()
+                       for pn, rpi in rpis.items() if isinstance(rpi.predicate, utils.RowPredicateExpression)]
+        if not expressions:
+            return {}
+        table_names = self._check_tables_fields(db_file_path, {t for t, _, _ in expressions})
+        TPN = namedtuple("TablePredicateName", ["table", "predicate_name"])
+        rtn, found = {}, 0
+        with sql.connect(db_file_path) as con:
+            for table, pn, predicate in expressions:
+                if table not in table_names or found >= max_failures:
+                    continue
+                pkfs = tdf.primary_key_fields.get(table, ())
+                # the rows of a table without a primary key are identified by their position
+                source = "[%s]"%table_names[table] if pkfs else \
+                         "(Select row_number() over () - 1 as _position, * from [%s])"%table_names[table]
+                limit = " limit %s"%math.ceil(max_failures - found) if max_failures < float("inf") else ""
+                failures = []
+                for row in con.execute("Select %s from %s where not (%s)%s"%
+                                       (", ".join(_brackets(pkfs)) if pkfs else "_position", source,
+                                        predicate.sql(), limit)):
+                    pk = tuple(self._read_data_cell(table, f, x) for f, x in zip(pkfs, row)) if pkfs else row
+                    failures.append(pk[0] if len(pk) == 1 else pk)
+                if failures:
+                    rtn[TPN(table, pn)] = tuple(failures)
+                    found += len(failures)
+        return rtn
+    def find_aggregate_check_failures(self, db_file_path):
+        """
+        Finds the groups that fail the aggregate checks (see TicDatFactory.add_aggregate_check). The grouping,
+        aggregation and comparison are pushed down to SQLite, so only the failing groups are read from the database.
+
+        :param db_file_path: A SQLite db with a consistent schema.
+
+        :return: A dictionary constructed as for TicDatFactory.find_aggregate_check_failures.
+        """
+        verify(sql, "sqlite3 needs to be installed to use this subroutine")
+        tdf = self.tic_dat_factory
+        checks = [(t, cn, ac) for t, acs in tdf._aggregate_checks.items() for cn, ac in acs.items()]
+        if not checks:
             return {}
-        return find_duplicates(self._duplicate_focused_tdf.sql.create_tic_dat(db_file_path),
-                              self._duplicate_focused_tdf)
+        tables = {t for _, _, ac in checks for t in [ac.child_table, ac.parent_table] if t is not None}
+        table_names = self._check_tables_fields(db_file_path, tables)
+        verify(not tables.difference(table_names), "The following tables could not be found in %s\n%s"%
+               (db_file_path, "\n".join(sorted(tables.difference(table_names)))))
+        TCN = namedtuple("TableCheckName", ["table", "check_name"])
+        rtn = {}
+        with sql.connect(db_file_path) as con:
+            for table, cn, ac in checks:
+                failures = []
+                for row in con.execute(ac.sql(table_names=table_names)):
+                    group = tuple(self._read_data_cell(table, f, x) for f, x in zip(ac.group_by, row[:-1]))
+                    failures.append(group[0] if len(group) == 1 else group)
+                if failures:
+                    rtn[TCN(table, cn)] = tuple(failures)
+        return rtn
     def _fks(self):
         rtn = defaultdict(set)
         for fk in self.tic_dat_factory.foreign_keys:
@@ -141,7 +233,7 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
                 for str in self._get_schema_sql(set(tdf.all_tables).
                                                 difference(tdf.generic_tables)):
                     con.execute(str)
-            with open(sql_file_path, "r") as f:
+            with utils._open_file(sql_file_path, "r") as f:
                 for str in f.read().split(";"):
                     con.execute(str)
             return self._create_tic_dat_from_con(con,
@@ -202,16 +294,24 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
                         (", ".join(_brackets(tdf.data_fields[table])), table_name)):
                     yield [self._read_data_cell(table, f, x) for f, x in zip(tdf.data_fields[table], row)]
         return tableObj
-    def _create_tic_dat(self, db_file_path):
+    def _find_duplicates_and_create_tic_dat(self, db_file_path):
+        # a single read of the file that serves both find_duplicates and create_tic_dat (for standard_main)
+        verify(sql, "sqlite3 needs to be installed to use this subroutine")
+        duplicates = {}
+        tic_dat_dict = self._create_tic_dat(db_file_path, duplicates)
+        if duplicates:
+            return duplicates, None
+        return {}, self._Rtn(False)(**tic_dat_dict)
+    def _create_tic_dat(self, db_file_path, duplicates=None):
         tdf = self.tic_dat_factory
         table_names = self._check_tables_fields(db_file_path, tdf.all_tables)
         with sql.connect(db_file_path) as con:
-            rtn = self._create_tic_dat_from_con(con, table_names)
+            rtn = self._create_tic_dat_from_con(con, table_names, duplicates)
         for table in tdf.generator_tables:
             if table in table_names:
                 rtn[table] = self._create_gen_obj(db_file_path, table, table_names[table])
         return rtn
-    def _create_tic_dat_from_con(self, con, table_names):
+    def _create_tic_dat_from_con(self, con, table_names, duplicates=None):
         missing_tables = sorted(set(self.tic_dat_factory.all_tables).difference(table_names))
         if missing_tables:
             print("The following table names could not be found in the SQLite database.\n%s\n" %
@@ -224,6 +324,7 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
                 assert table in tdf.generic_tables
                 fields = tuple(x[1] for x in con.execute("PRAGMA table_info(%s)"%table))
             rtn[table]= {} if tdf.primary_key_fields.get(table, ())  else []
+            dups = {}
             for row in con.execute("Select %s from [%s]"%(", ".join(_brackets(fields)),
                                                           table_names[table])):
                 if table in tdf.generic_tables:
@@ -233,9 +334,14 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
                     pk = tuple(self._read_data_cell(table, f, x) for f, x in zip(pkfs, row[:len(pkfs)]))
                     data = [self._read_data_cell(table, f, x) for f, x in zip(fields[len(pkfs):], row[len(pkfs):])]
                     if dictish(rtn[table]) :
-                        rtn[table][pk[0] if len(pk) == 1 else tuple(pk)] = data
+                        pk = pk[0] if len(pk) == 1 else pk
+                        if pk in rtn[table]:
+                            dups[pk] = dups.get(pk, 1) + 1
+                        rtn[table][pk] = data
                     else :
                         rtn[table].append(data)
+            if dups and duplicates is not None:
+                duplicates[table] = dups
         return rtn
     def _ordered_tables(self):
         rtn = []
@@ -279,13 +385,17 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
         if x is True or x is False:
             return str(x)
         return self.tic_dat_factory._infinity_flag_write_cell(t, f, x)
-    def _get_data(self, tic_dat, as_sql):
+    def _get_data(self, tic_dat, as_sql, keys=None):
+        # keys, if provided, restricts the rows to the tables it maps to primary key containers (or None for all)
         rtn = []
         for t in self.tic_dat_factory.all_tables:
+            if keys is not None and t not in keys:
+                continue
             _t = getattr(tic_dat, t)
             if dictish(_t) :
                 primarykeys = tuple(self.tic_dat_factory.primary_key_fields[t])
-                for pkrow, sqldatarow in _t.items() :
+                for pkrow, sqldatarow in (_t.items() if keys is None or keys[t] is None else
+                                          ((k, _t[k]) for k in keys[t])):
                     _items = list(sqldatarow.items())
                     fields = primarykeys + tuple(x[0] for x in _items)
                     datarow = ((pkrow,) if len(primarykeys)==1 else pkrow) + tuple(x[1] for x in _items)
@@ -320,7 +430,7 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
         with _sql_con(db_file_path, foreign_keys=False) as con:
             for str in self._get_schema_sql(self.tic_dat_factory.all_tables):
                 con.execute(str)
-    def write_db_data(self, tic_dat, db_file_path, allow_overwrite = False):
+    def write_db_data(self, tic_dat, db_file_path, allow_overwrite = False, changes_since = None):
         """
         write the ticDat data to an SQLite database file
 
@@ -330,6 +440,10 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
 
         :param allow_overwrite: boolean - are we allowed to overwrite pre-existing data
 
+        :param changes_since: optional. A checkpoint token from TicDatFactory.track_changes. If provided, then
+                              db_file_path is assumed to already hold the tic_dat data as of that checkpoint, and
+                              only the rows edited since then are deleted and (re)inserted. Requires allow_overwrite.
+
         :return:
 
         caveats : True, False are written as "True", "False". Also see infinity_io_flag __doc__
@@ -342,6 +456,8 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
         if self.tic_dat_factory.generic_tables:
              dat, tdf = create_generic_free(tic_dat, self.tic_dat_factory)
              return tdf.sql.write_db_data(dat, db_file_path, allow_overwrite)
+        if changes_since is not None:
+            return self._write_db_data_changes(tic_dat, db_file_path, allow_overwrite, changes_since)
         if not os.path.exists(db_file_path) :
             self.write_db_schema(db_file_path)
         table_names = self._check_tables_fields(db_file_path, self.tic_dat_factory.all_tables)
@@ -355,6 +471,29 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
             for sql_str, data in self._get_data(tic_dat, as_sql=False):
                 con.execute(sql_str, list(data))
 
+    def _write_db_data_changes(self, tic_dat, db_file_path, allow_overwrite, changes_since):
+        tdf = self.tic_dat_factory
+        verify(allow_overwrite, "allow_overwrite needs to be True in order to write just the changed rows")
+        verify(not tdf.generic_tables, "changes_since isn't implemented for generic tables")
+        verify(os.path.isfile(db_file_path), "changes_since requires %s to already exist"%db_file_path)
+        changes = tdf.changes_since(tic_dat, changes_since)
+        table_names = self._check_tables_fields(db_file_path, changes)
+        with _sql_con(db_file_path, foreign_keys=False) as con:
+            for t, changed in changes.items():
+                verify(table_names.get(t) == t, "Failed to find table %s in path %s"%(t, db_file_path))
+                pks = tdf.primary_key_fields.get(t)
+                if not pks: # no keys to go on, so the whole table is rewritten
+                    con.execute("Delete from [%s]"%t)
+                    continue
+                where = " and ".join("%s is ?"%f for f in _brackets(pks))
+                for k in changed.deleted.union(changed.updated):
+                    con.execute("Delete from [%s] where %s"%(t, where),
+                                [self._write_data_cell(t, f, x) for f, x in zip(pks, k if len(pks) > 1 else (k,))])
+            keys = {t: None if changed.inserted is None else changed.inserted.union(changed.updated)
+                    for t, changed in changes.items()}
+            for sql_str, data in self._get_data(tic_dat, as_sql=False, keys=keys):
+                con.execute(sql_str, list(data))
+
     def write_sql_file(self, tic_dat, sql_file_path, include_schema = False,
                        allow_overwrite = False):
         """
@@ -363,6 +502,7 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
         :param tic_dat: the data object to write
 
         :param sql_file_path: the path of the text file to hold the sql statements for the data
+                              A path ending in .gz, .bz2, .xz or .zst is compressed as it is written.
 
         :param include_schema: boolean - should we write the schema sql first?
 
@@ -384,7 +524,7 @@ class SQLiteTicFactory(freezable_factory(object, "_isFrozen")) :
         return self._write_sql_file(tic_dat, sql_file_path, must_schema)
 
     def _write_sql_file(self, tic_dat, sql_file_path, schema_tables):
-        with open(sql_file_path, "w") as f:
+        with utils._open_file(sql_file_path, "w") as f:
             for str in self._get_schema_sql(schema_tables) + \
                        self._get_data(tic_dat, as_sql=True):
                 f.write(str + "\n")
@@ -561,6 +561,13 @@ class TestPostres(unittest.TestCase):
             tdf2.pgsql.write_data(td, cn, test_schema)
             dups = tdf.pgsql.find_duplicates(cn, test_schema)
             self.assertTrue(dups == {'three': {(1, 2, 2): 2}, 'two': {(1, 2): 3}, 'one': {1: 3, 2: 2}})
+            tdf3 = TicDatFactory(**{t:[[],["a", "b", "c", "da_active"]] for t in tdf.all_tables})
+            td = tdf3.TicDat(**{t:[[1, 2, 1, True], [1, 2, 2, False], [1, 2, 1, True], [2, 1, 3, True],
+                                   [2, 1, 3, False]] for t in tdf.all_tables})
+            tdf3.pgsql.write_schema(cn, "test_dups_active")
+            tdf3.pgsql.write_data(td, cn, "test_dups_active")
+            dups = tdf.pgsql.find_duplicates(cn, "test_dups_active", active_fld="da_active")
+            self.assertTrue(dups == {'three': {(1, 2, 1): 2}, 'two': {(1, 2): 2}, 'one': {1: 2}})
 
     def test_pd_progress(self):
         if not self.can_run:
@@ -1126,6 +1133,56 @@ class TestPostres(unittest.TestCase):
             for k, r in dat_3.t_one.items():
                 self.assertTrue(pickle.loads(r["Field Two"]) == pickle.loads(dat_4.t_one[k]["Field Two"]))
 
+    def test_write_changes(self):
+        if not self.can_run:
+            return
+        tdf = diet_schema
+        dat = tdf.copy_tic_dat(diet_dat)
+        schema = test_schema + "_write_changes"
+        with self.engine.connect() as cn:
+            tdf.pgsql.write_schema(cn, schema)
+            tdf.pgsql.write_data(dat, cn, schema)
+            token = tdf.track_changes(dat)
+            dat.categories["fat"]["Max Nutrition"] = 60
+            dat.foods["junk"] = {"Cost": 100}
+            dat.nutrition_quantities["junk", "fat"] = 30
+            dat.foods.pop("hot dog")
+            del dat.nutrition_quantities["hot dog", "sodium"]
+            self.assertTrue(set(tdf.changes_since(dat, token)) == {"categories", "foods", "nutrition_quantities"})
+            tdf.pgsql.write_data(dat, cn, schema, changes_since=token)
+            self.assertTrue(tdf._same_data(dat, tdf.pgsql.create_tic_dat(cn, schema)))
+
+    def test_database_checks(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(categories=[["Name"], ["Min Nutrition", "Max Nutrition"]], ratios=[[], ["a", "b"]],
+                            supplies=[["Commodity"], ["Supply"]], demands=[["Customer", "Commodity"], ["Quantity"]])
+        tdf.add_data_row_predicate("categories", "Min Nutrition <= Max Nutrition", "min max")
+        tdf.add_data_row_predicate("categories", "`Max Nutrition` > 0 or `Max Nutrition` is None", "positive")
+        tdf.add_data_row_predicate("categories", "`Max Nutrition` / `Min Nutrition` >= 1", "ratio")
+        tdf.add_data_row_predicate("categories", "not (1 < -`Min Nutrition` + 2 <= 1.5) and Name != 'd:'", "chain")
+        tdf.add_data_row_predicate("categories", lambda row: row["Name"] != "a", "not an expression")
+        tdf.add_data_row_predicate("ratios", "a / b is not None and a * 2 < b", "ratio")
+        tdf.add_aggregate_check("demands", "Commodity", ("sum", "Quantity"), "supplies", "<= Supply", "supply")
+        tdf.add_aggregate_check("demands", "Commodity", "count", "supplies", ">= 1", "has demand")
+        dat = tdf.TicDat(categories=[["a", 1, 2], ["b", 3, 2], ["c", None, 2], ["d:", 0, -1], ["e", 0, None]],
+                         ratios=[[1, 3], [2, 0], [None, 1], [1, 1]],
+                         supplies=[["x", 5], ["y", 4], ["z", 0]],
+                         demands=[["q", "x", 6], ["r", "y", 3], ["s", "y", None]])
+        schema = test_schema + "_database_checks"
+        with self.engine.connect() as cn:
+            tdf.pgsql.write_schema(cn, schema)
+            tdf.pgsql.write_data(dat, cn, schema)
+            fails = tdf.find_data_row_failures(dat)
+            fails.pop(("categories", "not an expression"))
+            pg_fails = tdf.pgsql.find_data_row_failures(cn, schema)
+            self.assertTrue(set(pg_fails) == set(fails) and
+                            all(set(v) == set(fails[k]) for k, v in pg_fails.items()))
+            self.assertTrue(sum(map(len, tdf.pgsql.find_data_row_failures(cn, schema, max_failures=4).values())) == 4)
+            ac_fails = tdf.find_aggregate_check_failures(dat)
+            self.assertTrue(ac_fails == {("demands", "supply"): ("x",), ("demands", "has demand"): ("z",)})
+            self.assertTrue(tdf.pgsql.find_aggregate_check_failures(cn, schema) == ac_fails)
+
 test_schema = 'test'
 
 
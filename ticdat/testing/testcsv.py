@@ -7,7 +7,7 @@ from ticdat.testing.ticdattestutils import dietData, dietSchema, netflowData, di
 from ticdat.testing.ticdattestutils import  netflowSchema, firesException, copyDataDietWeirdCase
 from ticdat.testing.ticdattestutils import sillyMeData, sillyMeSchema, sillyMeDataTwoTables, fail_to_debugger
 from ticdat.testing.ticdattestutils import makeCleanDir, dietSchemaWeirdCase2, copyDataDietWeirdCase2
-from ticdat.testing.ticdattestutils import flagged_as_run_alone
+from ticdat.testing.ticdattestutils import flagged_as_run_alone, addDietForeignKeys
 import unittest
 from ticdat.csvtd import _can_unit_test
 import datetime
@@ -433,6 +433,67 @@ class TestCsv(unittest.TestCase):
         self.assertTrue(raw_tdf._same_data(dat_nums, dat_nums_2))
         self.assertTrue(raw_tdf._same_data(dat_strs, dat_strs_2))
 
+    def testHeaderResolution(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(data=[["a"], ["b", "c"]])
+        dirPath = makeCleanDir(os.path.join(_scratchDir, "header_resolution"))
+        with open(os.path.join(dirPath, "data.csv"), "w") as f:
+            f.write("C,extra,A,b\n3,x,1,2\n\n6,y,4\n")
+        dat = tdf.csv.create_tic_dat(dirPath)
+        self.assertTrue(tdf._same_data(dat, tdf.TicDat(data=[["1", 2, 3], ["4", None, 6]])))
+        with open(os.path.join(dirPath, "data.csv"), "w") as f:
+            f.write("C,A,b,B\n3,1,2,2\n")
+        self.assertTrue(self.firesException(lambda: tdf.csv.create_tic_dat(dirPath)))
+        with open(os.path.join(dirPath, "data.csv"), "w") as f:
+            f.write("C,A\n3,1\n")
+        self.assertTrue(self.firesException(lambda: tdf.csv.create_tic_dat(dirPath)))
+
+    def testMaxWorkers(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(parameters=[["Name"], ["Value"]], **dietSchema())
+        addDietForeignKeys(tdf)
+        tdf.set_data_type("foods", "cost", max=10)
+        tdf.set_default_value("foods", "cost", 2)
+        tdf.add_parameter("Budget", 100, max=float("inf"), inclusive_max=True)
+        tdf.set_infinity_io_flag(999)
+        ticDat = tdf.TicDat(parameters=[["Budget", float("inf")]],
+                            **{t: getattr(dietData(), t) for t in dietSchema()})
+        ticDat.foods["pizza"]["cost"] = float("inf")
+        dirPath = os.path.join(_scratchDir, "diet_max_workers")
+        tdf.csv.write_directory(ticDat, makeCleanDir(dirPath))
+        for use_processes in [False, True]:
+            csvTicDat = tdf.csv.create_tic_dat(dirPath, max_workers=3, use_processes=use_processes)
+            self.assertTrue(tdf._same_data(csvTicDat, tdf.csv.create_tic_dat(dirPath)))
+            self.assertTrue(csvTicDat._len_dict() == ticDat._len_dict())
+            self.assertTrue(csvTicDat.foods["pizza"]["cost"] == float("inf"))
+        self.assertTrue(self.firesException(lambda: tdf.csv.create_tic_dat(dirPath, max_workers=0)))
+
+        with open(os.path.join(dirPath, "foods.csv"), "a") as f:
+            f.write("pizza,3\n")
+        for use_processes in [False, True]:
+            duplicates = {}
+            tdf.csv._create_tic_dat(dirPath, "excel", True, None, duplicates, max_workers=2,
+                                    use_processes=use_processes)
+            self.assertTrue(duplicates == {"foods": {"pizza": 2}})
+
+    def testCompressed(self):
+        if not self.can_run:
+            return
+        import gzip
+        tdf = TicDatFactory(**dietSchema())
+        ticDat = tdf.freeze_me(tdf.TicDat(**{t:getattr(dietData(),t) for t in tdf.primary_key_fields}))
+        dirPath = os.path.join(_scratchDir, "diet_compressed")
+        tdf.csv.write_directory(ticDat, makeCleanDir(dirPath))
+        with open(os.path.join(dirPath, "foods.csv"), "rb") as f_in:
+            with gzip.open(os.path.join(dirPath, "foods.csv.gz"), "wb") as f_out:
+                f_out.write(f_in.read())
+        self.assertTrue(self.firesException(lambda: tdf.csv.create_tic_dat(dirPath)))
+        os.remove(os.path.join(dirPath, "foods.csv"))
+        self.assertTrue(tdf._same_data(ticDat, tdf.csv.create_tic_dat(dirPath)))
+        self.assertFalse(tdf.csv.find_duplicates(dirPath))
+
 _scratchDir = TestCsv.__name__ + "_scratch"
 
 # Run the tests.
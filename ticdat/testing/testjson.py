@@ -276,6 +276,24 @@ class TestJson(unittest.TestCase):
                             for _ in v.values()))
 
 
+    def testCompressed(self):
+        if not self.can_run:
+            return
+        import ticdat.utils as utils
+        tdf = TicDatFactory(**dietSchema())
+        ticDat = tdf.freeze_me(tdf.TicDat(**{t:getattr(dietData(),t) for t in tdf.primary_key_fields}))
+        for suffix in [".gz", ".bz2", ".xz"]:
+            filePath = os.path.join(_scratchDir, "diet.json" + suffix)
+            tdf.json.write_file(ticDat, filePath, allow_overwrite=True)
+            with open(filePath, "rb") as f:
+                self.assertFalse(f.read(1) == b"{")
+            self.assertTrue(tdf._same_data(ticDat, tdf.json.create_tic_dat(filePath)))
+            self.assertFalse(tdf.json.find_duplicates(filePath))
+            self.assertTrue(utils._get_write_function_and_kwargs(tdf, filePath, "file", False)[0] ==
+                            tdf.json.write_file)
+            self.assertTrue(tdf._same_data(ticDat, utils._get_dat_object(tdf, "create_tic_dat", filePath, "file",
+                                                                         True)))
+
 _scratchDir = TestJson.__name__ + "_scratch"
 
 # Run the tests.
@@ -758,6 +758,110 @@ class TestIO(unittest.TestCase):
         panDat2 = pdf.xls.create_pan_dat(filePath)
         self.assertTrue(pdf._same_data(panDat, panDat2))
 
+    def testCsvMaxWorkers(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(**dietSchema())
+        pdf = PanDatFactory(**dietSchema())
+        ticDat = tdf.freeze_me(tdf.TicDat(**{t:getattr(dietData(),t) for t in tdf.primary_key_fields}))
+        panDat = pan_dat_maker(dietSchema(), ticDat)
+        dirPath = os.path.join(_scratchDir, "diet_max_workers_csv")
+        pdf.csv.write_directory(panDat, makeCleanDir(dirPath), max_workers=3)
+        panDat2 = pdf.csv.create_pan_dat(dirPath, max_workers=3)
+        self.assertTrue(pdf._same_data(panDat, panDat2))
+        panDat2 = pdf.csv.create_pan_dat(dirPath, max_workers=2, decimal=",")
+        self.assertTrue(pdf._same_data(panDat2, pdf.csv.create_pan_dat(dirPath, decimal=",")))
+        self.assertTrue(self.firesException(lambda: pdf.csv.create_pan_dat(dirPath, max_workers=-1)))
+
+    def testCsvChunks(self):
+        if not self.can_run:
+            return
+        pdf = PanDatFactory(parameters=[["Name"], ["Value"]], **dietSchema())
+        pdf.add_parameter("When", "2020-01-01", datetime=True)
+        pdf.add_parameter("Budget", 100, max=float("inf"), inclusive_max=True)
+        pdf.set_data_type("categories", "maxNutrition", max=float("inf"), inclusive_max=True)
+        pdf.set_infinity_io_flag(999)
+        tdf = TicDatFactory(**dietSchema())
+        ticDat = tdf.copy_tic_dat(dietData())
+        ticDat.categories["fat"]["maxNutrition"] = float("inf")
+        panDat = pan_dat_maker(dietSchema(), ticDat)
+        panDat.parameters = utils.pd.DataFrame({"Name": ["When", "Budget"], "Value": ["2021-05-06", float("inf")]})
+        dirPath = os.path.join(_scratchDir, "diet_chunks_csv")
+        pdf.csv.write_directory(panDat, makeCleanDir(dirPath))
+        panDat2 = pdf.csv.create_pan_dat(dirPath)
+        panDat3 = pdf.csv.create_pan_dat(dirPath, chunksize=4)
+        self.assertTrue(pdf._same_data(panDat2, panDat3))
+        self.assertTrue(panDat3.categories.set_index("name")["maxNutrition"]["fat"] == float("inf"))
+        self.assertTrue(pdf.create_full_parameters_dict(panDat3) == pdf.create_full_parameters_dict(panDat2))
+        chunks = list(pdf.csv.create_table_chunks(dirPath, 4))
+        self.assertTrue([t for t, _ in chunks] == [t for t in pdf.all_tables
+                                                   for _ in range(math.ceil(len(getattr(panDat2, t)) / 4))])
+        self.assertTrue(all(len(chunk) <= 4 for t, chunk in chunks))
+        self.assertTrue(sum(len(chunk) for t, chunk in chunks if t == "foods") == len(panDat.foods))
+        self.assertTrue(self.firesException(lambda: list(pdf.csv.create_table_chunks(dirPath, 0))))
+
+    def testCompressed(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(**dietSchema())
+        pdf = PanDatFactory(**dietSchema())
+        ticDat = tdf.freeze_me(tdf.TicDat(**{t:getattr(dietData(),t) for t in tdf.primary_key_fields}))
+        panDat = pan_dat_maker(dietSchema(), ticDat)
+        for suffix in [".gz", ".bz2"]:
+            filePath = os.path.join(_scratchDir, "diet.json" + suffix)
+            pdf.json.write_file(panDat, filePath)
+            self.assertTrue(pdf._same_data(panDat, pdf.json.create_pan_dat(filePath)))
+            pdf.json.write_file_pd(panDat, filePath)
+            pdf.json.write_file_pd(panDat, filePath[:-len(suffix)])
+            self.assertTrue(pdf._same_data(pdf.json.create_pan_dat(filePath[:-len(suffix)]),
+                                           pdf.json.create_pan_dat(filePath)))
+        dirPath = os.path.join(_scratchDir, "diet_compressed_csv")
+        pdf.csv.write_directory(panDat, makeCleanDir(dirPath))
+        df = utils.pd.read_csv(os.path.join(dirPath, "foods.csv"))
+        os.remove(os.path.join(dirPath, "foods.csv"))
+        df.to_csv(os.path.join(dirPath, "foods.csv.xz"), index=False)
+        self.assertTrue(pdf._same_data(panDat, pdf.csv.create_pan_dat(dirPath)))
+
+    def testSchemaColumnsOnly(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(**dietSchema())
+        pdf = PanDatFactory(**dietSchema())
+        ticDat = tdf.freeze_me(tdf.TicDat(**{t:getattr(dietData(),t) for t in tdf.primary_key_fields}))
+        panDat = pan_dat_maker(dietSchema(), ticDat)
+        wide_schema = {t: [pks, list(dfs) + ["Vendor Notes", "Vendor Id"]] for t, (pks, dfs) in dietSchema().items()}
+        wide_pdf = PanDatFactory(**wide_schema)
+        wide_dat = wide_pdf.PanDat(**{t: getattr(panDat, t).assign(**{"Vendor Notes": "x", "Vendor Id": 7})
+                                      for t in pdf.all_tables})
+        dirPath = os.path.join(_scratchDir, "diet_wide_csv")
+        wide_pdf.csv.write_directory(wide_dat, makeCleanDir(dirPath))
+        filePath = os.path.join(_scratchDir, "diet_wide")
+        wide_pdf.sql.write_file(wide_dat, filePath + ".db")
+        wide_pdf.xls.write_file(wide_dat, filePath + ".xlsx")
+        wide_pdf.json.write_file_pd(wide_dat, filePath + ".json")
+        for panDat2 in [pdf.csv.create_pan_dat(dirPath), pdf.csv.create_pan_dat(dirPath, chunksize=5),
+                        pdf.sql.create_pan_dat(filePath + ".db"), pdf.xls.create_pan_dat(filePath + ".xlsx"),
+                        pdf.json.create_pan_dat(filePath + ".json")]:
+            self.assertTrue(pdf._same_data(panDat, panDat2, epsilon=1e-5))
+            self.assertFalse(any("Vendor Id" in getattr(panDat2, t).columns for t in pdf.all_tables))
+        self.assertTrue(wide_pdf._same_data(wide_dat, wide_pdf.sql.create_pan_dat(filePath + ".db")))
+        with pandatio._sql_con(filePath + ".db") as con:
+            self.assertTrue(pdf.sql._select_list(con, "foods", "foods") == "[name], [cost]")
+
+    def testXlsxRowWrites(self):
+        if not self.can_run:
+            return
+        pdf = PanDatFactory(table=[["a"], ["b", "c", "d", "e"]])
+        df = pd.DataFrame({"a": ["x", "y", "z", "w"], "b": [1, 2, 3, 4], "c": [1.5, float("nan"), float("inf"), -2.],
+                           "d": [True, False, True, False],
+                           "e": [datetime.datetime(2021, 3, 4, 5, 6), pd.NaT, datetime.datetime(1999, 1, 2), pd.NaT]})
+        filePath = os.path.join(_scratchDir, "row_writes.xlsx")
+        pdf.xls.write_file(pdf.PanDat(table=df), filePath)
+        pdFilePath = os.path.join(_scratchDir, "row_writes_pd.xlsx")
+        df.to_excel(pdFilePath, sheet_name="table", index=False)
+        self.assertTrue(pdf.xls.create_pan_dat(filePath).table.equals(pdf.xls.create_pan_dat(pdFilePath).table))
+        self.assertTrue(pd.read_excel(filePath).equals(pd.read_excel(pdFilePath)))
+
 _scratchDir = TestIO.__name__ + "_scratch"
 
 # Run the tests.
@@ -2,7 +2,7 @@ import unittest
 from ticdat.pandatfactory import PanDatFactory, remove_trailing_all_nan
 from ticdat.utils import DataFrame, numericish, ForeignKey, ForeignKeyMapping
 import ticdat.utils as utils
-from ticdat.testing.ticdattestutils import fail_to_debugger, flagged_as_run_alone, netflowPandasData
+from ticdat.testing.ticdattestutils import fail_to_debugger, flagged_as_run_alone, netflowPandasData, firesException
 from ticdat.testing.ticdattestutils import netflowSchema, copy_to_pandas_with_reset, dietSchema, netflowData
 from ticdat.testing.ticdattestutils import addNetflowForeignKeys, sillyMeSchema, dietData, pan_dat_maker
 from ticdat.testing.ticdattestutils import addDietForeignKeys, dietData
@@ -977,6 +977,320 @@ class TestUtils(unittest.TestCase):
             self.assertTrue(tic_dat.byproduct[renamings[r][1], renamings[a][1], renamings[by][1]]["Quantity"] ==
                             row["Quantity"] > 0)
 
+    def test_diff(self):
+        pdf = PanDatFactory(**dietSchema())
+        tdf = TicDatFactory(**dietSchema())
+        dat = pan_dat_maker(dietSchema(), tdf.copy_tic_dat(dietData()))
+        self.assertFalse(pdf.diff(dat, pdf.copy_pan_dat(dat)))
+        tic_dat2 = tdf.copy_tic_dat(dietData())
+        tic_dat2.foods["pizza"]["cost"] += 1
+        tic_dat2.foods["new food"] = 3
+        del tic_dat2.nutritionQuantities["milk", "fat"]
+        tic_dat2.categories["fat"]["maxNutrition"] *= 1 + 1e-8
+        dat2 = pan_dat_maker(dietSchema(), tic_dat2)
+        diff = pdf.diff(dat, dat2)
+        self.assertTrue(set(diff) == {"foods", "nutritionQuantities", "categories"})
+        self.assertTrue(list(diff["foods"].added["name"]) == ["new food"] and not len(diff["foods"].removed))
+        self.assertTrue(diff["foods"].changed.to_dict("records") ==
+                        [{"name": "pizza", "field": "cost", "old": dietData().foods["pizza"]["cost"],
+                          "new": tic_dat2.foods["pizza"]["cost"]}])
+        self.assertTrue(diff["nutritionQuantities"].removed.to_dict("records") ==
+                        [{"food": "milk", "category": "fat", "qty": dietData().nutritionQuantities["milk", "fat"]["qty"]}])
+        self.assertTrue(set(pdf.diff(dat, dat2, epsilon=1e-5)) == {"foods", "nutritionQuantities"})
+        self.assertTrue(list(pdf.diff(dat2, dat)["foods"].removed["name"]) == ["new food"])
+
+        pdf = PanDatFactory(t=[["a"], ["b"]], l=[[], ["x", "y"]])
+        dat = pdf.PanDat(t=[[1, float("nan")]], l=[[1, 2], [1, 2], [3, None]])
+        dat2 = pdf.PanDat(t=[[1, float("nan")]], l=[[1, 2], [3, None], [4, 5]])
+        self.assertTrue(set(pdf.diff(dat, dat2)) == {"t", "l"})
+        diff = pdf.diff(dat, dat2, nans_are_same_for_data_rows=True)
+        self.assertTrue(set(diff) == {"l"} and not len(diff["l"].changed))
+        self.assertTrue(diff["l"].added.values.tolist() == [[4, 5]] and diff["l"].removed.values.tolist() == [[1, 2]])
+
+    def test_find_all_failures(self):
+        pdf = PanDatFactory(**dietSchema())
+        addDietForeignKeys(pdf)
+        pdf.set_data_type("foods", "cost", max=3)
+        calls = []
+        def small(r):
+            calls.append("small")
+            return r["qty"] < 5000
+        def positive(r):
+            calls.append("positive")
+            return r["qty"] > 0 or f"{r['food']} isn't positive"
+        pdf.add_data_row_predicate("nutritionQuantities", small, "small")
+        pdf.add_data_row_predicate("nutritionQuantities", "qty != 1", "not one")
+        pdf.add_data_row_predicate("nutritionQuantities", positive, "positive",
+                                   predicate_failure_response="Error Message")
+        pdf.add_data_row_predicate("foods", lambda r: r["cost"] >= 0, "foods positive")
+        dat = pan_dat_maker(dietSchema(), TicDatFactory(**dietSchema()).copy_tic_dat(dietData()))
+        self.assertFalse(any(pdf.find_all_failures(dat)))
+        dat.foods = utils.pd.concat([dat.foods, DataFrame({"name": ["gold"], "cost": [-100]})], ignore_index=True)
+        dat.nutritionQuantities = utils.pd.concat([dat.nutritionQuantities,
+            DataFrame({"food": ["gold", "junk", "milk"], "category": ["fat"] * 3, "qty": [5001, 1, -2]})],
+            ignore_index=True)
+        calls[:] = []
+        for as_table in [True, False]:
+            failures = pdf.find_all_failures(dat, as_table=as_table)
+            expected = (pdf.find_duplicates(dat, as_table=as_table), pdf.find_data_type_failures(dat, as_table=as_table),
+                        pdf.find_data_row_failures(dat, as_table=as_table),
+                        pdf.find_foreign_key_failures(dat, as_table=as_table))
+            for found, expect in zip(failures, expected):
+                self.assertTrue(list(found) == list(expect) and all(found[k].equals(expect[k]) if as_table else
+                                                                    list(found[k]) == list(expect[k]) for k in found))
+        self.assertTrue(all(failures))
+        self.assertTrue([k.predicate_name for k in failures.data_row] == ["small", "not one", "positive",
+                                                                          "foods positive"])
+        self.assertTrue(list(pdf.find_all_failures(dat).data_row["nutritionQuantities", "positive"]["Error Message"])
+                        == ["milk isn't positive"])
+        # the callable predicates of a table take turns on each row, rather than each making its own pass
+        self.assertTrue(calls[:4] == ["small", "positive"] * 2)
+        # the predicates are still evaluated one at a time when max_failures (or stats) is used
+        calls[:] = []
+        pdf.find_data_row_failures(dat, max_failures=100)
+        self.assertTrue(calls[:2] == ["small"] * 2)
+
+    def test_find_failures_since(self):
+        pdf = PanDatFactory(**dietSchema())
+        addDietForeignKeys(pdf)
+        pdf.set_data_type("foods", "cost", max=3)
+        pdf.add_data_row_predicate("nutritionQuantities", lambda r: r["qty"] < 100, "small")
+        dat = pan_dat_maker(dietSchema(), TicDatFactory(**dietSchema()).copy_tic_dat(dietData()))
+        dat.nutritionQuantities.loc[0, "qty"] = 1000 # a failure from before the checkpoint isn't revisited
+        token = pdf.track_changes(dat)
+        self.assertFalse(pdf.changes_since(dat, token) or any(pdf.find_failures_since(dat, token)))
+        dat.foods = utils.pd.concat([dat.foods, DataFrame({"name": ["gold"], "cost": [100]})], ignore_index=True)
+        dat.nutritionQuantities = utils.pd.concat([dat.nutritionQuantities,
+            DataFrame({"food": ["gold", "junk", "milk"], "category": ["fat"] * 3, "qty": [101, 1, 2]})],
+            ignore_index=True)
+        changes = pdf.changes_since(dat, token)
+        self.assertTrue(set(changes) == {"foods", "nutritionQuantities"} and
+                        list(changes["nutritionQuantities"].inserted) == [36, 37, 38])
+        failures = pdf.find_failures_since(dat, token)
+        self.assertTrue(list(failures.duplicates["nutritionQuantities"]["food"]) == ["milk"])
+        self.assertTrue(list(failures.data_type["foods", "cost"]["name"]) == ["gold"])
+        self.assertTrue(list(failures.data_row["nutritionQuantities", "small"]["food"]) == ["gold"])
+        self.assertTrue({k.foreign_table: list(v["food"]) for k, v in failures.foreign_key.items()} ==
+                        {"foods": ["junk"]})
+        token = pdf.track_changes(dat)
+        dat.categories = dat.categories[dat.categories["name"] != "fat"]
+        self.assertTrue(list(pdf.changes_since(dat, token)) == ["categories"])
+        failures = pdf.find_failures_since(dat, token)
+        self.assertTrue(not any(failures[:3]) and {k.foreign_table for k in failures.foreign_key} == {"categories"})
+        self.assertTrue(len(next(iter(failures.foreign_key.values()))) ==
+                        sum(dat.nutritionQuantities["category"] == "fat"))
+        # only the native rows that referenced the deleted (or updated) rows are rechecked, so the junk row that
+        # was orphaned before the checkpoint isn't revisited
+        token = pdf.track_changes(dat)
+        dat.foods = dat.foods[dat.foods["name"] != "milk"]
+        dat.categories.loc[dat.categories["name"] == "protein", "maxNutrition"] = 1000
+        failures = pdf.find_failures_since(dat, token)
+        self.assertTrue({k.foreign_table: set(v["food"]) for k, v in failures.foreign_key.items()} ==
+                        {"foods": {"milk"}})
+        self.assertTrue(sum(len(_) for _ in failures.foreign_key.values()) ==
+                        sum(dat.nutritionQuantities["food"] == "milk"))
+        self.assertTrue("junk" in set(pdf.find_foreign_key_failures(dat, verbosity="Low")["nutritionQuantities",
+                                      "foods", ("food", "name")]["food"]))
+        dat.nutritionQuantities = dat.nutritionQuantities.iloc[0:0]
+        self.assertFalse(any(pdf.find_failures_since(dat, token)))
+
+        pdf = PanDatFactory(t=[["a"], ["b"]])
+        dat = pdf.PanDat(t=DataFrame({"a": ["x", "y", "z"], "b": [1, 2, 3]}))
+        token = pdf.track_changes(dat)
+        # the new row makes b a float column, which doesn't make the old rows look updated
+        dat.t = utils.pd.concat([dat.t, DataFrame({"a": ["w"], "b": [1.5]})], ignore_index=True)
+        changes = pdf.changes_since(dat, token)
+        self.assertTrue(list(changes["t"].inserted) == [3] and not len(changes["t"].updated))
+        dat.t.loc[0, "b"] = 2
+        self.assertTrue(list(pdf.changes_since(dat, token)["t"].updated) == [0])
+
+    def test_sampled_failures(self):
+        pdf = PanDatFactory(t=[["a"], ["b"]], l=[[], ["x"]])
+        pdf.set_data_type("t", "b", max=49)
+        pdf.add_data_row_predicate("l", lambda r: r["x"] % 2 == 0, "even")
+        dat = pdf.PanDat(t=[[i, i] for i in range(100)], l=[[i] for i in range(1000)])
+        sampled = pdf.find_data_type_failures(dat, sample=0.2, sample_seed=1)
+        self.assertTrue(sampled.sample_sizes == {"t": (20, 100)} and sampled.may_be_undercounted)
+        fails = sampled.failures["t", "b"]
+        self.assertTrue(all(fails["b"] >= 49) and sampled.estimated_failure_rates == {("t", "b"): len(fails) / 20})
+        self.assertTrue(set(fails["a"]) ==
+                        set(pdf.find_data_type_failures(dat, sample=0.2, sample_seed=1).failures["t", "b"]["a"]))
+        sampled = pdf.find_data_row_failures(dat, sample=100, sample_seed=2, as_table=False)
+        self.assertTrue(sampled.sample_sizes == {"l": (100, 1000)} and sampled.may_be_undercounted)
+        self.assertTrue(len(sampled.failures["l", "even"]) == 100 and
+                        0 < sampled.estimated_failure_rates["l", "even"] < 1)
+        sampled = pdf.find_data_row_failures(dat, sample=1.0)
+        self.assertFalse(sampled.may_be_undercounted)
+        self.assertTrue(len(sampled.failures["l", "even"]) == 500 and
+                        sampled.estimated_failure_rates["l", "even"] == 0.5)
+
+    def test_row_predicate_stats(self):
+        f = PanDatFactory(t=[["a"], ["b"]])
+        f.add_data_row_predicate("t", lambda r: r["b"] > -1, "rare")
+        f.add_data_row_predicate("t", lambda r: r["b"] % 2 == 0, "common")
+        f.add_data_row_predicate("t", lambda r: 1 / r["b"] > 0, "exception", predicate_failure_response="Error Message")
+        dat = f.PanDat(t=[[i, i] for i in range(100)])
+        stats = {}
+        fails = f.find_data_row_failures(dat, exception_handling="Handled as Failure", stats=stats)
+        self.assertTrue(set(stats) == {("t", "rare"), ("t", "common"), ("t", "exception")})
+        self.assertTrue(all(_.calls == 100 and _.wall_time >= 0 for _ in stats.values()))
+        self.assertTrue([stats["t", _].failures for _ in ["rare", "common", "exception"]] == [0, 50, 1])
+        self.assertTrue([stats["t", _].exceptions for _ in ["rare", "common", "exception"]] == [0, 0, 1])
+        self.assertTrue(set(fails) == {("t", "common"), ("t", "exception")})
+        fails = f.find_data_row_failures(dat, exception_handling="Handled as Failure", stats=stats,
+                                         order_by_stats=True, max_failures=1)
+        self.assertTrue(set(fails) == {("t", "common")} and stats["t", "common"].failures > 50)
+        self.assertTrue(stats["t", "rare"].calls == 100)
+        self.assertTrue(stats["t", "common"].calls == 102) # the trip wire stopped the calls after rows 0 and 1
+        self.assertTrue(firesException(lambda: f.find_data_row_failures(dat, order_by_stats=True)))
+
+    def test_kwargs_cache(self):
+        f = PanDatFactory(t=[["a"], ["b"]], p=[["c"], []])
+        calls = []
+        def make_kwargs(dat):
+            calls.append(1)
+            return {"bound": len(dat.p)}
+        f.add_data_row_predicate("t", lambda r, bound: r["b"] < bound, "bound", predicate_kwargs_maker=make_kwargs)
+        dat = f.PanDat(t=[[i, i] for i in range(4)], p=[[0], [1]])
+        cache = {}
+        for _ in range(3):
+            fails = f.find_data_row_failures(dat, kwargs_cache=cache)
+            self.assertTrue(len(calls) == 1 and len(fails[("t", "bound")]) == 2)
+        dat.t.loc[3, "b"] = 30
+        fails = f.find_data_row_failures(dat, kwargs_cache=cache)
+        self.assertTrue(len(calls) == 2 and len(fails[("t", "bound")]) == 2)
+        dat.p.loc[len(dat.p)] = [2]
+        fails = f.find_data_row_failures(dat, kwargs_cache=cache)
+        self.assertTrue(len(calls) == 3 and len(fails[("t", "bound")]) == 1)
+        f.find_data_row_failures(dat, kwargs_cache=cache)
+        f.find_data_row_failures(dat)
+        self.assertTrue(len(calls) == 4)
+        self.assertTrue(firesException(lambda: f.find_data_row_failures(dat, kwargs_cache=[])))
+
+    def test_fingerprint(self):
+        pdf = PanDatFactory(**dietSchema())
+        tdf = TicDatFactory(**dietSchema())
+        dat = pan_dat_maker(dietSchema(), tdf.copy_tic_dat(dietData()))
+        fp = pdf.fingerprint(dat)
+        self.assertTrue(set(fp.tables) == set(pdf.all_tables) and fp == pdf.fingerprint(pdf.copy_pan_dat(dat)))
+        dat2 = pdf.PanDat(**{t: getattr(dat, t).sample(frac=1, random_state=0).set_index(
+                                getattr(dat, t).columns[0], drop=False) for t in pdf.all_tables})
+        self.assertTrue(pdf.fingerprint(dat2) == fp)
+        dat2.foods.loc[dat2.foods["name"] == "pizza", "cost"] += 1
+        fp2 = pdf.fingerprint(dat2)
+        self.assertTrue(fp2.overall != fp.overall and fp2.tables["foods"] != fp.tables["foods"])
+        self.assertTrue(all(fp2.tables[t] == fp.tables[t] for t in pdf.all_tables if t != "foods"))
+
+        pdf = PanDatFactory(t=[["a"], ["b", "c"]], l=[[], ["x", "y"]])
+        pdf.set_data_type("t", "c", datetime=True)
+        dat = pdf.PanDat(t=[[1, float("inf"), utils.pd.Timestamp(2020, 1, 1)], [2, 3, None]],
+                         l=[[1, 2], [1, 2], [3, None]])
+        dat2 = pdf.PanDat(t=[[2, 3.0, None], [1, 100, "2020-01-01"]], l=[[3, None], [1.0, 2], [1, 2]])
+        self.assertTrue(pdf.fingerprint(dat).tables["l"] == pdf.fingerprint(dat2).tables["l"])
+        self.assertTrue(pdf.fingerprint(dat).tables["t"] != pdf.fingerprint(dat2).tables["t"])
+        pdf.set_infinity_io_flag(100)
+        self.assertTrue(pdf.fingerprint(dat) == pdf.fingerprint(dat2))
+        dat2.l = dat2.l[:2]
+        self.assertTrue(pdf.fingerprint(dat).tables["l"] != pdf.fingerprint(dat2).tables["l"])
+
+    def test_expression_row_predicates(self):
+        pdf = PanDatFactory(categories=[["Name"], ["Min Nutrition", "Max Nutrition"]])
+        pdf.add_data_row_predicate("categories", "Min Nutrition <= Max Nutrition", "min max")
+        pdf.add_data_row_predicate("categories", "`Max Nutrition` > 0 or `Max Nutrition` is None", "positive")
+        pdf.add_data_row_predicate("categories", "Name + 1 > 0", "exception")
+        self.assertTrue(firesException(lambda: pdf.add_data_row_predicate("categories", "Name.lower()")))
+        self.assertTrue(firesException(lambda: pdf.add_data_row_predicate("categories", "Max Nutrition",
+                                                                           predicate_failure_response="Error Message")))
+        dat = pdf.PanDat(categories=[["a", 1, 2], ["b", 3, 2], ["c", None, 2], ["d", 0, -1], ["e", 0, None]])
+        fails = pdf.find_data_row_failures(dat, exception_handling="Handled as Failure")
+        self.assertTrue({k: set(v["Name"]) for k, v in fails.items()} ==
+                        {("categories", "min max"): {"b", "c", "d", "e"}, ("categories", "positive"): {"d"},
+                         ("categories", "exception"): set("abcde")})
+        fails = pdf.find_data_row_failures(dat, exception_handling="Handled as Failure", max_failures=2)
+        self.assertTrue(sum(len(v) for v in fails.values()) == 2)
+        fails_2 = pdf.find_data_row_failures(dat, as_table=False, exception_handling="Handled as Failure")
+        pdf_2 = PanDatFactory(categories=[["Name"], ["Min Nutrition", "Max Nutrition"]])
+        pdf_2.add_data_row_predicate("categories", lambda r: r["Min Nutrition"] <= r["Max Nutrition"], "min max")
+        self.assertTrue(list(fails_2["categories", "min max"]) ==
+                        list(pdf_2.find_data_row_failures(dat, as_table=False)["categories", "min max"]))
+
+        pdf = PanDatFactory(**pdf.schema())
+        pdf.add_data_row_predicate("categories", "`Max Nutrition` / `Min Nutrition` >= 1", "ratio")
+        pdf.add_data_row_predicate("categories", "(`Max Nutrition` / `Min Nutrition`) is None", "no ratio")
+        pdf.add_data_row_predicate("categories", "`Max Nutrition` / 0 is None", "zero")
+        fails = pdf.find_data_row_failures(dat)
+        self.assertTrue({k: set(v["Name"]) for k, v in fails.items()} ==
+                        {("categories", "ratio"): {"b", "c", "d", "e"}, ("categories", "no ratio"): {"a", "b"}})
+        for v in pdf.get_row_predicates("categories").values():
+            self.assertTrue(list(v.predicate.mask(dat.categories)) ==
+                            [v.predicate(r) for r in dat.categories.to_dict("records")])
+
+    def test_aggregate_checks(self):
+        pdf = PanDatFactory(commodities=[["Name"], ["Supply"]], demands=[["Customer", "Commodity"], ["Quantity"]])
+        pdf.add_aggregate_check("demands", "Commodity", ("sum", "Quantity"), "commodities", "<= Supply", "supply")
+        pdf.add_aggregate_check("demands", "Commodity", "count", "commodities", ">= 1", "has demand")
+        pdf.add_aggregate_check("demands", "Customer", ("max", "Quantity"), comparison="<= 10", check_name="max")
+        self.assertTrue(firesException(lambda: pdf.add_aggregate_check("demands", "Commodity", "count",
+                                                                       comparison="<= Supply")))
+        dat = pdf.PanDat(commodities=[["a", 10], ["b", 5], ["c", 3]],
+                         demands=[["x", "a", 6], ["y", "a", 6], ["x", "b", 5], ["z", "b", None]])
+        fails = pdf.find_aggregate_check_failures(dat)
+        self.assertTrue(set(fails) == {("demands", "supply"), ("demands", "has demand"), ("demands", "max")})
+        self.assertTrue(fails["demands", "supply"].to_dict("records") == [{"Commodity": "a", "Aggregate Value": 12}])
+        self.assertTrue(fails["demands", "has demand"].to_dict("records") ==
+                        [{"Commodity": "c", "Aggregate Value": 0}])
+        self.assertTrue(list(fails["demands", "max"]["Customer"]) == ["z"])
+        dat.demands.loc[dat.demands["Customer"] == "y", "Quantity"] = 4
+        dat.demands.loc[dat.demands["Customer"] == "z", "Quantity"] = 0
+        dat.demands.loc[len(dat.demands)] = ["z", "c", 1]
+        self.assertFalse(pdf.find_aggregate_check_failures(dat))
+
+        pdf = PanDatFactory(supplies=[["Warehouse", "Commodity"], ["Supply"]],
+                            demands=[["Customer", "Commodity"], ["Quantity"]])
+        pdf.add_aggregate_check("demands", "Commodity", ("sum", "Quantity"), "supplies", "<= sum(Supply)",
+                                "supply", parent_group_by="Commodity")
+        pdf.add_aggregate_check("demands", "Commodity", "count", "supplies", ">= 1", "has demand",
+                                parent_group_by="Commodity")
+        dat = pdf.PanDat(supplies=[["w1", "a", 5], ["w2", "a", 5], ["w1", "b", 4], ["w1", "c", None]],
+                         demands=[["x", "a", 6], ["y", "a", 4], ["x", "b", 5], ["z", "b", None]])
+        fails = pdf.find_aggregate_check_failures(dat)
+        self.assertTrue(set(fails) == {("demands", "supply"), ("demands", "has demand")})
+        self.assertTrue(fails["demands", "supply"].to_dict("records") == [{"Commodity": "b", "Aggregate Value": 5}])
+        self.assertTrue(fails["demands", "has demand"].to_dict("records") ==
+                        [{"Commodity": "c", "Aggregate Value": 0}])
+        dat.supplies.loc[len(dat.supplies)] = ["w2", "b", 1]
+        dat.demands.loc[len(dat.demands)] = ["z", "c", 0]
+        self.assertFalse(pdf.find_aggregate_check_failures(dat))
+
+    def test_vectorized_data_type_failures(self):
+        pdf = PanDatFactory(t=[["a"], ["b", "c", "d"]])
+        pdf.set_data_type("t", "b", number_allowed=True, must_be_int=True, min=0, max=10, inclusive_max=False)
+        pdf.set_data_type("t", "c", number_allowed=False, strings_allowed=["x", "y"], nullable=True)
+        pdf.set_data_type("t", "d", datetime=True)
+        pdf.set_default_value("t", "c", "x")
+        rows = [[1, 2, "x", "2021-01-01"], [2, 2.5, "z", None], [3, 10, None, "not a date"],
+                [4, "5", True, utils.pd.Timestamp(2021, 1, 1)], [5, float("inf"), 3, 3], [6, -1, "y", "2021-01-01"]]
+        dat = pdf.PanDat(t=rows)
+        fails = pdf.find_data_type_failures(dat)
+        for (t, f), df in fails.items():
+            self.assertTrue(set(df["a"]) == {a for a, *row in rows if not pdf.data_types[t][f].valid_data(
+                None if utils.pd.isnull(row[["b", "c", "d"].index(f)]) else row[["b", "c", "d"].index(f)])})
+        self.assertTrue({k: set(v["a"]) for k, v in fails.items()} ==
+                        {("t", "b"): {2, 3, 4, 5, 6}, ("t", "c"): {2, 4, 5}, ("t", "d"): {2, 3, 5}})
+        self.assertTrue(sum(map(len, pdf.find_data_type_failures(dat, max_failures=6).values())) == 6)
+        pdf.replace_data_type_failures(dat, {("t", "d"): utils.pd.Timestamp(2020, 1, 1)})
+        self.assertFalse(pdf.find_data_type_failures(dat))
+        self.assertTrue(list(dat.t["b"]) == [2, 0, 0, 0, 0, 0] and list(dat.t["c"]) == ["x", "x", None, "x", "x", "y"])
+        self.assertTrue(dat.t["d"][1] == utils.pd.Timestamp(2020, 1, 1) and dat.t["d"][0] == "2021-01-01")
+
+        from fractions import Fraction
+        pdf = PanDatFactory(t=[["a"], ["b"]])
+        pdf.set_data_type("t", "b", number_allowed=True, must_be_int=True, min=0, max=10, strings_allowed=["x"])
+        rows = [[1, Fraction(1, 2)], [2, Fraction(3)], [3, 2], [4, Fraction(20)], [5, "x"], [6, 1.5]]
+        fails = pdf.find_data_type_failures(pdf.PanDat(t=rows))
+        self.assertTrue(set(fails["t", "b"]["a"]) == {a for a, b in rows if not pdf.data_types["t"]["b"].valid_data(b)}
+                        == {1, 4, 6})
+
 
 # Run the tests.
 if __name__ == "__main__":
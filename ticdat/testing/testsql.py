@@ -87,6 +87,22 @@ class TestSql(unittest.TestCase):
         dups = tdf.sql.find_duplicates(f)
         self.assertTrue(dups ==  {'three': {(1, 2, 2): 2}, 'two': {(1, 2): 3}, 'one': {1: 3, 2: 2}})
 
+    def testDupsReadAdjusted(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(one = [["a"],["b"]], two = [["a", "b"],[]], three = [["a"], []])
+        tdf2 = TicDatFactory(**{t:[[],tdf.primary_key_fields[t] + tdf.data_fields[t]] for t in tdf.all_tables})
+        td = tdf2.TicDat(one = [[200, 1], [200, 2], [1, 3], ["inf", 4], ["inf", 5]],
+                         two = [["true", 1], ["true", 1], ["true", 2], [300, 1]],
+                         three = [1, 2, 3])
+        f = makeCleanPath(os.path.join(_scratchDir, "testDupsReadAdjusted.db"))
+        tdf2.sql.write_db_data(td, f)
+        # the duplicated keys are adjusted the same way create_tic_dat adjusts them
+        tdf.set_infinity_io_flag(100)
+        self.assertTrue(tdf.sql.find_duplicates(f) == {'one': {float("inf"): 2, "inf": 2}, 'two': {(True, 1): 2}})
+        tdf.set_infinity_io_flag("N/A")
+        self.assertTrue(tdf.sql.find_duplicates(f) == {'one': {200: 2, float("inf"): 2}, 'two': {(True, 1): 2}})
+
     def testDiet(self):
         if not self.can_run:
             return
@@ -465,6 +481,82 @@ class TestSql(unittest.TestCase):
         dat_2 = tdf.sql.create_tic_dat_from_sql(path)
         self.assertTrue(tdf._same_data(dat_1, dat_2, nans_are_same_for_data_rows=True))
 
+    def test_write_changes(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(**dietSchema())
+        addDietForeignKeys(tdf)
+        tdf.set_infinity_io_flag(999999)
+        dat = tdf.copy_tic_dat(dietData())
+        path = makeCleanPath(os.path.join(_scratchDir, "write_changes.db"))
+        tdf.sql.write_db_data(dat, path)
+        token = tdf.track_changes(dat)
+        dat.categories["fat"]["maxNutrition"] = 60
+        dat.categories["calories"]["maxNutrition"] = float("inf")
+        dat.foods["junk"] = {"cost": 100}
+        dat.nutritionQuantities["junk", "fat"] = 30
+        dat.foods.pop("hot dog")
+        for k in [k for k in dat.nutritionQuantities if k[0] == "hot dog"]:
+            del dat.nutritionQuantities[k]
+        self.assertTrue(set(tdf.changes_since(dat, token)) == {"categories", "foods", "nutritionQuantities"})
+        self.assertTrue(firesException(lambda: tdf.sql.write_db_data(dat, path, changes_since=token)))
+        tdf.sql.write_db_data(dat, path, allow_overwrite=True, changes_since=token)
+        self.assertTrue(tdf._same_data(dat, tdf.sql.create_tic_dat(path)))
+        token = tdf.track_changes(dat)
+        tdf.sql.write_db_data(dat, path, allow_overwrite=True, changes_since=token) # no changes, nothing written
+        self.assertTrue(tdf._same_data(dat, tdf.sql.create_tic_dat(path)))
+
+        tdf = TicDatFactory(table=[[], ["a", "b"]])
+        dat = tdf.TicDat(table=[[1, 2], [3, 4]])
+        path = makeCleanPath(os.path.join(_scratchDir, "write_changes_keyless.db"))
+        tdf.sql.write_db_data(dat, path)
+        token = tdf.track_changes(dat)
+        dat.table[0]["b"] = 12
+        tdf.sql.write_db_data(dat, path, allow_overwrite=True, changes_since=token)
+        self.assertTrue(tdf._same_data(dat, tdf.sql.create_tic_dat(path)))
+
+    def testCompressedSqlFile(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(**dietSchema())
+        ticDat = tdf.freeze_me(tdf.TicDat(**{t:getattr(dietData(),t) for t in tdf.primary_key_fields}))
+        for suffix in [".gz", ".xz"]:
+            filePath = os.path.join(_scratchDir, "diet.sql" + suffix)
+            tdf.sql.write_sql_file(ticDat, filePath, include_schema=True, allow_overwrite=True)
+            self.assertTrue(tdf._same_data(ticDat, tdf.sql.create_tic_dat_from_sql(filePath, includes_schema=True)))
+            self.assertTrue(utils._get_write_function_and_kwargs(tdf, filePath, "file", False)[0] ==
+                            tdf.sql.write_sql_file)
+
+    def testDatabaseChecks(self):
+        if not self.can_run:
+            return
+        tdf = TicDatFactory(categories=[["Name"], ["Min Nutrition", "Max Nutrition"]], ratios=[[], ["a", "b"]],
+                            supplies=[["Commodity"], ["Supply"]], demands=[["Customer", "Commodity"], ["Quantity"]])
+        tdf.add_data_row_predicate("categories", "Min Nutrition <= Max Nutrition", "min max")
+        tdf.add_data_row_predicate("categories", "`Max Nutrition` > 0 or `Max Nutrition` is None", "positive")
+        tdf.add_data_row_predicate("categories", "`Max Nutrition` / `Min Nutrition` >= 1", "ratio")
+        tdf.add_data_row_predicate("categories", "not (1 < -`Min Nutrition` + 2 <= 1.5) and Name != 'd'", "chain")
+        tdf.add_data_row_predicate("categories", lambda row: row["Name"] != "a", "not an expression")
+        tdf.add_data_row_predicate("ratios", "a / b is not None and a * 2 < b", "ratio")
+        tdf.add_aggregate_check("demands", "Commodity", ("sum", "Quantity"), "supplies", "<= Supply", "supply")
+        tdf.add_aggregate_check("demands", "Commodity", "count", "supplies", ">= 1", "has demand")
+        dat = tdf.TicDat(categories=[["a", 1, 2], ["b", 3, 2], ["c", None, 2], ["d", 0, -1], ["e", 0, None]],
+                         ratios=[[1, 3], [2, 0], [None, 1], [1, 1]],
+                         supplies=[["x", 5], ["y", 4], ["z", 0]],
+                         demands=[["q", "x", 6], ["r", "y", 3], ["s", "y", None]])
+        path = makeCleanPath(os.path.join(_scratchDir, "database_checks.db"))
+        tdf.sql.write_db_data(dat, path)
+        fails = tdf.find_data_row_failures(dat)
+        fails.pop(("categories", "not an expression"))
+        sql_fails = tdf.sql.find_data_row_failures(path)
+        self.assertTrue(set(sql_fails) == set(fails) and
+                        all(set(v) == set(fails[k]) for k, v in sql_fails.items()))
+        self.assertTrue(set(sql_fails["ratios", "ratio"]) == {1, 2, 3})
+        self.assertTrue(sum(map(len, tdf.sql.find_data_row_failures(path, max_failures=4).values())) == 4)
+        ac_fails = tdf.find_aggregate_check_failures(dat)
+        self.assertTrue(ac_fails == {("demands", "supply"): ("x",), ("demands", "has demand"): ("z",)})
+        self.assertTrue(tdf.sql.find_aggregate_check_failures(path) == ac_fails)
+
 _scratchDir = TestSql.__name__ + "_scratch"
 
 # Run the tests.
@@ -12,12 +12,14 @@ import os
 import itertools
 import shutil
 import json
+import math
 try:
     import dateutil, dateutil.parser
 except:
     dateutil = None
 import datetime
 from unittest.mock import patch
+from types import SimpleNamespace
 
 try:
     import testing.postgresql as testing_postgresql
@@ -951,6 +953,11 @@ class TestUtils(unittest.TestCase):
          self.assertTrue(set(fd(tdf, {"bo":[{"b":2}, {"a":1}, {"a":1, "b":0}]})["bo"]) == {(1,0)})
          self.assertTrue(set(fd(tdf, {"bo":[{"b":2}, {"a":1}, {"a":1, "b":0}, {"a":0, "b":2}]})["bo"]) ==
                          {(1,0),(0,2)})
+         self.assertTrue(fd(tdf, {"bo":[[1, 2, 3], [1, 2, 4], [1, 3, 4], (1, 2, 5)]}) == {"bo": {(1, 2): 3}})
+         self.assertTrue(firesException(lambda: fd(tdf, {"bo":[[1, 2, 3], [1, 2]]})))
+         self.assertTrue(firesException(lambda: fd(tdf, {"bo":[{"a": 1, "d": 2}]})))
+         self.assertTrue(utils.count_duplicate_keys(x % 3 for x in range(7)) == {0: 3, 1: 2, 2: 2})
+         self.assertFalse(utils.count_duplicate_keys(iter(["a", ("a",), 1])))
 
          tdf = TicDatFactory(bo = [["c"],[]])
          dat = tdf.TicDat(bo = [1, "a"])
@@ -1309,6 +1316,23 @@ class TestUtils(unittest.TestCase):
             dat_1 = utils._get_dat_object(tdf, "create_tic_dat", path, f_or_d, False)
             self.assertTrue(tdf._same_data(dat, dat_1))
 
+        tdf = TicDatFactory(one = [["a"],["b", "c"]], two = [["a", "b"],["c"]])
+        tdf_dups = TicDatFactory(**{t:[[],["a", "b", "c"]] for t in tdf.all_tables})
+        dat_dups = tdf_dups.TicDat(**{t:[["x", "y", 1], ["x", "y", 2], ["y", "x", 3]] for t in tdf.all_tables})
+        dat = tdf.TicDat(**{t:[["x", "y", 1], ["y", "x", 3]] for t in tdf.all_tables})
+        for attr, path in [["csv", core_path+"_dups_csv"], ["xls", core_path+"_dups.xlsx"],
+                           ["sql", core_path+"_dups.db"], ["json", core_path+"_dups.json"]]:
+            f_or_d = "directory" if attr == "csv" else "file"
+            for _tdf, _dat, _path in [[tdf, dat, path.replace("_dups", "_no_dups")], [tdf_dups, dat_dups, path]]:
+                write_func, write_kwargs = utils._get_write_function_and_kwargs(_tdf, _path, f_or_d,
+                                                                                case_space_table_names=False)
+                write_func(_dat, _path, **write_kwargs)
+            self.assertTrue(tdf._same_data(dat, utils._get_dat_object(tdf, "create_tic_dat",
+                                                                      path.replace("_dups", "_no_dups"), f_or_d, True)))
+            self.assertTrue(getattr(tdf, attr)._find_duplicates_and_create_tic_dat(path)[0] ==
+                            getattr(tdf, attr).find_duplicates(path) == {"one": {"x": 2}, "two": {("x", "y"): 2}})
+            self.assertTrue(firesException(lambda: utils._get_dat_object(tdf, "create_tic_dat", path, f_or_d, True)))
+
 
     def testTwentySix(self):
         data_path = os.path.join(_scratchDir, "custom_module")
@@ -1541,6 +1565,37 @@ class TestUtils(unittest.TestCase):
         errs = tdf.find_data_row_failures(dat, max_failures=9)
         self.assertTrue(len(errs) == 1 and all(len(_) == 9 for _ in errs.values()))
 
+        # a truncated enumeration finds the failures of the earlier predicates first, regardless of row order
+        tdf = TicDatFactory(t=[["a"], ["b"]])
+        tdf.add_data_row_predicate("t", lambda row: row["b"] < 3, "late rows")
+        tdf.add_data_row_predicate("t", lambda row, bad: row["b"] not in bad, "kwargs",
+                                   predicate_kwargs_maker=lambda dat: None)
+        tdf.add_data_row_predicate("t", lambda row: row["b"] > 1, "early rows")
+        dat = tdf.TicDat(t=[[i, i] for i in range(5)])
+        self.assertTrue(list(tdf.find_data_row_failures(dat, max_failures=2)) == [("t", "late rows")])
+        self.assertTrue(list(tdf.find_data_row_failures(dat, max_failures=3)) == [("t", "late rows"), ("t", "kwargs")])
+        errs = tdf.find_data_row_failures(dat, max_failures=4)
+        self.assertTrue(list(errs) == [("t", "late rows"), ("t", "kwargs"), ("t", "early rows")] and
+                        errs["t", "early rows"] == (0,))
+        self.assertTrue(list(tdf.find_data_row_failures(dat)) == list(errs))
+
+        # any exception fails a Boolean predicate, but only an Exception fails an Error Message predicate
+        class Interrupt(BaseException):
+            pass
+        def interrupt(row):
+            raise Interrupt()
+        tdf = TicDatFactory(t=[["a"], ["b"]])
+        tdf.add_data_row_predicate("t", interrupt, "boolean")
+        dat = tdf.TicDat(t=[[1, 1]])
+        self.assertTrue(set(tdf.find_data_row_failures(dat, exception_handling="Handled as Failure")) ==
+                        {("t", "boolean")} ==
+                        set(tdf.find_all_failures(dat, exception_handling="Handled as Failure").data_row))
+        tdf = TicDatFactory(t=[["a"], ["b"]])
+        tdf.add_data_row_predicate("t", interrupt, "error message", predicate_failure_response="Error Message")
+        for find in [tdf.find_data_row_failures, tdf.find_all_failures]:
+            with self.assertRaises(Interrupt):
+                find(dat, exception_handling="Handled as Failure")
+
     def test_fk_max_failures(self):
         tdf = TicDatFactory(**dietSchema())
         addDietForeignKeys(tdf)
@@ -1902,6 +1957,29 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(set(i_fails.data_row_failures["Predicate Name"]) ==
                         {'little stuff test a', 'little stuff test b'})
 
+        # the row predicates see the null cells of a TicDat as nan (or NaT), just as for the equivalent PanDat
+        seen = []
+        def positive(row):
+            seen.append((row["Size"], row["Start"]))
+            return row["Size"] > 0
+        tdf = TicDatFactory(table=[["Name"], ["Size", "Start"]])
+        tdf.add_data_row_predicate("table", positive, "positive")
+        tdf.add_data_row_predicate("table", lambda row: row["Start"] is not None, "has start")
+        tdf.set_data_type("table", "Size", min=0, max=10, nullable=True)
+        tdf.set_data_type("table", "Start", datetime=True, nullable=True)
+        pdf = PanDatFactory.create_from_full_schema(tdf.schema(include_ancillary_info=True))
+        pdf.add_data_row_predicate("table", positive, "positive")
+        pdf.add_data_row_predicate("table", lambda row: row["Start"] is not None, "has start")
+        dat = tdf.TicDat(table=[["a", None, None], ["b", 0, datetime.datetime(2020, 1, 1)], ["c", 2, None]])
+        i_fails = _integrity_solve(tdf, dat)
+        self.assertTrue(i_fails._len_dict() == {'data_row_failures': 2})
+        self.assertTrue(list(i_fails.data_row_failures["Field 1"]) == ["a", "b"])
+        self.assertTrue(math.isnan(seen[0][0]) and pd.isnull(seen[0][1]) and seen[0][1] is not None)
+        tdf_seen, seen[:] = list(seen), []
+        self.assertTrue(list(_integrity_solve(pdf, tdf.copy_to_pandas(dat, reset_index=True))
+                             .data_row_failures["Field 1"]) == ["a", "b"])
+        self.assertTrue([type(_) for _ in tdf_seen[0]] == [type(_) for _ in seen[0]])
+
     def test_149(self):
         self.assertTrue(pd, "pandas needs to be installed for this unit test")
         tdf = TicDatFactory(**dietSchema())
@@ -2021,6 +2099,433 @@ class TestUtils(unittest.TestCase):
             self.assertTrue((not tdf.find_data_type_failures(tdat2)) == (i == 0))
             self.assertTrue((not pdf.find_data_type_failures(pdat2)) == (i == 0))
 
+    def test_validation_stamps(self):
+        tdf = TicDatFactory(**dietSchema())
+        tdf2 = TicDatFactory(data=[[], ["a", "b"]], pks=[["a"], []])
+        dat = tdf.copy_tic_dat(dietData())
+        dat2 = tdf2.TicDat(data=[[1, 2], [3, 4]], pks=[[1], [2]])
+        for _tdf, _dat in [[tdf, dat], [tdf2, dat2]]:
+            self.assertTrue(_tdf.good_tic_dat_object(_dat) and _tdf.good_tic_dat_object(_dat, row_checking="strict"))
+            self.assertTrue(_tdf.good_tic_dat_object(_dat))
+        self.assertTrue(dat.foods._validation_stamps["strict"] == dat.foods._version)
+        dat.foods["new food"] = {"cost": 3}
+        self.assertTrue(dat.foods._validation_stamps["strict"] != dat.foods._version)
+        self.assertTrue(tdf.good_tic_dat_object(dat))
+        dat.nutritionQuantities.update({"bad key length": {"qty": 3}})
+        self.assertFalse(tdf.good_tic_dat_object(dat))
+        dat.nutritionQuantities.pop("bad key length")
+        self.assertTrue(tdf.good_tic_dat_object(dat))
+        dat.foods |= {"another food": {"cost": 4}}
+        self.assertTrue(tdf.good_tic_dat_object(dat))
+        dat.foods |= {"bad food": {"zzz": 1}}
+        self.assertFalse(tdf.good_tic_dat_object(dat))
+        dat.foods.pop("bad food")
+        self.assertTrue(tdf.good_tic_dat_object(dat))
+        dat.foods.pop("another food")
+        dat2.pks[1]["junk"] = 12 # data-less rows are mutable dicts, and are thus always rechecked
+        self.assertFalse(tdf2.good_tic_dat_object(dat2))
+        dat2.pks[1].pop("junk")
+        dat2.data.append({"a": 5, "b": 6})
+        self.assertTrue(tdf2.good_tic_dat_object(dat2))
+        dat2.data._list.append(12) # bypassing the mutation counter is a hack, but the stamp fails closed
+        self.assertFalse(tdf2.good_tic_dat_object(dat2))
+        dat2.data._list.pop()
+        self.assertTrue(tdf2.good_tic_dat_object(dat2))
+        class SubTable(type(dat.foods)):
+            pass
+        dat.foods = SubTable(dat.foods) # a subclass could mutate without bumping _version
+        self.assertTrue(tdf.good_tic_dat_object(dat) and "strict" not in dat.foods._validation_stamps)
+        for _tdf, _dat in [[tdf, dat], [tdf2, dat2]]:
+            _dat = _tdf.freeze_me(_dat)
+            self.assertTrue(_tdf.good_tic_dat_object(_dat))
+            _t = _dat.categories if _tdf is tdf else _dat.pks
+            self.assertTrue(_t._validation_stamps.get("generous") == _t._version)
+            self.assertTrue(firesException(lambda: _t.__ior__({})))
+            self.assertTrue(_tdf.good_tic_dat_object(_dat))
+            self.assertFalse(TicDatFactory(**{t: [[], ["a", "b", "c"]] for t in _tdf.all_tables}).
+                             good_tic_dat_object(_dat))
+
+    def test_changes_since(self):
+        tdf = TicDatFactory(t=[["a"], ["b"]], l=[[], ["x"]], s=[["k1", "k2"], []])
+        dat = tdf.TicDat(t=[[1, 2], [2, 3], [3, 4]], l=[[1]], s=[[5, 6]])
+        self.assertTrue(firesException(lambda: tdf.changes_since(dat, 0)))
+        token = tdf.track_changes(dat)
+        self.assertFalse(tdf.changes_since(dat, token))
+        dat.t[1]["b"] = 10
+        dat.t[4] = [5]
+        del dat.t[2]
+        dat.t[7]["b"] = 3 # inserted then deleted, so cancels out
+        dat.t.pop(7)
+        dat.t.pop(3)
+        dat.t[3] = 8 # deleted then inserted is an update
+        dat.s["new", "key"]
+        token_2 = tdf.track_changes(dat)
+        changes = tdf.changes_since(dat, token)
+        self.assertTrue(set(changes) == {"t", "s"})
+        self.assertTrue(changes["t"] == ({4}, {1, 3}, {2}) and changes["s"] == ({("new", "key")}, set(), set()))
+        dat.l.append([3])
+        dat.t[4]["b"] = 0
+        dat.s.clear()
+        changes = tdf.changes_since(dat, token_2)
+        self.assertTrue(changes == {"l": (None, None, None), "t": (set(), {4}, set()),
+                                    "s": (set(), set(), {(5, 6), ("new", "key")})})
+        token_3 = tdf.track_changes(dat)
+        dat.t.update((k, {"b": k}) for k in [1, 20]) # a one pass generator
+        self.assertTrue(20 in dat.t and dat.t[1]["b"] == 1)
+        self.assertTrue(tdf.changes_since(dat, token_3) == {"t": ({20}, {1}, set())})
+        self.assertTrue(tdf.good_tic_dat_object(dat))
+        self.assertTrue(firesException(lambda: tdf.track_changes(tdf.freeze_me(tdf.TicDat()))))
+    def test_diff(self):
+        tdf = TicDatFactory(**dietSchema())
+        dat = tdf.copy_tic_dat(dietData())
+        self.assertFalse(tdf.diff(dat, tdf.copy_tic_dat(dat)))
+        dat2 = tdf.copy_tic_dat(dat)
+        dat2.foods["pizza"]["cost"] += 1
+        dat2.foods["new food"] = 3
+        del dat2.nutritionQuantities["milk", "fat"]
+        dat2.categories["fat"]["maxNutrition"] *= 1 + 1e-8
+        diff = tdf.diff(dat, dat2)
+        self.assertTrue(set(diff) == {"foods", "nutritionQuantities", "categories"})
+        self.assertTrue(diff["foods"].added == {"new food"} and not diff["foods"].removed)
+        self.assertTrue(diff["foods"].changed == {"pizza": {"cost": (dat.foods["pizza"]["cost"],
+                                                                     dat2.foods["pizza"]["cost"])}})
+        self.assertTrue(diff["nutritionQuantities"] == (set(), {("milk", "fat")}, {}))
+        self.assertTrue(set(tdf.diff(dat, dat2, epsilon=1e-5)) == {"foods", "nutritionQuantities"})
+        self.assertTrue(tdf.diff(dat2, dat)["foods"].removed == {"new food"})
+
+        tdf = TicDatFactory(t=[["a"], ["b"]], l=[[], ["x", "y"]])
+        dat = tdf.TicDat(t=[[1, float("nan")]], l=[[1, 2], [1, 2], [3, None]])
+        dat2 = tdf.TicDat(t=[[1, float("nan")]], l=[[1, 2], [3, None], [4, 5]])
+        self.assertTrue(set(tdf.diff(dat, dat2)) == {"t", "l"})
+        diff = tdf.diff(dat, dat2, nans_are_same_for_data_rows=True)
+        self.assertTrue(diff == {"l": ([(4, 5)], [(1, 2)], {})})
+
+    def test_find_all_failures(self):
+        def normalized(d):
+            return {k: tuple(map(set, v)) if k.__class__.__name__ != "TablePredicateName" else set(v)
+                    for k, v in d.items()}
+        def check(tdf, dat):
+            all_failures = tdf.find_all_failures(dat)
+            self.assertTrue(all_failures.duplicates == {})
+            self.assertTrue(normalized(all_failures.data_type) == normalized(tdf.find_data_type_failures(dat)))
+            self.assertTrue(normalized(all_failures.data_row) == normalized(tdf.find_data_row_failures(dat)))
+            self.assertTrue(normalized(all_failures.foreign_key) ==
+                            normalized(tdf.find_foreign_key_failures(dat)))
+            return all_failures
+        tdf = TicDatFactory(**dietSchema())
+        addDietForeignKeys(tdf)
+        self.assertFalse(any(check(tdf, tdf.copy_tic_dat(dietData()))))
+        tdf = TicDatFactory(**dietSchema())
+        addDietForeignKeys(tdf)
+        tdf.set_data_type("foods", "cost", max=2)
+        tdf.add_data_row_predicate("categories", lambda r: r["minNutrition"] <= r["maxNutrition"] - 100)
+        tdf.add_data_row_predicate("foods", lambda r: "Bad" if r["cost"] > 2.2 else True, "pricey",
+                                   predicate_failure_response="Error Message")
+        tdf.add_data_row_predicate("foods", lambda r, x: True, "kwargs", predicate_kwargs_maker=lambda dat: 7)
+        dat = tdf.copy_tic_dat(dietData())
+        dat.nutritionQuantities["junk", "fat"] = dat.nutritionQuantities["junk", "junk2"] = 3
+        all_failures = check(tdf, dat)
+        self.assertTrue(all(all_failures[1:]))
+        self.assertTrue(all_failures.data_row["foods", "kwargs"].primary_key == "*")
+
+        tdf = TicDatFactory(**netflowSchema())
+        addNetflowForeignKeys(tdf)
+        tdf.set_data_type("arcs", "capacity", max=100)
+        dat = tdf.copy_tic_dat(netflowData())
+        dat.cost["Pencils", "Detroit", "Boston"] = dat.inflow["Pens", "Atlanta"] = 5
+        self.assertTrue(all(check(tdf, dat)[1::2]))
+
+        tdf = TicDatFactory(parent=[["a"], ["b"]], child=[[], ["a", "b"]])
+        tdf.add_foreign_key("child", "parent", [["a", "a"], ["b", "b"]])
+        tdf.set_data_type("child", "b", nullable=True)
+        dat = tdf.TicDat(parent=[[1, 2], [3, 4]], child=[[1, 2], [1, 3], [3, 4], [2, None]])
+        self.assertTrue(normalized(check(tdf, dat).foreign_key) ==
+                        {tdf.foreign_keys[0]: ({(1, 3), (2, None)}, {1, 3})})
+
+    def test_find_failures_since(self):
+        tdf = TicDatFactory(**dietSchema())
+        addDietForeignKeys(tdf)
+        tdf.set_data_type("foods", "cost", max=3)
+        tdf.add_data_row_predicate("nutritionQuantities", lambda r: r["qty"] < 100, "small")
+        dat = tdf.copy_tic_dat(dietData())
+        dat.nutritionQuantities["milk", "fat"] = 1000 # a failure from before the checkpoint isn't revisited
+        token = tdf.track_changes(dat)
+        self.assertFalse(any(tdf.find_failures_since(dat, token)))
+        dat.foods["gold"] = 100
+        dat.nutritionQuantities["gold", "fat"] = 101
+        dat.nutritionQuantities["junk", "fat"] = 1
+        failures = tdf.find_failures_since(dat, token)
+        self.assertTrue(failures.data_type == {("foods", "cost"): ((100,), ("gold",))})
+        self.assertTrue(failures.data_row == {("nutritionQuantities", "small"): (("gold", "fat"),)})
+        self.assertTrue({k.foreign_table: v for k, v in failures.foreign_key.items()} ==
+                        {"foods": (("junk",), (("junk", "fat"),))})
+        self.assertTrue(("milk", "fat") in tdf.find_all_failures(dat).data_row["nutritionQuantities", "small"])
+        token = tdf.track_changes(dat)
+        del dat.categories["fat"]
+        failures = tdf.find_failures_since(dat, token)
+        self.assertTrue(not any(failures[:3]) and {k.foreign_table for k in failures.foreign_key} == {"categories"})
+        self.assertTrue(set(failures.foreign_key[next(iter(failures.foreign_key))].native_pks) ==
+                        {k for k in dat.nutritionQuantities if k[1] == "fat"})
+        self.assertTrue(dat.nutritionQuantities._fk_lookups) # the orphans were found with a look up index
+        dat.categories["fiber"] = [0, 10]
+        dat.nutritionQuantities["milk", "fiber"] = 1
+        dat.nutritionQuantities["chicken", "fat"] = 1 # inserted then deleted, leaving a stale key in the index
+        del dat.nutritionQuantities["chicken", "fat"]
+        token = tdf.track_changes(dat)
+        del dat.categories["fiber"]
+        failures = tdf.find_failures_since(dat, token)
+        self.assertTrue({k.foreign_table: set(v.native_pks) for k, v in failures.foreign_key.items()} ==
+                        {"categories": {("milk", "fiber")}})
+
+    def test_sampled_failures(self):
+        tdf = TicDatFactory(t=[["a"], ["b"]], l=[[], ["x"]])
+        tdf.set_data_type("t", "b", max=49)
+        tdf.add_data_row_predicate("l", lambda r: r["x"] % 2 == 0, "even")
+        tdf.add_data_row_predicate("t", lambda r, y: True, "bad kwargs", predicate_kwargs_maker=lambda dat: 0)
+        dat = tdf.TicDat(t=[[i, i] for i in range(100)], l=[[i] for i in range(1000)])
+        sampled = tdf.find_data_type_failures(dat, sample=0.2, sample_seed=1)
+        self.assertTrue(sampled.sample_sizes == {"t": (20, 100)} and sampled.may_be_undercounted)
+        fails = sampled.failures["t", "b"]
+        self.assertTrue(set(fails.pks) == set(fails.bad_values) and all(_ >= 49 for _ in fails.pks))
+        self.assertTrue(sampled.estimated_failure_rates == {("t", "b"): len(fails.pks) / 20})
+        self.assertTrue(sampled == tdf.find_data_type_failures(dat, sample=0.2, sample_seed=1))
+        sampled = tdf.find_data_row_failures(dat, sample=100, sample_seed=2)
+        self.assertTrue(sampled.sample_sizes == {"t": (100, 100), "l": (100, 1000)} and sampled.may_be_undercounted)
+        self.assertTrue(all(_ % 2 for _ in sampled.failures["l", "even"]) and
+                        0 < sampled.estimated_failure_rates["l", "even"] < 1)
+        self.assertTrue(sampled.estimated_failure_rates["t", "bad kwargs"] == 1)
+        sampled = tdf.find_data_row_failures(dat, sample=1.0)
+        self.assertFalse(sampled.may_be_undercounted)
+        self.assertTrue(sampled.failures == tdf.find_data_row_failures(dat) and
+                        sampled.estimated_failure_rates["l", "even"] == 0.5)
+        self.assertTrue(firesException(lambda: tdf.find_data_type_failures(dat, sample=1.5)))
+        self.assertTrue(tdf.find_data_row_failures(dat, sample=1).sample_sizes["l"] == (1, 1000))
+        self.assertTrue(tdf.find_data_row_failures(dat, sample=utils.numpy.int64(3)).sample_sizes["l"] == (3, 1000))
+        for bad in [True, False, 0, -2, 0.0, "0.5"]:
+            self.assertTrue(firesException(lambda: tdf.find_data_row_failures(dat, sample=bad)))
+
+    def test_row_predicate_stats(self):
+        f = TicDatFactory(t=[["a"], ["b"]])
+        f.add_data_row_predicate("t", lambda r: r["b"] > -1, "rare")
+        f.add_data_row_predicate("t", lambda r: r["b"] % 2 == 0, "common")
+        f.add_data_row_predicate("t", lambda r: 1 / r["b"] > 0, "exception", predicate_failure_response="Error Message")
+        dat = f.TicDat(t=[[i, i] for i in range(100)])
+        stats = {}
+        fails = f.find_data_row_failures(dat, exception_handling="Handled as Failure", stats=stats)
+        self.assertTrue(set(stats) == {("t", "rare"), ("t", "common"), ("t", "exception")})
+        self.assertTrue(all(_.calls == 100 and _.wall_time >= 0 for _ in stats.values()))
+        self.assertTrue([stats["t", _].failures for _ in ["rare", "common", "exception"]] == [0, 50, 1])
+        self.assertTrue([stats["t", _].exceptions for _ in ["rare", "common", "exception"]] == [0, 0, 1])
+        self.assertTrue(set(fails) == {("t", "common"), ("t", "exception")})
+        fails = f.find_data_row_failures(dat, exception_handling="Handled as Failure", stats=stats,
+                                         order_by_stats=True, max_failures=1)
+        self.assertTrue(set(fails) == {("t", "common")} and stats["t", "common"].failures > 50)
+        self.assertTrue(stats["t", "rare"].calls == 100)
+        self.assertTrue(firesException(lambda: f.find_data_row_failures(dat, order_by_stats=True)))
+
+    def test_kwargs_cache(self):
+        f = TicDatFactory(t=[["a"], ["b"]], p=[["c"], []])
+        calls = []
+        def make_kwargs(dat):
+            calls.append(1)
+            return {"bound": len(dat.p)}
+        f.add_data_row_predicate("t", lambda r, bound: r["b"] < bound, "bound", predicate_kwargs_maker=make_kwargs)
+        dat = f.TicDat(t=[[i, i] for i in range(4)], p=[[0], [1]])
+        cache = {}
+        for _ in range(3):
+            fails = f.find_data_row_failures(dat, kwargs_cache=cache)
+            self.assertTrue(len(calls) == 1 and len(fails[("t", "bound")]) == 2)
+        dat.t[3]["b"] = 30
+        fails = f.find_data_row_failures(dat, kwargs_cache=cache)
+        self.assertTrue(len(calls) == 2 and len(fails[("t", "bound")]) == 2)
+        dat.p[2] = {}
+        fails = f.find_data_row_failures(dat, kwargs_cache=cache)
+        self.assertTrue(len(calls) == 3 and len(fails[("t", "bound")]) == 1)
+        f.find_data_row_failures(dat, kwargs_cache=cache)
+        f.find_data_row_failures(dat)
+        self.assertTrue(len(calls) == 4)
+        self.assertTrue(firesException(lambda: f.find_data_row_failures(dat, kwargs_cache=[])))
+        # t counts the edits to its rows, but the rows of p are editable dicts, so p is digested until frozen
+        self.assertTrue([len(_) for _ in f._content_stamp(dat)] == [2, 5])
+        self.assertTrue([len(_) for _ in f._content_stamp(f.freeze_me(f.copy_tic_dat(dat)))] == [5, 5])
+        stamp = f._content_stamp(dat)
+        self.assertTrue(stamp == f._content_stamp(dat) != f._content_stamp(f.copy_tic_dat(dat)))
+        dat.t[0] = dat.t[0]
+        self.assertTrue(stamp != f._content_stamp(dat))
+
+        f = TicDatFactory(t=[["a"], ["b", "c"]], p=[["c"], ["d"]])
+        f.add_data_row_predicate("t", lambda r, bound: r["b"] < bound, "bound",
+                                 predicate_kwargs_maker=lambda dat: {"bound": dat.p[0]["d"]})
+        dat = f.TicDat(t=[[1, -2, float("nan")]], p=[[0, -1]])
+        cache = {}
+        self.assertTrue(f.find_data_row_failures(dat, kwargs_cache=cache) == {})
+        dat.p[0]["d"] = -2
+        self.assertTrue(set(f.find_data_row_failures(dat, kwargs_cache=cache)) == {("t", "bound")})
+        # the tables of other objects don't count their edits, so they are digested instead
+        plain = lambda dat_: SimpleNamespace(**{t: {k: dict(r) for k, r in getattr(dat_, t).items()}
+                                                for t in f.all_tables})
+        plain_dat, cache = plain(dat), {}
+        self.assertTrue(f._content_stamp(plain_dat) == f._content_stamp(plain(dat))) # nan doesn't spoil the stamp
+        self.assertTrue(set(f.find_data_row_failures(plain_dat, kwargs_cache=cache)) == {("t", "bound")})
+        plain_dat.p[0]["d"] = -1 # hash(-1) == hash(-2) in CPython, but the stamp still changes
+        self.assertTrue(f.find_data_row_failures(plain_dat, kwargs_cache=cache) == {})
+
+    def test_fingerprint(self):
+        tdf = TicDatFactory(**dietSchema())
+        dat = tdf.copy_tic_dat(dietData())
+        fp = tdf.fingerprint(dat)
+        self.assertTrue(set(fp.tables) == set(tdf.all_tables) and fp == tdf.fingerprint(tdf.copy_tic_dat(dat)))
+        dat2 = tdf.TicDat(**{t: dict(reversed(list(getattr(dat, t).items()))) for t in tdf.all_tables})
+        self.assertTrue(tdf.fingerprint(dat2) == fp)
+        dat2.foods["pizza"]["cost"] += 1
+        fp2 = tdf.fingerprint(dat2)
+        self.assertTrue(fp2.overall != fp.overall and fp2.tables["foods"] != fp.tables["foods"])
+        self.assertTrue(all(fp2.tables[t] == fp.tables[t] for t in tdf.all_tables if t != "foods"))
+        dat2.foods["pizza"]["cost"] = dat.foods["pizza"]["cost"]
+        self.assertTrue(tdf.fingerprint(dat2) == fp)
+
+        tdf = TicDatFactory(t=[["a"], ["b", "c"]], l=[[], ["x", "y"]])
+        tdf.set_data_type("t", "c", datetime=True)
+        dat = tdf.TicDat(t=[[1, float("inf"), datetime.datetime(2020, 1, 1)]], l=[[1, 2], [1, 2], [3, None]])
+        dat2 = tdf.TicDat(t=[[1, 100, "2020-01-01"]], l=[[3, None], [1.0, 2], [1, 2]])
+        self.assertTrue(tdf.fingerprint(dat).tables["l"] == tdf.fingerprint(dat2).tables["l"])
+        self.assertTrue(tdf.fingerprint(dat).tables["t"] != tdf.fingerprint(dat2).tables["t"])
+        tdf.set_infinity_io_flag(100)
+        self.assertTrue(tdf.fingerprint(dat) == tdf.fingerprint(dat2))
+        dat2.l.pop()
+        self.assertTrue(tdf.fingerprint(dat).tables["l"] != tdf.fingerprint(dat2).tables["l"])
+
+    def test_expression_row_predicates(self):
+        tdf = TicDatFactory(categories=[["Name"], ["Min Nutrition", "Max Nutrition"]])
+        tdf.add_data_row_predicate("categories", "Min Nutrition <= Max Nutrition", "min max")
+        tdf.add_data_row_predicate("categories", "`Max Nutrition` > 0 or `Max Nutrition` is None", "positive")
+        self.assertTrue(firesException(lambda: tdf.add_data_row_predicate("categories", "Name.lower()")))
+        self.assertTrue(firesException(lambda: tdf.add_data_row_predicate("categories", "Nmae == 'a'")))
+        self.assertTrue(firesException(lambda: tdf.add_data_row_predicate("categories", "Name is 'a'")))
+        dat = tdf.TicDat(categories=[["a", 1, 2], ["b", 3, 2], ["c", None, 2], ["d", 0, -1], ["e", 0, None]])
+        fails = tdf.find_data_row_failures(dat)
+        self.assertTrue({k: set(v) for k, v in fails.items()} ==
+                        {("categories", "min max"): {"b", "c", "d", "e"}, ("categories", "positive"): {"d"}})
+        expression = tdf.get_row_predicates("categories")["min max"].predicate
+        self.assertTrue(expression({"Min Nutrition": 1, "Max Nutrition": 1}) and
+                        not expression({"Min Nutrition": float("nan"), "Max Nutrition": 1}))
+        tdf = TicDatFactory(**tdf.schema())
+        tdf.add_data_row_predicate("categories", "`Max Nutrition` / `Min Nutrition` >= 1", "ratio")
+        tdf.add_data_row_predicate("categories", "(`Max Nutrition` / `Min Nutrition`) is None", "no ratio")
+        tdf.add_data_row_predicate("categories", "not (1 < -`Min Nutrition` + 2 <= 1.5) and 1/0 is None", "chain")
+        fails = tdf.find_data_row_failures(tdf.copy_tic_dat(dat))
+        self.assertTrue({k: set(v) for k, v in fails.items()} ==
+                        {("categories", "ratio"): {"b", "c", "d", "e"}, ("categories", "no ratio"): {"a", "b"}})
+
+    def test_aggregate_checks(self):
+        tdf = TicDatFactory(commodities=[["Name"], ["Supply"]], demands=[["Customer", "Commodity"], ["Quantity"]])
+        tdf.add_aggregate_check("demands", "Commodity", ("sum", "Quantity"), "commodities", "<= Supply", "supply")
+        tdf.add_aggregate_check("demands", "Commodity", "count", "commodities", ">= 1", "has demand")
+        tdf.add_aggregate_check("demands", "Customer", ("max", "Quantity"), comparison="<= 10", check_name="max")
+        self.assertTrue(firesException(lambda: tdf.add_aggregate_check("demands", "Commodity", "count",
+                                                                       comparison="<= Supply")))
+        self.assertTrue(firesException(lambda: tdf.add_aggregate_check("demands", "Commodity", ("median", "Quantity"))))
+        self.assertTrue(firesException(lambda: tdf.add_aggregate_check("demands", ["Customer", "Commodity"], "count",
+                                                                       "commodities")))
+        dat = tdf.TicDat(commodities=[["a", 10], ["b", 5], ["c", 3]],
+                         demands=[["x", "a", 6], ["y", "a", 6], ["x", "b", 5], ["z", "b", None]])
+        fails = tdf.find_aggregate_check_failures(dat)
+        self.assertTrue(fails == {("demands", "supply"): ("a",), ("demands", "has demand"): ("c",),
+                                  ("demands", "max"): ("z",)})
+        dat.demands["y", "a"]["Quantity"] = 4
+        dat.demands["z", "c"] = 1
+        dat.demands["z", "b"]["Quantity"] = 0
+        self.assertFalse(tdf.find_aggregate_check_failures(dat))
+        self.assertTrue(set(tdf.clone().get_aggregate_checks("demands")) == {"supply", "has demand", "max"})
+        self.assertFalse(tdf.clone(table_restrictions={"demands"}).get_aggregate_checks("demands").get("supply"))
+
+        import sqlite3
+        dat.demands["y", "a"]["Quantity"] = 6
+        dat.demands["z", "b"]["Quantity"] = None
+        del dat.demands["z", "c"]
+        con = sqlite3.connect(":memory:")
+        con.execute('CREATE TABLE commodities (Name, Supply)')
+        con.execute('CREATE TABLE demands (Customer, Commodity, Quantity)')
+        con.executemany("INSERT INTO commodities VALUES (?, ?)", [[k, r["Supply"]] for k, r in dat.commodities.items()])
+        con.executemany("INSERT INTO demands VALUES (?, ?, ?)", [list(k) + [r["Quantity"]]
+                                                                 for k, r in dat.demands.items()])
+        for cn, ac in tdf.get_aggregate_checks("demands").items():
+            self.assertTrue(tuple(_[0] for _ in con.execute(ac.sql())) == fails["demands", cn])
+
+        tdf = TicDatFactory(supplies=[["Warehouse", "Commodity"], ["Supply"]],
+                            demands=[["Customer", "Commodity"], ["Quantity"]])
+        tdf.add_aggregate_check("demands", "Commodity", ("sum", "Quantity"), "supplies", "<= sum(Supply)",
+                                "supply", parent_group_by="Commodity")
+        tdf.add_aggregate_check("demands", "Commodity", "count", "supplies", ">= 1", "has demand",
+                                parent_group_by="Commodity")
+        self.assertTrue(firesException(lambda: tdf.add_aggregate_check("demands", "Commodity", "count", "supplies",
+                                                                       "<= Supply", parent_group_by="Commodity")))
+        self.assertTrue(firesException(lambda: tdf.add_aggregate_check("demands", "Commodity", "count",
+                                                                       parent_group_by="Commodity")))
+        self.assertTrue(firesException(lambda: tdf.add_aggregate_check("demands", "Commodity", "count", "supplies",
+                                                                       "<= sum(Quantity)", parent_group_by="Commodity")))
+        dat = tdf.TicDat(supplies=[["w1", "a", 5], ["w2", "a", 5], ["w1", "b", 4], ["w1", "c", None]],
+                         demands=[["x", "a", 6], ["y", "a", 4], ["x", "b", 5], ["z", "b", None]])
+        fails = tdf.find_aggregate_check_failures(dat)
+        self.assertTrue(fails == {("demands", "supply"): ("b",), ("demands", "has demand"): ("c",)})
+        con = sqlite3.connect(":memory:")
+        con.execute('CREATE TABLE supplies (Warehouse, Commodity, Supply)')
+        con.execute('CREATE TABLE demands (Customer, Commodity, Quantity)')
+        for t in ["supplies", "demands"]:
+            con.executemany(f"INSERT INTO {t} VALUES (?, ?, ?)", [list(k) + list(r.values())
+                                                                  for k, r in getattr(dat, t).items()])
+        for cn, ac in tdf.get_aggregate_checks("demands").items():
+            self.assertTrue(tuple(_[0] for _ in con.execute(ac.sql())) == fails["demands", cn])
+        dat.supplies["w2", "b"] = 1
+        dat.demands["z", "c"] = 0
+        self.assertFalse(tdf.find_aggregate_check_failures(dat))
+
+    def test_data_type_failures_by_column(self):
+        tdf = TicDatFactory(t=[["a", "b"], ["c", "d"]], l=[[], ["c", "d"]])
+        tdf.set_data_type("t", "b", number_allowed=True, must_be_int=True, min=0, max=10)
+        for t in ["t", "l"]:
+            tdf.set_data_type(t, "c", number_allowed=True, min=0, max=10, inclusive_max=False)
+            tdf.set_data_type(t, "d", number_allowed=False, strings_allowed=["x", "y"], nullable=True)
+        rows = [[1, 2, 3, "x"], [2, 2.5, 10, None], [3, 3, True, "z"], [4, 4, 1, ("x",)], [None, 5, float("nan"), "y"],
+                [6, 6, 1.0, float("nan")], [7, 7, 11, ("x",)]]
+        dat = tdf.TicDat(t=rows, l=[r[2:] for r in rows])
+        fails = tdf.find_data_type_failures(dat)
+        brute_force = {}
+        for t, data_types in tdf._true_data_types().items():
+            for pk, row in tdf._full_rows(dat, t):
+                for f, dt in data_types.items():
+                    if not dt.valid_data(row[f]):
+                        brute_force.setdefault((t, f), set()).add(pk)
+        self.assertTrue({k: set(v.pks) for k, v in fails.items()} == dict(brute_force))
+        self.assertTrue(set(fails["t", "c"].pks) == {(2, 2.5), (3, 3), (None, 5), (7, 7)})
+        self.assertTrue(set(fails["l", "d"].pks) == {2, 3, 6})
+        self.assertTrue(tdf.data_types["t"]["d"]._invalid_positions(["x", ["x"], None, "z"]) == [1, 3])
+        self.assertTrue(tdf._true_data_types() is tdf._true_data_types())
+        self.assertTrue(len(tdf.find_data_type_failures(dat, max_failures=3)) <= 3)
+
+    def test_shared_full_rows(self):
+        tdf = TicDatFactory(t=[["a"], ["b"]], l=[[], ["c"]])
+        rows_seen = []
+        def first(row):
+            rows_seen.append(row)
+            return row["b"] > 0
+        tdf.add_data_row_predicate("t", first, "first")
+        tdf.add_data_row_predicate("t", lambda row: rows_seen.append(row) or row["a"] != 2, "second")
+        tdf.add_data_row_predicate("t", lambda row, bound: 1 / row["b"] < bound or None, "third",
+                                   predicate_kwargs_maker=lambda dat: {"bound": 1},
+                                   predicate_failure_response="Error Message")
+        tdf.add_data_row_predicate("l", lambda row: row["c"] > 0, "only")
+        dat = tdf.TicDat(t=[[1, 1], [2, 0], [3, 2]], l=[[1], [0]])
+        stats = {}
+        fails = tdf.find_data_row_failures(dat, exception_handling="Handled as Failure", stats=stats)
+        self.assertTrue(len(rows_seen) == 6 and all(rows_seen[i] is rows_seen[i + 1] for i in range(0, 6, 2)))
+        self.assertTrue(stats["t", "first"].calls == stats["t", "third"].calls == 3)
+        self.assertTrue(fails["t", "first"] == (2,) and fails["t", "second"] == (2,) and fails["l", "only"] == (1,))
+        self.assertTrue({k: v for k, v in fails["t", "third"]} == {1: "None", 2: "Exception<division by zero>"})
+        self.assertTrue(stats["t", "third"].exceptions == 1 and stats["t", "first"].exceptions == 0)
+        self.assertTrue(firesException(lambda: tdf.find_data_row_failures(dat, exception_handling="Unhandled")))
+
+
 _scratchDir = TestUtils.__name__ + "_scratch"
 
 # Run the tests.
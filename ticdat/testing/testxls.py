@@ -9,6 +9,8 @@ import ticdat.xls as ticdat_xlsx
 import shutil
 import unittest
 import datetime
+import re
+import zipfile
 try:
     import dateutil, dateutil.parser
 except:
@@ -655,6 +657,46 @@ class TestXls(unittest.TestCase):
         sheet = book["data"]
         self.assertTrue(sheet.max_row == 4) # 1 based indexing, the column row, three data rows (BUT NOT 5 DATA ROWS)
 
+    def testRaggedRows(self):
+        file_path = os.path.join(_scratchDir, "ragged_rows.xlsx")
+        book = ticdat_xlsx.openpyxl.Workbook()
+        sheet = book.active
+        sheet.title = "data"
+        for row in [["a", "b"], ["x", 1], ["y"], ["z", 3]]:
+            sheet.append(row)
+        sheet["A7"] = None # extends the recorded dimensions of the sheet past the last non empty row
+        book.save(file_path)
+        tdf = TicDatFactory(data=[["a"], ["b"]])
+        dat = tdf.xls.create_tic_dat(file_path)
+        self.assertTrue(tdf._same_data(dat, tdf.TicDat(data=[["x", 1], ["y", None], ["z", 3]])))
+        tdf = TicDatFactory(data=[[], ["a", "b"]])
+        dat = tdf.xls.create_tic_dat(file_path)
+        self.assertTrue(tdf._same_data(dat, tdf.TicDat(data=[["x", 1], ["y", None], ["z", 3]])))
+        tdf.set_xlsx_trailing_empty_rows("ignore")
+        dat = tdf.xls.create_tic_dat(file_path)
+        self.assertTrue(len(dat.data) == 6 and all(r["a"] is None for r in dat.data[3:]))
+        os.remove(file_path) # the read_only workbook has released the file
+
+    def testStaleDimensions(self):
+        if not self.can_run:
+            return
+        file_path = os.path.join(_scratchDir, "stale_dimensions.xlsx")
+        tdf = TicDatFactory(data=[["a"], ["b"]])
+        dat = tdf.TicDat(data=[["v", 1], ["w", 2], ["x", 3], ["y", 4]])
+        for dimension in ["A1:B3", "A1"]:
+            tdf.xls.write_file(dat, file_path, allow_overwrite=True)
+            with zipfile.ZipFile(file_path) as zf:
+                contents = {n: zf.read(n) for n in zf.namelist()}
+            sheet_xml = next(n for n in contents if n.startswith("xl/worksheets/") and n.endswith(".xml"))
+            contents[sheet_xml], count = re.subn(rb'<dimension ref="[^"]*"', b'<dimension ref="%s"' %
+                                                 dimension.encode(), contents[sheet_xml])
+            self.assertTrue(count == 1)
+            with zipfile.ZipFile(file_path, "w") as zf:
+                for n, c in contents.items():
+                    zf.writestr(n, c)
+            self.assertTrue(tdf._same_data(dat, tdf.xls.create_tic_dat(file_path)))
+        os.remove(file_path)
+
 
 
 _scratchDir = TestXls.__name__ + "_scratch"
@@ -4,6 +4,10 @@ PEP8
 """
 import collections as clt
 import inspect
+import functools
+import random
+import time
+import itertools
 from collections import namedtuple, defaultdict
 import ticdat.utils as utils
 from ticdat.utils import verify, freezable_factory, FrozenDict, FreezeableDict
@@ -19,6 +23,8 @@ import ticdat.jsontd as json
 from ticdat.pgtd import PostgresTicFactory
 import sys
 import math
+import hashlib
+import datetime as datetime_
 try:
     import amplpy
 except:
@@ -26,6 +32,8 @@ except:
 
 pd, DataFrame = utils.pd, utils.DataFrame # if pandas not installed will be falsey
 
+_table_serials = count() # each table made by a TicDatFactory gets a distinct _serial, see TicDatFactory._content_stamp
+
 def _keylen(k) :
     if not utils.containerish(k) :
         return 1
@@ -278,8 +286,15 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
                           Truthy if the row is valid and Falsey otherwise. (See below, there are other arguments that
                           can refine how predicate works). The row argument passed to predicate will be a dict that
                           maps field name to data value for all fields (both primary key and data field) in the table.
+                          This dict is shared by all the predicates of the table, and so predicate shouldn't modify it.
                           Note - if None is passed as a predicate, then any previously added
                           predicate matching (table, predicate_name) will be removed.
+                          Alternately, predicate can be an expression string over the fields of the table, such
+                          as "Min Nutrition <= Max Nutrition" or "Quantity > 0 or Quantity is None". See
+                          utils.RowPredicateExpression for the supported expressions. Expressions can't be combined
+                          with predicate_kwargs_maker or an "Error Message" predicate_failure_response.
+                          Expressions can also be checked by the database itself (see the find_data_row_failures
+                          functions of the sql and pgsql attributes).
 
         :param predicate_name: The name of the predicate. If omitted, the smallest non-colliding
                                number will be used.
@@ -308,7 +323,13 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
                 self._data_row_predicates[table].pop(predicate_name, None)
             return
 
-        verify(callable(predicate), "predicate should be a one argument function")
+        if utils.stringish(predicate):
+            verify(table not in self.generic_tables, "expression predicates can't be used with generic tables")
+            verify(not predicate_kwargs_maker and predicate_failure_response == "Boolean",
+                   "expression predicates can't be used with predicate_kwargs_maker or an Error Message response")
+            predicate = utils.RowPredicateExpression(predicate, self.primary_key_fields.get(table, ()) +
+                                                                self.data_fields.get(table, ()))
+        verify(callable(predicate), "predicate should be a one argument function or an expression string")
         verify(not predicate_kwargs_maker or callable(predicate_kwargs_maker),
                "predicate_kwargs_maker should be a one argument function")
         verify(predicate_failure_response in ["Boolean", "Error Message"],
@@ -330,6 +351,60 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         '''
         verify(table in self.all_tables, "Unrecognized table name %s"%table)
         return {k: v for k, v in self._data_row_predicates.get(table, {}).items()}
+    def add_aggregate_check(self, child_table, group_by, agg, parent_table=None, comparison="> 0",
+                            check_name=None, parent_group_by=None):
+        """
+        The purpose of calling add_aggregate_check is to prepare for a future call to find_aggregate_check_failures.
+
+        Adds a check that groups the rows of a table, aggregates each group, and compares the aggregate to a bound.
+        For example, the total demand for each commodity can be verified to be no larger than the supply of that
+        commodity, or each parent row can be verified to have at least one child row. The bound can also aggregate
+        the parent table, so that the total demand for each commodity can be verified to be no larger than the total
+        supply of that commodity (summed over a supply table with a row for each warehouse and commodity).
+
+        :param child_table: the table whose rows are grouped and aggregated
+
+        :param group_by: a field (or a tuple of fields) of child_table to group by
+
+        :param agg: Either "count" (the number of rows in the group) or a (aggregation, field) pair, where
+                    aggregation is one of "sum", "min", "max", "mean". Null values are skipped by the aggregation.
+
+        :param parent_table: optional. If provided, then there is a group for each row of parent_table, and the
+                             group_by fields are matched to the primary key fields of parent_table (in order). Parent
+                             rows without child rows have a count or sum of 0 (and a null min, max or mean).
+
+        :param comparison: a string with a comparison operator (one of < <= > >= == !=) and a bound. The bound is
+                           either a number, a data field of parent_table, or an aggregation (one of "sum", "min",
+                           "max", "mean") of a field of parent_table, as in "<= 100", "<= Max Supply" or
+                           "<= sum(Supply)". A group whose aggregate is null fails the check.
+
+        :param check_name: The name of the check. If omitted, the smallest non-colliding number will be used.
+
+        :param parent_group_by: optional. A field (or a tuple of fields) of parent_table to use in place of its primary
+                                key fields. There is then a group for each distinct parent_group_by value of
+                                parent_table, and a bound that is a field of parent_table needs to be aggregated.
+
+        :return:
+        """
+        verify(not self._has_been_used,
+               "The aggregate checks can't be changed after a TicDatFactory has been used.")
+        aggregate_check = utils.AggregateCheck(self, child_table, group_by, agg, parent_table, comparison,
+                                               parent_group_by)
+        if check_name is None:
+            check_name = next(i for i in count() if i not in self._aggregate_checks[child_table])
+        self._aggregate_checks[child_table][check_name] = aggregate_check
+    def get_aggregate_checks(self, table):
+        '''
+        return all the aggregate checks for a given (child) table
+
+        :param table: a table in the schema
+
+        :return: a dictionary mapping check_name to utils.AggregateCheck objects (based on the prior call to
+                 add_aggregate_check). The sql method of these objects renders the check as a GROUP BY query that
+                 can be run against a database.
+        '''
+        verify(table in self.all_tables, "Unrecognized table name %s"%table)
+        return {k: v for k, v in self._aggregate_checks.get(table, {}).items()}
 
     def add_parameter(self, name, default_value, number_allowed = True,
                       inclusive_min = True, inclusive_max = False, min = 0, max = float("inf"),
@@ -681,6 +756,7 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
                 self._default_values[tbl][fld] = 0
         self._data_types = clt.defaultdict(dict)
         self._data_row_predicates = clt.defaultdict(dict)
+        self._aggregate_checks = clt.defaultdict(dict)
         self._tooltips = {}
         self._generator_tables = []
         self._foreign_keys = clt.defaultdict(set)
@@ -688,8 +764,16 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         # using list for truthiness to work around freezing headaches
         self._foreign_key_links_enabled = []
 
-        datarowfactory = lambda t :  utils.td_row_factory(t, self.primary_key_fields.get(t, ()),
-                        self.data_fields.get(t, ()), self.default_values.get(t, {}))
+        row_factories = {}
+        def datarowfactory(t):
+            # once used, the default values are fixed, so the rows of a table can all share one row type
+            if self._has_been_used and t in row_factories:
+                return row_factories[t]
+            rtn = utils.td_row_factory(t, self.primary_key_fields.get(t, ()),
+                                       self.data_fields.get(t, ()), self.default_values.get(t, {}))
+            if self._has_been_used:
+                row_factories[t] = rtn
+            return rtn
 
         goodticdattable = self._good_tic_dat_table_for_init
         superself = self
@@ -699,33 +783,124 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
             primarykey = primarykey or  self.primary_key_fields.get(tablename, ())
             keylen = len(primarykey)
             rowfactory = rowfactory_ or datarowfactory(tablename)
+            # the type of the rows made by rowfactory, see TicDatFactory._has_current_validation_stamp
+            rowtype = rowfactory if isinstance(rowfactory, type) else utils.FreezeableDict
             if keylen > 0 :
                 class TicDatDict (FreezeableDict) :
+                    _tic_dat_factory = superself
+                    _table_name, _row_type = tablename, rowtype
+                    _change_log = None # opt-in, see TicDatFactory.track_changes
                     def __init__(self, *_args, **_kwargs):
                         super(TicDatDict, self).__init__(*_args, **_kwargs)
+                        # _version counts mutations, so that good_tic_dat_object can skip unchanged tables
+                        self._version, self._serial = 0, next(_table_serials)
+                        self._validation_stamps = {}
+                        self._fk_lookups = {} # see TicDatFactory._orphan_candidates
                         alldatadicts.append(self)
+                    def _track(self, key, action, old_row=None):
+                        if hasattr(old_row, "_on_change"):
+                            old_row._on_change = None
+                        self._change_log.append((tablename, key, action))
+                        row = dict.get(self, key) if action != "deleted" else None
+                        if hasattr(row, "_on_change"):
+                            row._on_change = functools.partial(self._change_log.append, (tablename, key, "updated"))
                     def __setitem__(self, key, value):
                         verify(containerish(key) ==  (keylen > 1) and
                                (keylen == 1 or keylen == len(key)),
                                "inconsistent key length for %s"%tablename)
-                        return super(TicDatDict, self).__setitem__(key, rowfactory(value))
+                        old_row = action = None
+                        if self._change_log is not None:
+                            old_row, action = dict.get(self, key), "updated" if key in self else "inserted"
+                        rtn = super(TicDatDict, self).__setitem__(key, rowfactory(value))
+                        self._version += 1
+                        if self._change_log is not None:
+                            self._track(key, action, old_row)
+                        return rtn
                     def __getitem__(self, item):
                         if (item not in self) and (not getattr(self, "_dataFrozen", False)):
                             self[item] = rowfactory({})
                         return super(TicDatDict, self).__getitem__(item)
+                    def __delitem__(self, key):
+                        old_row = dict.get(self, key)
+                        super(TicDatDict, self).__delitem__(key)
+                        self._version += 1
+                        if self._change_log is not None:
+                            self._track(key, "deleted", old_row)
+                    def update(self, *args, **kwargs):
+                        actions = {}
+                        if self._change_log is not None:
+                            # args might be a one pass iterator, so build the rows once and update from them
+                            args, kwargs = (dict(*args, **kwargs),), {}
+                            actions = {k: ("updated" if k in self else "inserted", dict.get(self, k))
+                                       for k in args[0]}
+                        super(TicDatDict, self).update(*args, **kwargs)
+                        self._version += 1
+                        for k, (action, old_row) in actions.items():
+                            self._track(k, action, old_row)
+                    def pop(self, key, *args):
+                        old_row = dict.get(self, key)
+                        had_key = key in self
+                        rtn = super(TicDatDict, self).pop(key, *args)
+                        self._version += 1
+                        if self._change_log is not None and had_key:
+                            self._track(key, "deleted", old_row)
+                        return rtn
+                    def popitem(self):
+                        verify(not getattr(self, "_dataFrozen", False), "Can't edit a frozen TicDatDict")
+                        rtn = super(TicDatDict, self).popitem()
+                        self._version += 1
+                        if self._change_log is not None:
+                            self._track(rtn[0], "deleted", rtn[1])
+                        return rtn
+                    def setdefault(self, key, default=None):
+                        verify(not getattr(self, "_dataFrozen", False), "Can't edit a frozen TicDatDict")
+                        had_key = key in self
+                        rtn = super(TicDatDict, self).setdefault(key, default)
+                        self._version += 1
+                        if self._change_log is not None and not had_key:
+                            self._track(key, "inserted")
+                        return rtn
+                    def clear(self):
+                        verify(not getattr(self, "_dataFrozen", False), "Can't edit a frozen TicDatDict")
+                        old_rows = list(self.items()) if self._change_log is not None else []
+                        super(TicDatDict, self).clear()
+                        self._version += 1
+                        for k, old_row in old_rows:
+                            self._track(k, "deleted", old_row)
                 assert dictish(TicDatDict)
                 return TicDatDict
             class TicDatDataList(clt.abc.MutableSequence):
+                _tic_dat_factory = superself
+                _table_name, _row_type = tablename, rowtype
+                _change_log = None # opt-in, see TicDatFactory.track_changes
                 def __init__(self, *_args):
                     self._list = list()
+                    self._version, self._serial = 0, next(_table_serials)
+                    self._validation_stamps = {}
                     self.extend(list(_args))
+                def _track(self, row=None):
+                    # keyless tables don't have keys to report, so any edit just flags the table as changed
+                    self._change_log.append((tablename, None, "changed"))
+                    if hasattr(row, "_on_change"):
+                        row._on_change = functools.partial(self._change_log.append, (tablename, None, "changed"))
                 def __len__(self): return len(self._list)
                 def __getitem__(self, i): return self._list[i]
-                def __delitem__(self, i): del self._list[i]
+                def __delitem__(self, i):
+                    del self._list[i]
+                    self._version += 1
+                    if self._change_log is not None:
+                        self._track()
                 def __setitem__(self, i, v):
                     self._list[i] = rowfactory(v)
+                    self._version += 1
+                    if self._change_log is not None:
+                        self._track(self._list[i])
                 def insert(self, i, v):
-                    self._list.insert(i, rowfactory(v))
+                    row = rowfactory(v)
+                    self._list.insert(i, row)
+                    self._version += 1
+                    if self._change_log is not None:
+                        self._track(row)
                 def __repr__(self):
                     return "td:" + self._list.__repr__()
             assert containerish(TicDatDataList) and not dictish(TicDatDataList)
@@ -777,6 +952,7 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
                 superself._trigger_has_been_used()
                 self._all_data_dicts = []
                 self._made_foreign_links = False
+                self._change_log = None # see track_changes
                 lens = {t: l for t, v in init_tables.items() for l in [utils.safe_apply(len)(v)] if l is not None}
                 for t in init_tables :
                     verify(t in superself.all_tables, "Unexpected table name %s"%t)
@@ -927,6 +1103,7 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         self._automunge_multitype_fields = [True]
         self._none_as_infinity_bias_cache = {}
         self._convert_dat = []
+        self._true_data_types_cache = []
         self._isFrozen=True
 
     @property
@@ -1066,6 +1243,41 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         if utils.numericish(self.infinity_io_flag) and utils.numericish(x):
             return max(min(x, self.infinity_io_flag), -self.infinity_io_flag)
         return x
+    def _infinity_flag_write_transform(self, t, f):
+        """
+        we expect other routines inside ticdat to access this routine, even though it starts with _
+        :param t: table name
+        :param f: field name
+        :return: None if _infinity_flag_write_cell never adjusts the cells of this field, otherwise a
+                 function that performs the adjustment on a cell value
+        """
+        if (t == "parameters" and self._parameters) or utils.numericish(self.infinity_io_flag) or \
+           self._none_as_infinity_bias(t, f):
+            return functools.partial(self._infinity_flag_write_cell, t, f)
+    def _write_rows(self, t, _t):
+        """
+        we expect other routines inside ticdat to access this routine, even though it starts with _
+        :param t: table name
+        :param _t: the table t of a TicDat object
+        :return: a generator of the rows of _t as sequences of cells (primary key fields then data fields),
+                 in table order, with the infinity flag adjustment only applied to the fields that might need it
+        """
+        pks, dfs = self.primary_key_fields.get(t, ()), self.data_fields.get(t, ())
+        transforms = [(i, transform) for i, f in enumerate(pks + dfs)
+                      for transform in [self._infinity_flag_write_transform(t, f)] if transform]
+        if dictish(_t):
+            rows = ((p_key if containerish(p_key) else (p_key,)) + tuple(data_row[f] for f in dfs)
+                    for p_key, data_row in _t.items())
+        else:
+            rows = (tuple(data_row[f] for f in dfs) for data_row in (_t if containerish(_t) else _t()))
+        if not transforms:
+            yield from rows
+            return
+        for row in rows:
+            row = list(row)
+            for i, transform in transforms:
+                row[i] = transform(row[i])
+            yield row
     def _none_as_infinity_bias(self, t, f):
         if self.infinity_io_flag is not None:
             return None
@@ -1147,10 +1359,37 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
             elif t in self.generic_tables:
                     bad_message_handler("Strangely, you have generic tables but not pandas")
                     return False
+            if rtn and self._has_current_validation_stamp(getattr(data_obj, t), t, row_checking):
+                continue
             rtn = rtn and  self.good_tic_dat_table(getattr(data_obj, t), t,
                     lambda x : bad_message_handler(t + " : " + x), row_checking)
+            if rtn:
+                self._stamp_validation(getattr(data_obj, t), t, row_checking)
         return rtn
 
+    def _is_tracked_table(self, data_table, table_name):
+        # only the exact table class made by this factory for table_name counts its mutations in _version
+        table_type = type(data_table)
+        return table_type.__dict__.get("_tic_dat_factory") is self and table_type._table_name == table_name
+
+    def _has_current_validation_stamp(self, data_table, table_name, row_checking):
+        # fails closed - the stamp is only trusted if every row is still of the type the table makes
+        if not (self._is_tracked_table(data_table, table_name) and
+                data_table._validation_stamps.get(row_checking) == data_table._version):
+            return False
+        row_type = type(data_table)._row_type
+        rows = dict.values(data_table) if isinstance(data_table, dict) else data_table._list
+        return all(type(row) is row_type for row in rows)
+
+    def _stamp_validation(self, data_table, table_name, row_checking):
+        # the rows of tables without data fields are mutable dicts (until frozen), so only the rows
+        # of data field tables can be trusted not to go bad without bumping the table _version
+        if self._is_tracked_table(data_table, table_name) and table_name not in self.generator_tables and \
+           (self.data_fields.get(table_name) or getattr(data_table, "_dataFrozen", False)):
+            data_table._validation_stamps[row_checking] = data_table._version
+            if row_checking == "strict": # strict is the tougher check
+                data_table._validation_stamps["generous"] = data_table._version
+
     def _good_tic_dat_table_for_init(self, data_table, table_name,
                                      bad_message_handler = lambda x : None):
          if self.primary_key_fields.get(table_name, None) and containerish(data_table) \
@@ -1391,6 +1630,10 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
                         rtn.add_data_row_predicate(tbl, predicate=rpi.predicate, predicate_name=pn,
                                                    predicate_kwargs_maker=rpi.predicate_kwargs_maker,
                                                    predicate_failure_response=rpi.predicate_failure_response)
+        for tbl, checks in self._aggregate_checks.items(): # copied over as-is, like the row predicates
+            for cn, ac in checks.items():
+                if table_restrictions is None or {tbl, ac.parent_table}.difference([None]).issubset(table_restrictions):
+                    rtn._aggregate_checks[tbl][cn] = ac
         rtn.enable_foreign_key_links() if self._foreign_key_links_enabled else None
         if convert_dat: # this function is effectively a constructor so _ reference is ok
             assert callable(convert_dat) and len(inspect.getfullargspec(convert_dat).args) >= 1
@@ -1687,6 +1930,164 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         verify(self.good_tic_dat_object(tic_dat, msg.append),
                "tic_dat not a good object for this factory : %s"%"\n".join(msg))
         return freeze_me(tic_dat)
+    def track_changes(self, tic_dat):
+        """
+        Start recording the rows of tic_dat that are inserted, updated and deleted, and return a checkpoint.
+        Change tracking is opt-in, since it adds a little overhead to every edit. Calling this routine on a
+        tic_dat that is already being tracked simply returns a new checkpoint.
+
+        :param tic_dat: an unfrozen TicDat object created by this factory
+
+        :return: a checkpoint token that can be passed to changes_since
+
+        caveats: Only edits made through the TicDat tables (and their rows) are recorded. Replacing a table
+                 attribute outright (i.e. tic_dat.table = {...}) isn't something that can be tracked.
+        """
+        verify(isinstance(tic_dat, self.TicDat), "tic_dat needs to be a TicDat object created by this factory")
+        verify(not getattr(tic_dat, "_isFrozen", False), "a frozen TicDat can't change, and thus can't be tracked")
+        verify(not self.generic_tables and not self.generator_tables,
+               "change tracking is not implemented for generic or generator tables")
+        if tic_dat._change_log is None:
+            tables = {t: getattr(tic_dat, t) for t in self.all_tables}
+            bad_tables = [t for t, v in tables.items() if getattr(v, "_tic_dat_factory", None) is not self]
+            verify(not bad_tables, f"The following tables have been replaced with non-TicDat objects : {bad_tables}")
+            tic_dat._change_log = []
+            for t, tbl in tables.items():
+                tbl._change_log = tic_dat._change_log
+                for k, row in (tbl.items() if dictish(tbl) else ((None, _) for _ in tbl)):
+                    if hasattr(row, "_on_change"):
+                        row._on_change = functools.partial(tic_dat._change_log.append,
+                                                           (t, k, "updated" if dictish(tbl) else "changed"))
+        return len(tic_dat._change_log)
+    def changes_since(self, tic_dat, token):
+        """
+        Find the rows that have been edited since a checkpoint.
+
+        :param tic_dat: a TicDat object whose changes are being tracked. See track_changes.
+
+        :param token: a checkpoint token returned by track_changes
+
+        :return: A dictionary keyed by the names of the tables that have been edited since the checkpoint.
+                 The values are namedtuples with attributes "inserted", "updated", "deleted", each of which is
+                 a set of primary keys. An insert followed by a delete cancels out, whereas a delete followed by
+                 an insert is an update. Tables without primary keys have no keys to report, and if edited
+                 will have None for all three attributes.
+        """
+        verify(getattr(tic_dat, "_change_log", None) is not None,
+               "tic_dat isn't tracking changes. Call track_changes first.")
+        verify(utils.numericish(token) and 0 <= token <= len(tic_dat._change_log), "bad token")
+        ChangedKeys = namedtuple("ChangedKeys", ["inserted", "updated", "deleted"])
+        first_action, last_action = {}, {}
+        for t, k, action in tic_dat._change_log[token:]:
+            first_action.setdefault((t, k), action)
+            last_action[t, k] = action
+        rtn = {}
+        for (t, k), action in first_action.items():
+            if not self.primary_key_fields.get(t):
+                rtn[t] = ChangedKeys(None, None, None)
+                continue
+            existed_before, exists_now = action != "inserted", last_action[t, k] != "deleted"
+            if existed_before or exists_now:
+                rtn.setdefault(t, ChangedKeys(set(), set(), set()))
+                (rtn[t].updated if existed_before and exists_now else
+                 rtn[t].deleted if existed_before else rtn[t].inserted).add(k)
+        return {t: v for t, v in rtn.items() if v.inserted is None or any(v)}
+    def diff(self, tic_dat_1, tic_dat_2, epsilon=0, nans_are_same_for_data_rows=False):
+        """
+        Find the differences between two TicDat objects. Each table is compared with a single hash join on the
+        primary key, so the run time is linear in the size of the tables.
+
+        :param tic_dat_1: the "old" TicDat object
+
+        :param tic_dat_2: the "new" TicDat object
+
+        :param epsilon: data field values whose percent error (see utils.per_error) is less than epsilon are
+                        considered the same
+
+        :param nans_are_same_for_data_rows: if truthy, then two nan data field values are considered the same
+
+        :return: A dictionary keyed by the names of the tables that differ. The values are namedtuples with
+                 attributes "added", "removed", "changed".
+                 For tables with primary keys, "added" and "removed" are sets of primary keys, and "changed" is
+                 a dictionary mapping each primary key found in both objects to {field: (old value, new value)}
+                 for the data fields that differ.
+                 For tables without primary keys, "added" and "removed" are lists of data field tuples (repeated
+                 for duplicated rows) and "changed" is always empty.
+        """
+        for td in (tic_dat_1, tic_dat_2):
+            msg = []
+            verify(self.good_tic_dat_object(td, msg.append),
+                   "tic_dat not a good object for this factory : %s"%"\n".join(msg))
+        verify(not self.generic_tables, "diff is not implemented for generic tables")
+        assert epsilon >= 0
+        is_nan = lambda x: safe_apply(math.isnan)(x) or (pd and safe_apply(pd.isnull)(x) is True)
+        def same_value(x, y):
+            return x == y or (epsilon > 0 and safe_apply(utils.nearly_same)(x, y, epsilon)) or \
+                   bool(nans_are_same_for_data_rows and is_nan(x) and is_nan(y))
+        TableDiff = namedtuple("TableDiff", ["added", "removed", "changed"])
+        rtn = {}
+        for t in self.all_tables:
+            t1, t2 = getattr(tic_dat_1, t), getattr(tic_dat_2, t)
+            dfs = self.data_fields.get(t, ())
+            if self.primary_key_fields.get(t):
+                changed = {}
+                for k, r1 in t1.items():
+                    if k in t2:
+                        r2 = t2[k]
+                        flds = {f: (r1[f], r2[f]) for f in dfs if not same_value(r1[f], r2[f])}
+                        if flds:
+                            changed[k] = flds
+                added = {k for k in t2 if k not in t1}
+                removed = {k for k in t1 if k not in t2}
+            else:
+                _iter = lambda x: x if containerish(x) else x()
+                _tuple = lambda r: tuple(r[f] for f in dfs) if dictish(r) else tuple(r)
+                counts = clt.Counter(map(_tuple, _iter(t1)))
+                counts.subtract(map(_tuple, _iter(t2)))
+                added = [r for r, c in counts.items() for _ in range(-c)]
+                removed = [r for r, c in counts.items() for _ in range(c)]
+                changed = {}
+            if added or removed or changed:
+                rtn[t] = TableDiff(added, removed, changed)
+        return rtn
+    def fingerprint(self, tic_dat):
+        """
+        Compute a digest of the data in a TicDat object. The digest doesn't depend on the order of the rows, and
+        is stable across Python sessions, so it can be used to recognize previously seen data.
+
+        The cells are normalized prior to hashing. The infinity_io_flag is applied (so that two TicDat objects
+        that would write the same data have the same fingerprint), numbers are treated as floats, and datetimes
+        (including the values of datetime fields) are converted to a canonical form, with timezone aware
+        datetimes converted to UTC.
+
+        :param tic_dat: ticdat object
+
+        :return: a namedtuple with members "overall" and "tables". The former is a hex digest string for the
+                 entire data set, the latter is a dictionary mapping each table name to a hex digest string.
+        """
+        assert self.good_tic_dat_object(tic_dat), "tic_dat not a good object for this factory"
+        verify(not self.generic_tables, "fingerprint not implemented for generic tables")
+        def cell(t, f, x):
+            if t != "parameters": # as per set_infinity_io_flag, the parameters table isn't infinity flagged
+                x = self._infinity_flag_write_cell(t, f, x)
+            if x is None or (utils.numericish(x) and math.isnan(x)) or (utils.pd and x is utils.pd.NaT):
+                return None
+            if self._data_types.get(t, {}).get(f) and self._data_types[t][f].datetime:
+                x = utils.dateutil_adjuster(x) or x
+            if isinstance(x, datetime_.datetime):
+                return "datetime", utils._fingerprint_datetime(x)
+            if utils.numericish(x):
+                return float(x)
+            return x
+        table_digests = {}
+        for t in self.all_tables:
+            fields = self.primary_key_fields.get(t, ()) + self.data_fields.get(t, ())
+            row_hashes = sorted(hashlib.blake2b(repr(tuple(cell(t, f, row[f]) for f in fields)).encode(),
+                                                digest_size=8).digest()
+                                for _, row in self._full_rows(tic_dat, t))
+            table_digests[t] = utils._fingerprint_table(fields, b"".join(row_hashes))
+        return utils._fingerprint(table_digests)
+
     def find_foreign_key_failures(self, tic_dat, verbosity="High", max_failures=float("inf")):
         """
         Finds the foreign key failures for a ticdat object
@@ -1837,7 +2238,25 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
             full_row = dict(full_row, **{f:d for f,d in
                                          zip(self.primary_key_fields[table], pk)})
         return full_row
-    def find_data_type_failures(self, tic_dat, max_failures=float("inf")):
+    def _true_data_types(self):
+        '''
+        See issue https://github.com/ticdat/ticdat/issues/46  and the doc string for find_data_type_failures
+        for more info
+        :return:
+        '''
+        if self._true_data_types_cache: # the data types can't change once the factory has been used
+            return self._true_data_types_cache[0]
+        tmp_tdf = TicDatFactory.create_from_full_schema(self.schema(include_ancillary_info=True))
+        for t, pks in self.primary_key_fields.items():
+            for pk in pks:
+                if pk not in self._data_types.get(t, ()):
+                    tmp_tdf.set_data_type(t, pk, number_allowed=True,
+                      inclusive_min=True, inclusive_max=True, min=-float("inf"), max=float("inf"),
+                      must_be_int=False, strings_allowed='*', nullable=False, datetime=False)
+        if self._has_been_used:
+            self._true_data_types_cache.append(tmp_tdf.data_types)
+        return tmp_tdf.data_types
+    def find_data_type_failures(self, tic_dat, max_failures=float("inf"), sample=None, sample_seed=None):
         """
         Finds the data type failures for a ticdat object
 
@@ -1846,6 +2265,19 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         :param max_failures: number. An upper limit on the number of failures to find. Will short circuit and return
                                      ASAP with a partial failure enumeration when this number is reached.
 
+        :param sample: optional. Either a float fraction in (0, 1], or a positive int row count (so 1.0 is every
+                       row, and 1 is a single row). If provided, only a random sample of the rows of each
+                       table is checked, and a namedtuple is returned with the following members.
+                       --> failures - the dictionary described below, restricted to the sampled rows. Since the
+                                      unsampled rows aren't checked, the failures may be undercounted.
+                       --> sample_sizes - a dictionary mapping each checked table to
+                                          (number of rows sampled, number of rows)
+                       --> estimated_failure_rates - a dictionary mapping each key of failures to the fraction
+                                                     of the sampled rows of the table that failed
+                       --> may_be_undercounted - True if any checked table wasn't fully sampled
+
+        :param sample_seed: optional. The random seed for choosing the sample.
+
         :return: A dictionary constructed as follow:
 
          The keys are namedtuples with members "table", "field". Each (table,field) pair
@@ -1873,45 +2305,68 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         assert max_failures > 0, "max_failures should be a positive number"
 
         rtn_values, rtn_pks = clt.defaultdict(set), clt.defaultdict(set)
-        tmp_tdf = TicDatFactory.create_from_full_schema(self.schema(include_ancillary_info=True))
-        for t, pks in self.primary_key_fields.items():
-            for pk in pks:
-                if pk not in self._data_types.get(t, ()):
-                    tmp_tdf.set_data_type(t, pk, number_allowed=True,
-                      inclusive_min=True, inclusive_max=True, min=-float("inf"), max=float("inf"),
-                      must_be_int=False, strings_allowed='*', nullable=False, datetime=False)
         number_failures = [0] if max_failures < float("inf") else None
+        data_types = self._true_data_types()
+        if sample is not None:
+            sampled_keys = self._sample_keys(tic_dat, [t for t in data_types if t not in self.generator_tables],
+                                             sample, sample_seed)
         def populate_rtn():
             def inc_failures_trips_end():
                 if number_failures:
                     number_failures[0] += 1
                     return number_failures[0] >= max_failures
-            for table, type_row in tmp_tdf._data_types.items():
+            for table, type_row in data_types.items():
                 _table = getattr(tic_dat, table)
                 if dictish(_table):
-                    for pk  in _table:
-                        full_row = self._get_full_row(tic_dat, table, pk)
-                        for field, data_type in type_row.items():
-                            if not data_type.valid_data(full_row[field]) :
-                                rtn_values[(table, field)].add(full_row[field])
-                                rtn_pks[(table, field)].add(pk)
-                                if inc_failures_trips_end():
-                                    return
+                    pks = list(_table) if sample is None else sampled_keys[table]
+                    rows = [_table[pk] for pk in pks]
+                    pk_fields = self.primary_key_fields[table]
+                    def column(field):
+                        if field not in pk_fields:
+                            return [row[field] for row in rows]
+                        if len(pk_fields) == 1:
+                            return pks
+                        i = pk_fields.index(field)
+                        return [pk[i] for pk in pks]
                 elif containerish(_table):
-                    for pk, data_row in enumerate(_table):
-                        for field, data_type in type_row.items():
-                            if not data_type.valid_data(data_row[field]) :
-                                rtn_values[(table, field)].add(data_row[field])
-                                rtn_pks[(table, field)].add(pk)
-                                if inc_failures_trips_end():
-                                    return
+                    pks = range(len(_table)) if sample is None else sampled_keys[table]
+                    rows = _table if sample is None else [_table[i] for i in pks]
+                    column = lambda field: [row[field] for row in rows]
+                else:
+                    continue
+                for field, data_type in type_row.items():
+                    values = column(field)
+                    for i in data_type._invalid_positions(values):
+                        rtn_values[(table, field)].add(values[i])
+                        rtn_pks[(table, field)].add(pks[i])
+                        if inc_failures_trips_end():
+                            return
         populate_rtn()
         assert set(rtn_values).issuperset(set(rtn_pks))
         TableField = clt.namedtuple("TableField", ["table", "field"])
         ValuesPks = clt.namedtuple("ValuesPks", ["bad_values", "pks"])
-        return {TableField(*tf):ValuesPks(tuple(rtn_values[tf]),
-                                          tuple(rtn_pks[tf]) if tf in rtn_pks else None)
-                for tf in rtn_values}
+        rtn = {TableField(*tf):ValuesPks(tuple(rtn_values[tf]),
+                                         tuple(rtn_pks[tf]) if tf in rtn_pks else None)
+               for tf in rtn_values}
+        if sample is not None:
+            return utils._sampled_failures(rtn, self._sample_sizes(tic_dat, sampled_keys), lambda v: len(v.pks))
+        return rtn
+    def _sample_keys(self, tic_dat, tables, sample, sample_seed):
+        """
+        :return: a dictionary mapping each of the tables to a random sample of its primary keys (or, for tables
+                 without primary keys, its row indices)
+        """
+        rng = random.Random(sample_seed)
+        rtn = {}
+        for t in sorted(tables):
+            _table = getattr(tic_dat, t)
+            keys = list(_table) if dictish(_table) else \
+                   range(len(_table if containerish(_table) else list(_table())))
+            rtn[t] = rng.sample(keys, utils._sample_size(sample, len(keys)))
+        return rtn
+    def _sample_sizes(self, tic_dat, sampled_keys):
+        _len = lambda x: len(x) if containerish(x) else len(list(x()))
+        return {t: (len(keys), _len(getattr(tic_dat, t))) for t, keys in sampled_keys.items()}
 
     def replace_data_type_failures(self, tic_dat, replacement_values = FrozenDict()):
         """
@@ -1960,7 +2415,9 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
         assert not set(self.find_data_type_failures(tic_dat)).intersection(real_replacements)
         return tic_dat
 
-    def find_data_row_failures(self, tic_dat, exception_handling="__debug__", max_failures=float("inf")):
+    def find_data_row_failures(self, tic_dat, exception_handling="__debug__", max_failures=float("inf"),
+                               sample=None, sample_seed=None, stats=None, order_by_stats=False,
+                               kwargs_cache=None):
         """
         Finds the data row failures for a ticdat object
 
@@ -1978,6 +2435,29 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
 
         :param max_failures: number. An upper limit on the number of failures to find. Will short circuit and return
                                      ASAP with a partial failure enumeration when this number is reached.
+                                     The predicates are then evaluated one after the other (each over all the rows),
+                                     so the partial enumeration holds the failures of the earliest predicates.
+
+        :param sample: optional. Either a float fraction in (0, 1], or a positive int row count (so 1.0 is every
+                       row, and 1 is a single row). If provided, only a random sample of the rows of each
+                       table is checked, and a namedtuple is returned. See find_data_type_failures
+                       for details.
+
+        :param sample_seed: optional. The random seed for choosing the sample.
+
+        :param stats: optional. A dictionary that will be populated with statistics about each row predicate.
+                      The keys are (table, predicate name) pairs and the values are namedtuples with members
+                      "wall_time" (seconds), "calls", "failures" and "exceptions" (the exceptions handled as
+                      failures). Passing the same dictionary to subsequent calls accumulates the statistics.
+
+        :param order_by_stats: boolean. If truthy, the row predicates are evaluated in order of cost per failure,
+                               as measured by the stats argument (which is then required). Predicates that are
+                               cheap and fail often are evaluated first, which finds max_failures failures sooner.
+
+        :param kwargs_cache: optional. A dictionary used to remember the predicate_kwargs_maker results. Passing
+                             the same (initially empty) dictionary to subsequent calls will reuse these results
+                             so long as the contents of tic_dat haven't changed. The contents of this dictionary
+                             should be treated as opaque.
 
         :return: A dictionary constructed as follow:
 
@@ -2001,6 +2481,116 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
                "bad exception_handling argument")
         if exception_handling == "__debug__":
             exception_handling = "Unhandled" if __debug__ else "Handled as Failure"
+        utils._check_row_predicate_stats_args(stats, order_by_stats)
+        utils._check_kwargs_cache_arg(kwargs_cache)
+        rtn = clt.defaultdict(set)
+        PKEM = clt.namedtuple("PrimaryKeyErrorMessage", ["primary_key", "error_message"])
+        number_failures = [0] if max_failures < float("inf") else None
+        checks = self._row_predicate_checks(tic_dat, exception_handling, kwargs_cache)
+        if order_by_stats:
+            checks = {(tbl, pn): (tbl, pn, failure_response, check)
+                      for tbl, pn, failure_response, check in checks}
+            checks = [checks[_] for _ in utils._row_predicates_ordered_by_stats(checks, stats)]
+        if sample is not None:
+            sampled_keys = self._sample_keys(tic_dat, set(self._data_row_predicates).union(
+                                             ["parameters"] if self._parameters else []), sample, sample_seed)
+        if order_by_stats and not number_failures:
+            # the predicates of a table are evaluated together, in a single pass over its rows
+            table_order = {tbl: i for i, (tbl, *_) in reversed(list(enumerate(checks)))}
+            checks = sorted(checks, key=lambda c: table_order[c[0]])
+        check_order = []
+        def populate_rtn():
+            def inc_failures_trips_end():
+                if number_failures:
+                    number_failures[0] += 1
+                    return number_failures[0] >= max_failures
+            def evaluate_trips_end(tbl, predicates):
+                # each full row is built once, and shared by all the predicates
+                wall_times, calls, exceptions = [0] * len(predicates), [0] * len(predicates), [0] * len(predicates)
+                try:
+                    for pk, full_row in self._full_rows(tic_dat, tbl, None if sample is None else sampled_keys[tbl]):
+                        for i, (pn, boolean, predicate) in enumerate(predicates):
+                            calls[i] += 1
+                            start = time.perf_counter() if stats is not None else None
+                            try:
+                                _ = predicate(full_row)
+                            except BaseException as e:
+                                # any exception fails a Boolean predicate, as with a bare except
+                                if exception_handling == "Unhandled" or not (boolean or isinstance(e, Exception)):
+                                    raise
+                                exceptions[i] += 1
+                                _ = False if boolean else f"Exception<{e}>"
+                            if start is not None:
+                                wall_times[i] += time.perf_counter() - start
+                            if (not _) if boolean else (_ is not True):
+                                rtn[tbl, pn].add(pk if boolean else PKEM(pk, str(_)))
+                                if inc_failures_trips_end():
+                                    return True
+                finally:
+                    if stats is not None:
+                        for i, (pn, *_) in enumerate(predicates):
+                            utils._add_row_predicate_stats(stats, tbl, pn, wall_times[i], calls[i],
+                                                           len(rtn.get((tbl, pn), ())), exceptions[i])
+            for tbl, table_checks in itertools.groupby(checks, key=lambda c: c[0]):
+                predicates = []
+                for _, pn, failure_response, predicate in table_checks:
+                    check_order.append((tbl, pn))
+                    if isinstance(predicate, str):
+                        rtn[tbl, pn] = PKEM('*', predicate)
+                        if inc_failures_trips_end():
+                            return
+                    elif not number_failures:
+                        predicates.append((pn, failure_response == "Boolean", predicate))
+                    # since max_failures truncates the enumeration, the predicates are evaluated one after the other
+                    elif evaluate_trips_end(tbl, [(pn, failure_response == "Boolean", predicate)]):
+                        return
+                if predicates:
+                    evaluate_trips_end(tbl, predicates)
+        populate_rtn()
+        TPN = clt.namedtuple("TablePredicateName", ["table", "predicate_name"])
+
+        rtn = {TPN(*k):(rtn[k] if isinstance(rtn[k], PKEM) else tuple(rtn[k])) for k in check_order if k in rtn}
+        if sample is not None:
+            return utils._sampled_failures(rtn, self._sample_sizes(tic_dat, sampled_keys),
+                                           lambda v: float("inf") if isinstance(v, PKEM) else len(v))
+        return rtn
+
+    def find_aggregate_check_failures(self, tic_dat):
+        """
+        Finds the groups that fail the aggregate checks (see add_aggregate_check). Each check makes a single pass
+        over the child table (and the parent table, if there is one).
+
+        :param tic_dat: ticdat object
+
+        :return: A dictionary constructed as follows:
+
+         The keys are namedtuples with members "table", "check_name".
+
+         The values are tuples of the failing groups. A group is identified by its group_by field value (or a tuple
+         of group_by field values, if there are more than one).
+        """
+        assert self.good_tic_dat_object(tic_dat), "tic_dat not a good object for this factory"
+        TCN = clt.namedtuple("TableCheckName", ["table", "check_name"])
+        rtn = {}
+        for tbl, checks in self._aggregate_checks.items():
+            for cn, ac in checks.items():
+                failures = ac.failures((row for _, row in self._full_rows(tic_dat, tbl)),
+                                       None if ac.parent_table is None else self._full_rows(tic_dat, ac.parent_table))
+                if failures:
+                    rtn[TCN(tbl, cn)] = tuple(k for k, _ in failures)
+        return rtn
+
+    def _row_predicate_checks(self, tic_dat, exception_handling, kwargs_cache=None):
+        """
+        generator yielding (table, predicate_name, predicate_failure_response, check) for each row predicate
+        (including the implicit parameters table check). check is either a string (explaining why the
+        predicate_kwargs_maker failed) or the row predicate itself, as a one argument function of the full row
+        (i.e. with the predicate_kwargs bound). See _row_predicate_result for evaluating check.
+        The predicate_kwargs_maker functions are called lazily, and at most once each.
+        exception_handling is either "Handled as Failure" or "Unhandled", and applies to the
+        predicate_kwargs_maker calls.
+        kwargs_cache, if provided, is a dict that remembers the predicate_kwargs_maker results across calls.
+        """
         data_row_predicates = {k: dict(v) for k,v in self._data_row_predicates.items()}
         if self._parameters:
             def good_parameter(row):
@@ -2016,20 +2606,18 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
             data_row_predicates["parameters"][predicate_name] = RowPredicateInfo(good_parameter, None, "Boolean")
 
         predicate_kwargs_maker_results = {}
-        rtn = clt.defaultdict(set)
-        PKEM = clt.namedtuple("PrimaryKeyErrorMessage", ["primary_key", "error_message"])
-        number_failures = [0] if max_failures < float("inf") else None
         converted_dat = []
-        def populate_rtn():
-            def inc_failures_trips_end():
-                if number_failures:
-                    number_failures[0] += 1
-                    return number_failures[0] >= max_failures
-            for tbl, row_predicates in data_row_predicates.items():
-                for pn, rpi in row_predicates.items():
-                    uses_convert = self._convert_dat and (tbl, pn) in self._convert_dat[1]
-                    predicate_kwargs = {}
-                    if rpi.predicate_kwargs_maker:
+        stamp = []
+        def content_stamp():
+            if not stamp:
+                stamp.append(self._content_stamp(tic_dat))
+            return stamp[0]
+        for tbl, row_predicates in data_row_predicates.items():
+            for pn, rpi in row_predicates.items():
+                uses_convert = self._convert_dat and (tbl, pn) in self._convert_dat[1]
+                predicate_kwargs = {}
+                if rpi.predicate_kwargs_maker:
+                    def make_kwargs():
                         if uses_convert and not converted_dat:
                             if exception_handling == "Handled as Failure":
                                 try:
@@ -2038,64 +2626,280 @@ class TicDatFactory(freezable_factory(object, "_isFrozen", {"ampl_prepend"})) :
                                     converted_dat.append(f"Exception<{e}>")
                             else:
                                 converted_dat.append(self._convert_dat[0](tic_dat))
-                        if rpi.predicate_kwargs_maker not in predicate_kwargs_maker_results:
-                            __tic_dat = converted_dat[0] if uses_convert else tic_dat
-                            if uses_convert and isinstance(converted_dat[0], str):
-                                _predicate_kwargs = converted_dat[0]
-                            elif exception_handling == "Handled as Failure":
-                                try:
-                                    _predicate_kwargs = rpi.predicate_kwargs_maker(__tic_dat)
-                                except Exception as e:
-                                    _predicate_kwargs = f"Exception<{e}>"
-                            else:
-                                _predicate_kwargs = rpi.predicate_kwargs_maker(__tic_dat)
-                            predicate_kwargs_maker_results[rpi.predicate_kwargs_maker] = _predicate_kwargs
-                        predicate_kwargs = predicate_kwargs_maker_results[rpi.predicate_kwargs_maker]
-                    if not isinstance(predicate_kwargs, dict):
-                        rtn[tbl, pn] = PKEM('*', predicate_kwargs
-                                            if (isinstance(predicate_kwargs, str) and "Exception<" in predicate_kwargs)
-                                            else f"predicate_kwargs_maker failed to return a dict")
-                        if inc_failures_trips_end():
-                            return
-                    else:
-                        if rpi.predicate_failure_response == "Boolean":
-                            def _p(row):
-                                try:
-                                    return rpi.predicate(row, **predicate_kwargs)
-                                except:
-                                    return False
-                        else:
-                            def _p(row):
-                                try:
-                                    return rpi.predicate(row, **predicate_kwargs)
-                                except Exception as e:
-                                    return f"Exception<{e}>"
-                        if exception_handling == "Unhandled":
-                            _p = lambda row: rpi.predicate(row, **predicate_kwargs)
-                        _table = getattr(tic_dat, tbl)
-                        def handle_full_row_trips_end(pk, full_row):
-                            if rpi.predicate_failure_response == "Boolean" and not _p(full_row):
-                                rtn[tbl, pn].add(pk)
-                                return inc_failures_trips_end()
-                            if rpi.predicate_failure_response == "Error Message":
-                                _ = _p(full_row)
-                                if not _ is True:
-                                    rtn[tbl, pn].add(PKEM(pk, str(_)))
-                                    return inc_failures_trips_end()
-                        if dictish(_table):
-                            for pk  in _table:
-                                full_row = self._get_full_row(tic_dat, tbl, pk)
-                                if handle_full_row_trips_end(pk, full_row):
-                                    return
-                        else:
-                            for i, data_row in enumerate(_table):
-                                if handle_full_row_trips_end(i, data_row):
-                                    return
-        populate_rtn()
-        TPN = clt.namedtuple("TablePredicateName", ["table", "predicate_name"])
+                        __tic_dat = converted_dat[0] if uses_convert else tic_dat
+                        if uses_convert and isinstance(converted_dat[0], str):
+                            return converted_dat[0]
+                        if exception_handling == "Handled as Failure":
+                            try:
+                                return rpi.predicate_kwargs_maker(__tic_dat)
+                            except Exception as e:
+                                return f"Exception<{e}>"
+                        return rpi.predicate_kwargs_maker(__tic_dat)
+                    if rpi.predicate_kwargs_maker not in predicate_kwargs_maker_results:
+                        predicate_kwargs_maker_results[rpi.predicate_kwargs_maker] = utils._cached_predicate_kwargs(
+                            kwargs_cache, content_stamp, (rpi.predicate_kwargs_maker, bool(uses_convert)),
+                            make_kwargs)
+                    predicate_kwargs = predicate_kwargs_maker_results[rpi.predicate_kwargs_maker]
+                if not isinstance(predicate_kwargs, dict):
+                    yield (tbl, pn, rpi.predicate_failure_response,
+                           predicate_kwargs if (isinstance(predicate_kwargs, str) and "Exception<" in predicate_kwargs)
+                           else f"predicate_kwargs_maker failed to return a dict")
+                else:
+                    yield (tbl, pn, rpi.predicate_failure_response,
+                           functools.partial(rpi.predicate, **predicate_kwargs) if predicate_kwargs
+                           else rpi.predicate)
 
-        return {TPN(*k):(v if isinstance(v, PKEM) else tuple(v)) for k,v in rtn.items()}
+    @staticmethod
+    def _row_predicate_result(check, full_row, failure_response, exception_handling):
+        """
+        :return: True if full_row passes the check yielded by _row_predicate_checks, otherwise the failure
+                 (False for "Boolean" predicates, otherwise the error message)
+        """
+        try:
+            rtn = check(full_row)
+        except BaseException as e:
+            # any exception fails a Boolean predicate, as with a bare except
+            if exception_handling == "Unhandled" or not (failure_response == "Boolean" or isinstance(e, Exception)):
+                raise
+            return False if failure_response == "Boolean" else f"Exception<{e}>"
+        if failure_response == "Boolean":
+            return bool(rtn)
+        return rtn
+    def _content_stamp(self, tic_dat):
+        """
+        :return: a summary of the contents of tic_dat (row order included) that changes whenever the data changes
+                 (or None, if tic_dat has generic tables or generator tables).
+                 A table made by this factory is summarized by its mutation counters, so long as its rows can't
+                 be edited without bumping a counter (i.e. they count their own edits, or are frozen). Edits that
+                 bypass the table and row methods (such as calling dict.__setitem__ directly) aren't seen.
+                 Any other table is digested by the repr of its rows, which is exact for the numbers, strings,
+                 datetimes and None (and nan) typically stored in a TicDat.
+        """
+        if self.generic_tables or self.generator_tables:
+            return None
+        rtn = []
+        for t in sorted(self.all_tables):
+            _t = getattr(tic_dat, t)
+            row_type = type(_t)._row_type if self._is_tracked_table(_t, t) else None
+            if row_type and (hasattr(row_type, "_mutations") or getattr(_t, "_dataFrozen", False)):
+                # a copy of a table (e.g. copy.deepcopy) shares its _serial, but not its id
+                rtn.append((t, id(_t), _t._serial, _t._version, getattr(row_type, "_mutations", None)))
+                continue
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(f"{len(_t)}\n".encode())
+            rows = _t.items() if dictish(_t) else enumerate(_t)
+            for k, r in rows: # repr escapes newlines, so the newline separated row reprs can't run together
+                digest.update(repr((k, tuple(r.values()))).encode() + b"\n")
+            rtn.append((t, digest.hexdigest()))
+        return tuple(rtn)
+
+    def find_all_failures(self, tic_dat, exception_handling="__debug__"):
+        """
+        Finds all the integrity failures for a ticdat object, visiting each row only once. This is a faster
+        alternative to calling find_data_type_failures, find_data_row_failures and find_foreign_key_failures
+        one after the other, since each of those routines makes its own pass over the data.
+
+        :param tic_dat: ticdat object
+
+        :param exception_handling: see find_data_row_failures
+
+        :return: A namedtuple with members "duplicates", "data_type", "data_row", "foreign_key".
+
+         --> duplicates - always an empty dictionary, since a TicDat table with a primary key can't
+                          hold duplicate rows. (Duplicate rows are found when reading from a file or a database,
+                          see the find_duplicates routines on the xls, csv, sql, json and mdb attributes).
+
+         --> data_type - the same dictionary as returned by find_data_type_failures
+
+         --> data_row - the same dictionary as returned by find_data_row_failures
+
+         --> foreign_key - the same dictionary as returned by find_foreign_key_failures (with verbosity "High")
+
+        Note that the entire set of predicate_kwargs_maker functions is called before any rows are visited.
+        """
+        assert self.good_tic_dat_object(tic_dat), "tic_dat not a good object for this factory"
+        return self._find_all_failures(tic_dat, exception_handling)
+    def find_failures_since(self, tic_dat, token, exception_handling="__debug__"):
+        """
+        Finds the integrity failures for the rows of a ticdat object that have been edited since a checkpoint.
+        The rows that were valid at the checkpoint and haven't been edited since aren't revisited, so for a
+        small batch of new rows this is much faster than find_all_failures.
+
+        :param tic_dat: a TicDat object whose changes are being tracked. See track_changes.
+
+        :param token: a checkpoint token returned by track_changes
+
+        :param exception_handling: see find_data_row_failures
+
+        :return: the same namedtuple as find_all_failures, restricted to the failures of the following rows.
+
+         --> the rows inserted or updated since the checkpoint (all the rows, for an edited table
+             without a primary key).
+
+         --> for foreign keys into a table that has had rows deleted since the checkpoint, the rows of the
+             native table that referenced the deleted rows are probed (for that foreign key only), since deleting
+             a parent row can orphan child rows that haven't themselves been edited. These rows are found with
+             a look up index of the native table that is built on first use and then kept current with the
+             change log. (If the deleted rows can't be identified, e.g. for a foreign key into a table without
+             a primary key, then every row of the native table is probed).
 
+        caveats: Row predicates whose predicate_kwargs_maker depends on other tables can make an unedited row fail.
+                 Such failures are only found by find_all_failures.
+        """
+        assert self.good_tic_dat_object(tic_dat), "tic_dat not a good object for this factory"
+        return self._find_all_failures(tic_dat, exception_handling, self.changes_since(tic_dat, token))
+    def _find_all_failures(self, tic_dat, exception_handling, changes=None, predicate_nulls=None):
+        # predicate_nulls, if provided, maps table -> {field: the value the row predicates receive for a None}
+        predicate_nulls = predicate_nulls or {}
+        verify(exception_handling in ["Handled as Failure", "Unhandled", "__debug__"],
+               "bad exception_handling argument")
+        if exception_handling == "__debug__":
+            exception_handling = "Unhandled" if __debug__ else "Handled as Failure"
+        PKEM = clt.namedtuple("PrimaryKeyErrorMessage", ["primary_key", "error_message"])
+        dt_values, dt_pks, dr_rtn = clt.defaultdict(set), clt.defaultdict(set), clt.defaultdict(set)
+        fk_values, fk_pks = clt.defaultdict(set), clt.defaultdict(set)
+
+        data_types = {t: v for t, v in self._true_data_types().items() if t not in self.generator_tables}
+        row_checks = defaultdict(list)
+        for tbl, pn, failure_response, check in self._row_predicate_checks(tic_dat, exception_handling):
+            if isinstance(check, str):
+                dr_rtn[tbl, pn] = PKEM('*', check)
+            else:
+                row_checks[tbl].append((pn, failure_response, check))
+
+        table_data = {}
+        def get_table_data(tblname, fields):
+            if fields == self.primary_key_fields.get(tblname, ()):
+                return getattr(tic_dat, tblname)
+            if (tblname, fields) not in table_data:
+                table_data[tblname, fields] = {tuple(full_row[f] for f in fields) for _, full_row in
+                                               self._full_rows(tic_dat, tblname)}
+            return table_data[tblname, fields]
+        fk_probes, dirty_fks = defaultdict(list), {}
+        for native, fks in self._foreign_keys_by_native().items():
+            for fk in fks:
+                foreign_to_native = fk.foreigntonativemapping()
+                ffs = tuple(_ff for _ff in self.primary_key_fields.get(fk.foreign_table, ()) +
+                            self.data_fields.get(fk.foreign_table, ()) if _ff in foreign_to_native)
+                if changes is not None:
+                    foreign_changes = changes.get(fk.foreign_table)
+                    into_pk = ffs == self.primary_key_fields.get(fk.foreign_table)
+                    if foreign_changes and (foreign_changes.deleted is None or foreign_changes.deleted or
+                                            (foreign_changes.updated and not into_pk)):
+                        # maps to the look up values lost from the foreign table, if they are known
+                        dirty_fks[fk] = foreign_changes.deleted if into_pk and self.primary_key_fields.get(native) \
+                                        and foreign_changes.deleted is not None else None
+                    elif native not in changes:
+                        continue
+                native_values = tuple(_.native_field for _ in fk.mapping) \
+                                if type(fk.mapping) is not ForeignKeyMapping else fk.mapping.native_field
+                fk_probes[native].append((fk, tuple(foreign_to_native[_ff] for _ff in ffs),
+                                          ffs == self.primary_key_fields.get(fk.foreign_table) and len(ffs) == 1,
+                                          get_table_data(fk.foreign_table, ffs), native_values))
+
+        def check_row(t, pk, full_row, type_row, checks, probes):
+            for field, data_type in type_row.items():
+                if not data_type.valid_data(full_row[field]):
+                    dt_values[t, field].add(full_row[field])
+                    dt_pks[t, field].add(pk)
+            predicate_row = full_row
+            if checks and t in predicate_nulls:
+                predicate_row = {f: predicate_nulls[t][f] if v is None and f in predicate_nulls[t] else v
+                                 for f, v in full_row.items()}
+            for pn, failure_response, check in checks:
+                _ = self._row_predicate_result(check, predicate_row, failure_response, exception_handling)
+                if _ is not True:
+                    dr_rtn[t, pn].add(pk if failure_response == "Boolean" else PKEM(pk, str(_)))
+            for fk, look_up_fields, scalar_look_up, foreign_look_into, native_values in probes:
+                foreign_look_up = tuple(full_row[f] for f in look_up_fields)
+                if (foreign_look_up[0] if scalar_look_up else foreign_look_up) not in foreign_look_into:
+                    fk_pks[fk].add(pk)
+                    fk_values[fk].add(tuple(full_row[f] for f in native_values)
+                                      if isinstance(native_values, tuple) else full_row[native_values])
+        for t in self.all_tables:
+            type_row, checks, probes = data_types.get(t, {}), row_checks.get(t, ()), fk_probes.get(t, ())
+            if not (type_row or checks or probes):
+                continue
+            if changes is None or (t in changes and changes[t].inserted is None):
+                for pk, full_row in self._full_rows(tic_dat, t):
+                    check_row(t, pk, full_row, type_row, checks, probes)
+                continue
+            _table, edited = getattr(tic_dat, t), set()
+            if t in changes:
+                edited = changes[t].inserted | changes[t].updated
+                for pk in edited:
+                    if pk in _table:
+                        check_row(t, pk, self._get_full_row(tic_dat, t, pk), type_row, checks, probes)
+            scan_probes = []
+            for probe in (_ for _ in probes if _[0] in dirty_fks):
+                if dirty_fks[probe[0]] is None:
+                    scan_probes.append(probe)
+                    continue
+                for pk in self._orphan_candidates(tic_dat, probe, dirty_fks[probe[0]]).difference(edited):
+                    check_row(t, pk, self._get_full_row(tic_dat, t, pk), {}, (), [probe])
+            if scan_probes:
+                for pk, full_row in self._full_rows(tic_dat, t):
+                    if pk not in edited:
+                        check_row(t, pk, full_row, {}, (), scan_probes)
+
+        TableField = clt.namedtuple("TableField", ["table", "field"])
+        ValuesPks = clt.namedtuple("ValuesPks", ["bad_values", "pks"])
+        TPN = clt.namedtuple("TablePredicateName", ["table", "predicate_name"])
+        FKF = namedtuple("ForeignKeyFailures", ("native_values", "native_pks"))
+        AllFailures = clt.namedtuple("AllFailures", ["duplicates", "data_type", "data_row", "foreign_key"])
+        return AllFailures({},
+                           {TableField(*tf): ValuesPks(tuple(v), tuple(dt_pks[tf])) for tf, v in dt_values.items()},
+                           {TPN(*k): (v if isinstance(v, PKEM) else tuple(v)) for k, v in dr_rtn.items()},
+                           {fk: FKF(tuple(fk_values[fk]), tuple(v)) for fk, v in fk_pks.items()})
+    def _orphan_candidates(self, tic_dat, probe, lost_values):
+        """
+        :param probe: a foreign key probe, as built by _find_all_failures
+        :param lost_values: the primary keys deleted from the foreign table of the foreign key
+        :return: the primary keys of the native rows that reference one of lost_values. The look up index of the
+                 native table is built on the first call, and afterwards is brought current by replaying the
+                 change log entries since the last call, so the cost scales with the number of edits.
+                 The index can hold stale keys (rows edited or deleted since being indexed). These are harmless,
+                 since the returned rows are probed anyway.
+        """
+        fk, look_up_fields, scalar_look_up = probe[:3]
+        look_up = (lambda full_row: full_row[look_up_fields[0]]) if scalar_look_up else \
+                  (lambda full_row: tuple(full_row[f] for f in look_up_fields))
+        native_table, change_log = getattr(tic_dat, fk.native_table), tic_dat._change_log
+        if (fk, look_up_fields) not in native_table._fk_lookups:
+            index = defaultdict(set)
+            for pk, full_row in self._full_rows(tic_dat, fk.native_table):
+                index[look_up(full_row)].add(pk)
+            native_table._fk_lookups[fk, look_up_fields] = [len(change_log), index]
+        position, index = native_table._fk_lookups[fk, look_up_fields]
+        for t, pk, action in change_log[position:]:
+            if t == fk.native_table and action != "deleted" and pk in native_table:
+                index[look_up(self._get_full_row(tic_dat, t, pk))].add(pk)
+        native_table._fk_lookups[fk, look_up_fields][0] = len(change_log)
+        return {pk for v in lost_values for pk in index.get(v, ()) if pk in native_table}
+    def _full_rows(self, tic_dat, table, keys=None):
+        """
+        generator yielding (primary key, full row) for each row of the table, where the full row is a dict that
+        includes the primary key fields. (For tables without a primary key, the row index is yielded in place of
+        the primary key, and the data row itself in place of the full row).
+        If keys is provided, then only the rows for those primary keys (or row indices) are yielded.
+        """
+        _table = getattr(tic_dat, table)
+        if not dictish(_table):
+            rows = _table if containerish(_table) else _table()
+            if keys is None:
+                yield from enumerate(rows)
+            else:
+                rows = rows if lupish(rows) else list(rows)
+                yield from ((i, rows[i]) for i in keys)
+            return
+        pk_fields = self.primary_key_fields[table]
+        for pk, data_row in (_table.items() if keys is None else ((k, _table[k]) for k in keys)):
+            full_row = dict(data_row)
+            if len(pk_fields) == 1:
+                full_row[pk_fields[0]] = pk
+            else:
+                full_row.update(zip(pk_fields, pk))
+            yield pk, full_row
     def obfusimplify(self, tic_dat, table_prepends = utils.FrozenDict(), skip_tables = (),
                      freeze_it = False) :
         """
@@ -2,7 +2,7 @@
 general utility module
 PEP8
 """
-from numbers import Number
+from numbers import Number, Integral, Real
 from itertools import chain, combinations
 from collections import defaultdict
 import ticdat
@@ -11,11 +11,28 @@ import sys
 import os
 from collections import namedtuple
 import time
+import math
 import datetime as datetime_
+import hashlib
+import ast
+import keyword
+import operator
+import re
+import concurrent.futures
+import gzip
+import bz2
 try:
     import dateutil, dateutil.parser
 except:
     dateutil = None
+try:
+    import lzma
+except:
+    lzma = None
+try:
+    import zstandard
+except:
+    zstandard = None
 import json
 try:
     import dspotconnect
@@ -267,6 +284,11 @@ class TypeDictionary(namedtuple("TypeDictionary",
                     ("number_allowed", "inclusive_min", "inclusive_max", "min",
                       "max", "must_be_int", "strings_allowed", "nullable", "datetime"))):
     def valid_data(self, data):
+        data_type = type(data)
+        if (data_type is float or data_type is int) and not self.datetime: # the common case, checked quickly
+            return bool(self.nullable) if data != data else self._valid_number(data)
+        if data_type is str and not self.datetime:
+            return self.strings_allowed == "*" or data in self.strings_allowed
         if (pd and pd.isnull(data)) or (data is None):
             return bool(self.nullable)
         if self.datetime:
@@ -295,6 +317,86 @@ class TypeDictionary(namedtuple("TypeDictionary",
             assert containerish(self.strings_allowed)
             return data in self.strings_allowed
         return False
+    def _invalid_positions(self, values):
+        """
+        :param values: a list of data values (i.e. a column)
+        :return: the (ascending) positions of the values that aren't valid_data. The distinct values are classified
+                 by type, so that the strings are checked only against strings_allowed and the numeric bounds are
+                 applied only to the int and float values. The other values are checked with valid_data.
+        """
+        try:
+            distinct = set(zip(map(type, values), values)) # the type distinguishes True from 1 (and 1 from 1.0)
+        except TypeError:
+            return [i for i, x in enumerate(values) if not self.valid_data(x)]
+        by_type = defaultdict(list)
+        for t, x in distinct:
+            by_type[t].append(x)
+        bad = set()
+        for t, xs in by_type.items():
+            if t is str and not self.datetime:
+                if self.strings_allowed != "*":
+                    allowed = set(self.strings_allowed)
+                    bad.update((t, x) for x in xs if x not in allowed)
+            elif t in (int, float) and not self.datetime:
+                bad.update((t, x) for x in xs if not (self.nullable if x != x else self._valid_number(x)))
+            else:
+                bad.update((t, x) for x in xs if not self.valid_data(x))
+        if not bad:
+            return []
+        return [i for i, k in enumerate(zip(map(type, values), values)) if k in bad]
+    def _invalid_mask(self, series):
+        """
+        :param series: a pandas.Series of data values (i.e. a column)
+        :return: a boolean Series that is True for the values that aren't valid_data (with null treated as None).
+                 The numeric bounds, must_be_int and strings_allowed rules are applied as vectorized operations.
+        """
+        nulls = series.isnull()
+        rtn = pd.Series(False, index=series.index) if self.nullable else nulls.copy()
+        def numbers_mask(numbers): # numbers is a float Series that is nan for the non-numbers
+            if not self.number_allowed:
+                return numbers.notnull()
+            bad = (numbers < self.min) | (numbers > self.max)
+            if not self.inclusive_min:
+                bad |= numbers == self.min
+            if not self.inclusive_max:
+                bad |= numbers == self.max
+            if self.must_be_int:
+                bad |= (numbers % 1 != 0) & numbers.notnull() & \
+                       ~((numbers == self.max) & (self.max == float("inf")) & self.inclusive_max)
+            return bad
+        if pd.api.types.is_bool_dtype(series):
+            return rtn | ~nulls
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return rtn if self.datetime else rtn | ~nulls
+        if pd.api.types.is_numeric_dtype(series) and not self.datetime:
+            return rtn | numbers_mask(series.astype(float))
+        if self.datetime or not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_object_dtype(series) or
+                                 pd.api.types.is_string_dtype(series)):
+            candidates = series[~nulls]
+            return rtn | candidates.map(lambda x: not self.valid_data(x)).reindex(series.index, fill_value=False)
+        types = series.map(type)
+        distinct_types = {t: (issubclass(t, Number) and not issubclass(t, bool), stringish(t)) for t in set(types)}
+        is_number = types.map({t: v[0] for t, v in distinct_types.items()}).astype(bool) & ~nulls
+        is_string = types.map({t: v[1] for t, v in distinct_types.items()}).astype(bool) & ~nulls
+        rtn |= ~(nulls | is_number | is_string)
+        if is_number.any():
+            numbers = pd.to_numeric(series.where(is_number), errors="coerce").astype(float)
+            rtn |= numbers_mask(numbers) & is_number
+            unconverted = is_number & numbers.isnull() # i.e. numbers (like Fraction) that to_numeric can't convert
+            if unconverted.any():
+                rtn |= series[unconverted].map(lambda x: not self.valid_data(x)).reindex(series.index,
+                                                                                         fill_value=False)
+        if is_string.any() and self.strings_allowed != "*":
+            rtn |= is_string & ~series.isin(self.strings_allowed)
+        return rtn
+    def _valid_number(self, data):
+        # the numericish portion of valid_data, for data that isn't null
+        if not self.number_allowed or data < self.min or data > self.max:
+            return False
+        if (not self.inclusive_min and data == self.min) or (not self.inclusive_max and data == self.max):
+            return False
+        return not self.must_be_int or safe_apply(int)(data) == data or \
+               (data == self.max == float("inf") and self.inclusive_max)
     @staticmethod
     def safe_creator(number_allowed, inclusive_min, inclusive_max, min, max,
                       must_be_int, strings_allowed, nullable, datetime=False):
@@ -339,21 +441,6 @@ development_deployed_environment = False
 
 def _integrity_solve(input_schema, dat):
     verify(pd, "pandas must be installed for this functionality to work")
-    pdf = input_schema.clone(clone_factory=ticdat.PanDatFactory)
-    # need to make sure the advanced row predicates copy over to pdf as well
-    memo_dat_version_of_func = {}
-    def dat_version_of_func(func_):  # closures and lambdas are tricky, this is needed
-        if func_ not in memo_dat_version_of_func:
-            memo_dat_version_of_func[func_] = lambda *args, **kwargs: func_(dat)
-        return memo_dat_version_of_func[func_]
-    if isinstance(input_schema, ticdat.TicDatFactory):
-        for t in input_schema.all_tables:
-            for predicate_name, predicate_tuple in input_schema.get_row_predicates(t).items():
-                if predicate_tuple.predicate_kwargs_maker:
-                    pdf.add_data_row_predicate(t, predicate_tuple.predicate, predicate_name,
-                                               dat_version_of_func(predicate_tuple.predicate_kwargs_maker),
-                                               predicate_tuple.predicate_failure_response)
-
     _id_flds = {t: (pks or dfs) for t, (pks, dfs) in input_schema.schema().items()}
     longest_id_flds =  max(len(id_fld) for id_fld in _id_flds.values())
     _fld_names = [f"Field {_ + 1}" for _ in range(longest_id_flds)]
@@ -363,59 +450,143 @@ def _integrity_solve(input_schema, dat):
         data_row_failures=[["Table Name", "Predicate Name", "Error Message"] + _fld_names, []],
         foreign_key_failures =[["Native Table", "Foreign Table", "Mapping"] + _fld_names, []])
 
-    if isinstance(input_schema, ticdat.PanDatFactory):
-        pan_dat = dat
+    # the identifying columns of each table are renamed to the report columns once, and shared by every report
+    def report_ids(table_, df):
+        df = df[list(_id_flds[table_])].copy()
+        df.columns = _fld_names[:len(_id_flds[table_])]
+        for f in _fld_names[len(_id_flds[table_]):]:
+            df[f] = None
+        return df.reset_index(drop=True)
+    _id_frames = {}
+    def id_frame(table_):
+        if table_ not in _id_frames:
+            _id_frames[table_] = report_ids(table_, getattr(pan_dat, table_))
+        return _id_frames[table_]
+
+    def error_rows(table_, where_bad_rows, **report_columns):
+        df = id_frame(table_)[numpy.asarray(where_bad_rows, dtype=bool)].reset_index(drop=True)
+        for i, (k, v) in enumerate(report_columns.items()):
+            df.insert(i, k, v)
+        return df
+
+    def report(table_, frames):
+        frames = [_ for _ in frames if len(_)]
+        if not frames:
+            return DataFrame(columns=list(solution_schema.primary_key_fields[table_]))
+        return pd.concat(frames, ignore_index=True)
+
+    def error_message_row(table_, predicate_, error_message):
+        return DataFrame([[table_, predicate_, error_message] + [None] * len(_fld_names)],
+                         columns=["Table Name", "Predicate Name", "Error Message"] + _fld_names)
+
+    def data_row_frame(table_, predicate_, df, error_message=None):
+        df.insert(0, "Error Message", error_message)
+        df.insert(0, "Predicate Name", predicate_)
+        df.insert(0, "Table Name", table_)
+        return df
+
+    data_row_frames = []
+    if isinstance(input_schema, ticdat.TicDatFactory):
+        # a single pass over the rows of dat finds all the failures (see TicDatFactory.find_all_failures). The
+        # failing rows are then located by their positions in the DataFrames of the tables that have failures.
+        assert input_schema.good_tic_dat_object(dat), "dat not a good object for this factory"
+        # the row predicates see null cells the way a DataFrame would present them (i.e. nan or NaT, not None)
+        predicate_nulls = defaultdict(dict)
+        for table in input_schema._data_row_predicates:
+            rows = [full_row for _, full_row in input_schema._full_rows(dat, table)]
+            for field in input_schema.primary_key_fields.get(table, ()) + input_schema.data_fields.get(table, ()):
+                values = [row[field] for row in rows]
+                null_position = next((i for i, v in enumerate(values) if v is None), None)
+                if null_position is not None:
+                    predicate_nulls[table][field] = pd.Series(values).iloc[[null_position]].tolist()[0]
+        all_fails = input_schema._find_all_failures(dat, "__debug__", predicate_nulls=predicate_nulls)
+        failing_tables = {t for t, _ in all_fails.data_type}.union(
+            [fk.native_table for fk in all_fails.foreign_key],
+            [t for (t, _), v in all_fails.data_row.items() if not hasattr(v, "error_message")])
+        pan_dat = input_schema.copy_to_pandas(dat, table_restrictions=sorted(failing_tables), reset_index=True) \
+                  if failing_tables else None
+        _positions = {}
+        def position(table_, key):
+            if not input_schema.primary_key_fields.get(table_):
+                return key
+            if table_ not in _positions:
+                _positions[table_] = {pk: i for i, pk in enumerate(getattr(dat, table_))}
+            return _positions[table_][key]
+        def row_mask(table_, keys):
+            rtn = numpy.zeros(len(id_frame(table_)), dtype=bool)
+            rtn[[position(table_, k) for k in keys]] = True
+            return rtn
+
+        dups = {}
+        dt_fails = defaultdict(dict)
+        for table, type_row in input_schema._true_data_types().items():
+            for field in type_row:
+                if (table, field) in all_fails.data_type:
+                    dt_fails[table][field] = row_mask(table, all_fails.data_type[table, field].pks)
+        fk_fails = {(fk.native_table, fk.foreign_table, tuple(fk.mapping)):
+                    row_mask(fk.native_table, all_fails.foreign_key[fk].native_pks)
+                    for fk in input_schema.foreign_keys if fk in all_fails.foreign_key}
+
+        # the data row failures are reported in the order that find_data_row_failures uses for a PanDat
+        table_order = {t: i for i, t in enumerate(dict.fromkeys(list(input_schema._data_row_predicates) +
+                                                                ["parameters"]))}
+        predicate_order = lambda table_, predicate_: \
+            list(input_schema._data_row_predicates.get(table_, {})).index(predicate_) \
+            if predicate_ in input_schema._data_row_predicates.get(table_, {}) else float("inf")
+        for (table, predicate), bad_rows in sorted(all_fails.data_row.items(),
+                                                   key=lambda kv: (table_order[kv[0][0]], predicate_order(*kv[0]))):
+            if hasattr(bad_rows, "primary_key") and hasattr(bad_rows, "error_message"):
+                data_row_frames.append(error_message_row(table, predicate, bad_rows.error_message))
+            elif bad_rows and hasattr(bad_rows[0], "error_message"):
+                rows, error_messages = zip(*sorted((position(table, _.primary_key), _.error_message)
+                                                   for _ in bad_rows))
+                data_row_frames.append(data_row_frame(table, predicate,
+                                                      id_frame(table).iloc[list(rows)].reset_index(drop=True),
+                                                      list(error_messages)))
+            else:
+                rows = sorted(position(table, _) for _ in bad_rows)
+                data_row_frames.append(data_row_frame(table, predicate,
+                                                      id_frame(table).iloc[rows].reset_index(drop=True)))
     else:
-        pan_dat = input_schema.copy_to_pandas(dat, reset_index=True)
-
-    def add_error_row(default_dict_object, table_, row_):
-        for f, c in zip(_fld_names, row_[:len(_id_flds[table_])]):
-            default_dict_object[f].append(c)
-        for i in range(len(_id_flds[table_]), longest_id_flds):
-            default_dict_object[_fld_names[i]].append(None)
-
-    dups = pdf.find_duplicates(pan_dat)
-    duplicate_rows = defaultdict(list)
-    for table, dup_df in dups.items():
-        for row in dup_df.itertuples(index=False):
-            duplicate_rows["Table Name"].append(table)
-            add_error_row(duplicate_rows, table, row)
-
-    dt_fails = pdf.find_data_type_failures(pan_dat)
-    data_type_failures = defaultdict(list)
-    for (table, field), dt_fail_df in dt_fails.items():
-        for row in dt_fail_df.itertuples(index=False):
-            data_type_failures["Table Name"].append(table)
-            data_type_failures["Field Name"].append(field)
-            add_error_row(data_type_failures, table, row)
-
-    fk_fails = pdf.find_foreign_key_failures(pan_dat, verbosity="Low")
-    foreign_key_failures = defaultdict(list)
-    for (native_table, foreign_table, mapping), fk_fail_df in fk_fails.items():
-        for row in fk_fail_df.itertuples(index=False):
-            foreign_key_failures["Native Table"].append(native_table)
-            foreign_key_failures["Foreign Table"].append(foreign_table)
-            foreign_key_failures["Mapping"].append(str(mapping))
-            add_error_row(foreign_key_failures, native_table, row)
-
-    dr_fails = pdf.find_data_row_failures(pan_dat)
-    data_row_failures = defaultdict(list)
-    for (table, predicate), bad_rows in dr_fails.items():
-        if hasattr(bad_rows, "primary_key") and hasattr(bad_rows, "error_message"):
-            data_row_failures["Table Name"].append(table)
-            data_row_failures["Predicate Name"].append(predicate)
-            data_row_failures["Error Message"].append(bad_rows.error_message)
-            for f in _fld_names:
-                data_row_failures[f].append(None)
-        else:
-            for row in bad_rows.itertuples(index=False):
-                data_row_failures["Table Name"].append(table)
-                data_row_failures["Predicate Name"].append(predicate)
+        pan_dat = dat
+        # the data row failures are found as tables, so as to include the error messages
+        all_fails = input_schema._find_all_failures(pan_dat, False, True, "__debug__")
+        dups = all_fails.duplicates
+        dt_fails = defaultdict(dict)
+        for (table, field), where_bad_rows in all_fails.data_type.items():
+            dt_fails[table][field] = numpy.asarray(where_bad_rows, dtype=bool)
+        fk_fails = {(fk.native_table, fk.foreign_table, tuple(fk.mapping)): where_bad_rows
+                    for fk, where_bad_rows in all_fails.foreign_key.items()}
+        for (table, predicate), bad_rows in all_fails.data_row.items():
+            if hasattr(bad_rows, "primary_key") and hasattr(bad_rows, "error_message"):
+                data_row_frames.append(error_message_row(table, predicate, bad_rows.error_message))
+            else:
                 error_message = None
-                if len(row) > len(input_schema.primary_key_fields[table] + input_schema.data_fields[table]):
-                    error_message = row[-1]
-                data_row_failures["Error Message"].append(error_message)
-                add_error_row(data_row_failures, table, row)
+                if len(bad_rows.columns) > len(input_schema.primary_key_fields[table] +
+                                               input_schema.data_fields[table]):
+                    error_message = bad_rows.iloc[:, -1].to_numpy()
+                data_row_frames.append(data_row_frame(table, predicate, report_ids(table, bad_rows), error_message))
+
+    duplicate_rows = report("duplicate_rows", [error_rows(table, dups_, **{"Table Name": table})
+                                               for table, dups_ in dups.items()])
+
+    # the boolean failure arrays of a table are melted into (row, field) pairs, ordered by field and then row
+    data_type_frames = []
+    for table, fails in dt_fails.items():
+        fields = list(fails)
+        field_positions, row_positions = numpy.nonzero(numpy.vstack([fails[f] for f in fields]))
+        df = id_frame(table).iloc[row_positions].reset_index(drop=True)
+        df.insert(0, "Field Name", numpy.asarray(fields, dtype=object)[field_positions])
+        df.insert(0, "Table Name", table)
+        data_type_frames.append(df)
+    data_type_failures = report("data_type_failures", data_type_frames)
+
+    foreign_key_failures = report("foreign_key_failures",
+        [error_rows(native_table, where_bad_rows, **{"Native Table": native_table, "Foreign Table": foreign_table,
+                                                    "Mapping": str(mapping)})
+         for (native_table, foreign_table, mapping), where_bad_rows in fk_fails.items()])
+
+    data_row_failures = report("data_row_failures", data_row_frames)
 
     return (solution_schema,
             solution_schema.PanDat(duplicate_rows=duplicate_rows, data_type_failures=data_type_failures,
@@ -458,6 +629,10 @@ def standard_main(input_schema, solution_schema, solve, case_space_table_names=F
 
     --> ending in ".json" imply reading/writing .json files
 
+    --> the ".json" and ".sql" endings can be followed by ".gz", ".bz2", ".xz" or ".zst", in which case the file
+        is compressed (or decompressed) as it is written (or read). (The ".zst" codec needs the zstandard package).
+        Similarly, the .csv files of an input directory can be compressed.
+
     --> otherwise, the assumption is that an input/output directory is being specified,
         which will be used for reading/writing .csv files.
         (Recall that .csv format is implemented as one-csv-file-per-table, so an entire
@@ -552,7 +727,10 @@ def standard_main(input_schema, solution_schema, solve, case_space_table_names=F
                 return engine_on_foresta.download_solution(foresta_dict["scenario"])
             input_file = None
 
-    file_or_dir = lambda f: "file" if any(f.endswith(_) for _ in recognized_extensions) else "directory"
+    compressible_extensions = tuple(_ for _ in recognized_extensions if _ in (".json", ".sql"))
+    file_or_dir = lambda f: "file" if any(f.endswith(_) for _ in recognized_extensions) or \
+                                      any(_uncompressed_name(f).endswith(_) for _ in compressible_extensions) \
+                                   else "directory"
     dat = None
     if input_file:
         if not (os.path.exists(input_file)):
@@ -612,26 +790,29 @@ def standard_main(input_schema, solution_schema, solve, case_space_table_names=F
         print("No solution was created!")
 
 def _get_dat_object(tdf, create_routine, file_path, file_or_directory, check_for_dups):
+    def create_or_check_for_dups(tdf_io):
+        if not check_for_dups:
+            return getattr(tdf_io, create_routine)(file_path)
+        # the duplicates are counted as the rows are read, so the file is only read once
+        dups, rtn = tdf_io._find_duplicates_and_create_tic_dat(file_path)
+        assert not dups, "duplicate rows found"
+        return rtn
     def inner_f():
         if os.path.isfile(file_path) and file_or_directory == "file":
-            if file_path.endswith(".json"):
-                assert not (check_for_dups and tdf.json.find_duplicates(file_path)), "duplicate rows found"
-                return getattr(tdf.json, create_routine)(file_path)
+            if _uncompressed_name(file_path).endswith(".json"):
+                return create_or_check_for_dups(tdf.json)
             if file_path.endswith(".xls") or file_path.endswith(".xlsx"):
-                assert not (check_for_dups and tdf.xls.find_duplicates(file_path)), "duplicate rows found"
-                return getattr(tdf.xls, create_routine)(file_path)
+                return create_or_check_for_dups(tdf.xls)
             if file_path.endswith(".db"):
-                assert not (check_for_dups and tdf.sql.find_duplicates(file_path)), "duplicate rows found"
-                return getattr(tdf.sql, create_routine)(file_path)
-            if file_path.endswith(".sql"):
+                return create_or_check_for_dups(tdf.sql)
+            if _uncompressed_name(file_path).endswith(".sql"):
                 # no way to check a .sql file for duplications
                 return tdf.sql.create_tic_dat_from_sql(file_path) # only TicDat objects handle .sql files
             if file_path.endswith(".mdb") or file_path.endswith(".accdb"):
                 assert not (check_for_dups and tdf.mdb.find_duplicates(file_path)), "duplicate rows found"
                 return tdf.mdb.create_tic_dat(file_path)
         elif os.path.isdir(file_path) and file_or_directory == "directory":
-            assert not (check_for_dups and tdf.csv.find_duplicates(file_path)), "duplicate rows found"
-            return getattr(tdf.csv, create_routine)(file_path)
+            return create_or_check_for_dups(tdf.csv)
     dat = inner_f()
     verify(dat, f"Failed to read from and/or recognize {file_path}{_extra_input_file_check_str(file_path)}")
     return dat
@@ -639,13 +820,13 @@ def _get_dat_object(tdf, create_routine, file_path, file_or_directory, check_for
 def _get_write_function_and_kwargs(tdf, file_path, file_or_directory, case_space_table_names):
     write_func = None
     if file_or_directory == "file":
-        if file_path.endswith(".json"):
+        if _uncompressed_name(file_path).endswith(".json"):
             write_func = tdf.json.write_file
         if file_path.endswith(".xls") or file_path.endswith(".xlsx"):
             write_func = tdf.xls.write_file
         if file_path.endswith(".db"):
             write_func = getattr(tdf.sql, "write_db_data", getattr(tdf.sql, "write_file", None))
-        if file_path.endswith(".sql"):
+        if _uncompressed_name(file_path).endswith(".sql"):
             write_func = tdf.sql.write_sql_file
         if file_path.endswith(".mdb") or file_path.endswith(".accdb"):
             write_func = tdf.mdb.write_file
@@ -657,6 +838,31 @@ def _get_write_function_and_kwargs(tdf, file_path, file_or_directory, case_space
     kwargs = {k: v for k, v in kwargs.items() if k in inspect.getfullargspec(write_func).args}
     return write_func, kwargs
 
+_compression_suffixes = (".gz", ".bz2", ".xz", ".zst")
+
+def _compression_suffix(file_path):
+    return next((_ for _ in _compression_suffixes if stringish(file_path) and file_path.lower().endswith(_)), "")
+
+def _uncompressed_name(file_path):
+    # the file path with any compression suffix removed, i.e. the name that determines the file format
+    return file_path[:len(file_path) - len(_compression_suffix(file_path))]
+
+def _open_file(file_path, mode="r", **kwargs):
+    # like open, but transparently (de)compresses files whose names end in one of the _compression_suffixes
+    suffix = _compression_suffix(file_path)
+    if not suffix:
+        return open(file_path, mode, **kwargs)
+    mode = mode if "b" in mode else mode.replace("t", "") + "t"
+    if suffix == ".gz":
+        return gzip.open(file_path, mode, **kwargs)
+    if suffix == ".bz2":
+        return bz2.open(file_path, mode, **kwargs)
+    if suffix == ".xz":
+        verify(lzma, "lzma needs to be installed to read or write .xz files")
+        return lzma.open(file_path, mode, **kwargs)
+    verify(zstandard, "zstandard needs to be installed to read or write .zst files")
+    return zstandard.open(file_path, mode, **kwargs)
+
 def _extra_input_file_check_str(input_file):
     if os.path.isfile(input_file) and input_file.endswith(".csv"):
         return "\nTo load data from .csv files, pass the directory containing the .csv files as the " +\
@@ -740,18 +946,104 @@ def create_duplicate_focused_tdf(tdf):
     if primary_key_fields:
         return ticdat.TicDatFactory(**{k:[[],v] for k,v in primary_key_fields.items()})
 
+def count_duplicate_keys(keys):
+    """
+    Count primary key values as they stream by, without building any intermediate table.
+    :param keys: an iterable of primary key values (scalar for single field keys, tuple otherwise)
+    :return: a dictionary of key->count, with counts smaller than 2 pruned off
+    """
+    rtn = defaultdict(int)
+    for k in keys:
+        rtn[k] += 1
+    return {k:v for k,v in rtn.items() if v > 1}
+
+def _map_tables(function, tables, max_workers=None, processes=False):
+    # returns {table: function(table)}. If max_workers is provided, the tables are processed concurrently, with a
+    # process pool if processes is truthy (in which case function needs to be picklable) and a thread pool otherwise
+    verify(max_workers is None or (numericish(max_workers) and int(max_workers) == max_workers > 0),
+           "max_workers should be a positive integer")
+    tables = list(tables)
+    if max_workers is None or max_workers == 1 or len(tables) < 2:
+        return {t: function(t) for t in tables}
+    executor = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+    with executor(max_workers=int(max_workers)) as pool:
+        return dict(zip(tables, pool.map(function, tables)))
+
+def _sample_size(sample, population):
+    """
+    :param sample: either a float in (0, 1] (a fraction of the population) or a positive int (a row count).
+                   The type decides, so 1.0 is the entire population whereas 1 is a single row. Booleans are
+                   rejected.
+
+    :param population: the number of rows that could be sampled
+
+    :return: the number of rows to sample
+    """
+    verify(isinstance(sample, Real) and not isinstance(sample, bool),
+           "sample should either be a float fraction between 0 and 1, or a positive int row count")
+    if isinstance(sample, Integral):
+        verify(sample > 0, "an int sample is a row count, and needs to be positive")
+        return min(int(sample), population)
+    verify(0 < sample <= 1, "a float sample is a fraction of the rows, and needs to be in (0, 1]")
+    return min(int(math.ceil(sample * population)), population)
+
+def _sampled_failures(failures, sample_sizes, failure_count):
+    """
+    wraps the results of a find routine that only checked a sample of each table
+
+    :param failures: the dictionary returned by the find routine. The keys need to have a "table" attribute.
+
+    :param sample_sizes: a dictionary mapping table to (number of rows checked, number of rows in the table)
+
+    :param failure_count: a function mapping a value of failures to the number of failed rows it represents
+
+    :return: a namedtuple with members "failures", "sample_sizes", "estimated_failure_rates", "may_be_undercounted"
+    """
+    SampledFailures = namedtuple("SampledFailures", ["failures", "sample_sizes", "estimated_failure_rates",
+                                                     "may_be_undercounted"])
+    return SampledFailures(failures, sample_sizes,
+                           {k: min(failure_count(v) / max(sample_sizes[k.table][0], 1), 1.0)
+                            for k, v in failures.items()},
+                           any(checked < total for checked, total in sample_sizes.values()))
+
+def _fingerprint_datetime(x):
+    """
+    :param x: a datetime.datetime (or pandas.Timestamp)
+    :return: a canonical string for x. Timezone aware datetimes are first converted to UTC.
+    """
+    if x.tzinfo is not None:
+        x = x.astimezone(datetime_.timezone.utc).replace(tzinfo=None)
+    return x.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def _fingerprint_table(fields, row_hashes):
+    """
+    :param fields: the field names of the table
+    :param row_hashes: the bytes of the sorted hashes of the rows of the table
+    :return: a hex digest string for the table
+    """
+    rtn = hashlib.sha256(repr(tuple(fields)).encode())
+    rtn.update(row_hashes)
+    return rtn.hexdigest()
+
+def _fingerprint(table_digests):
+    """
+    :param table_digests: a dictionary mapping table name to the _fingerprint_table digest for that table
+    :return: a namedtuple with members "overall" and "tables"
+    """
+    Fingerprint = namedtuple("Fingerprint", ["overall", "tables"])
+    overall = hashlib.sha256()
+    for t, digest in sorted(table_digests.items()):
+        overall.update(f"{t}:{digest};".encode())
+    return Fingerprint(overall.hexdigest(), FrozenDict(table_digests))
+
 def find_duplicates(td, tdf_for_dups):
     assert tdf_for_dups.good_tic_dat_object(td)
     assert not any(tdf_for_dups.primary_key_fields.values())
     assert not tdf_for_dups.generator_tables
-    rtn = {t:defaultdict(int) for t in tdf_for_dups.primary_key_fields}
+    rtn = {}
     for t,flds in list(tdf_for_dups.data_fields.items()):
-        tbl = getattr(td, t)
-        for row in tbl:
-            k = tuple(row[f] for f in flds)
-            k = k[0] if len(k)==1 else k
-            rtn[t][k] += 1
-        rtn[t] = {k:v for k,v in rtn[t].items() if v > 1}
+        rtn[t] = count_duplicate_keys(k[0] if len(k)==1 else k for row in getattr(td, t)
+                                      for k in [tuple(row[f] for f in flds)])
         if not rtn[t]:
             del(rtn[t])
     return rtn
@@ -762,19 +1054,20 @@ def find_duplicates_from_dict_ticdat(tdf, dict_ticdat):
             all(map(containerish, dict_ticdat.values()))
      primary_key_fields = {k:v for k,v in tdf.primary_key_fields.items() if v}
      if primary_key_fields:
-         old_schema = {k:v for k,v in tdf.schema().items() if k in primary_key_fields}
-         all_data_tdf = ticdat.TicDatFactory(**{t:[[], pks+dfs]
-                                                for t,(pks,dfs) in old_schema.items()})
-         td = all_data_tdf.TicDat(**{k:v for k,v in dict_ticdat.items()
-                                     if k in primary_key_fields})
-         rtn = {t:defaultdict(int) for t in primary_key_fields}
-         for t,flds in list(primary_key_fields.items()):
-             tbl = getattr(td, t)
-             for row in tbl:
-                 k = tuple(row[f] for f in flds)
-                 k = k[0] if len(k)==1 else k
-                 rtn[t][k] += 1
-             rtn[t] = {k:v for k,v in rtn[t].items() if v > 1}
+         rtn = {}
+         for t,pks in list(primary_key_fields.items()):
+             all_flds = pks + tdf.data_fields.get(t, ())
+             def key_of(row):
+                 if dictish(row):
+                     verify(set(row).issubset(all_flds), "Unrecognized fields for table %s : %s"%
+                            (t, sorted(set(row).difference(all_flds))))
+                     k = tuple(row.get(f, 0) for f in pks)
+                 else:
+                     verify(containerish(row) and len(row) == len(all_flds),
+                            "Inconsistent row length for table %s"%t)
+                     k = tuple(row[:len(pks)])
+                 return k[0] if len(k)==1 else k
+             rtn[t] = count_duplicate_keys(map(key_of, dict_ticdat.get(t, ())))
              if not rtn[t]:
                  del(rtn[t])
          return rtn
@@ -1004,6 +1297,10 @@ class FreezeableDict(_FreezableDictBase) :
         if not getattr(self, "_dataFrozen", False) :
             return super(FreezeableDict, self).pop(*args, **kwargs)
         raise TicDatError("Can't edit a frozen " + self.__class__.__name__)
+    def __ior__(self, other):
+        # dict.__ior__ wouldn't go through the (possibly overridden) update
+        self.update(other)
+        return self
 
 class FrozenDict(FreezeableDict) :
     def __init__(self, *args, **kwargs):
@@ -1060,6 +1357,8 @@ def td_row_factory(table, key_field_names, data_field_names, default_values=None
     fieldtoindex = {x:data_field_names.index(x) for x in data_field_names}
     indextofield = {v:k for k,v in fieldtoindex.items()}
     class TicDatDataRow(freezable_factory(object, "_attributesFrozen")) :
+        _on_change = None # set by the owning table when change tracking is enabled
+        _mutations = 0 # counts the edits to all the rows of this class, see TicDatFactory._content_stamp
         def __init__(self, x):
             # since ticDat targeting numerical analysis, 0 is good default default
             self._data = [0] * len(fieldtoindex)
@@ -1091,6 +1390,9 @@ def td_row_factory(table, key_field_names, data_field_names, default_values=None
             if getattr(self, "_dataFrozen", False) :
                 raise TicDatError("Can't edit a frozen TicDatDataRow")
             self._data[fieldtoindex[key]] = value
+            TicDatDataRow._mutations += 1
+            if self._on_change is not None:
+                self._on_change()
         def keys(self):
             return tuple(indextofield[i] for i in range(len(self)))
         def values(self):
@@ -1327,6 +1629,546 @@ def nearly_same(x1, x2, epsilon) :
 RowPredicateInfo = namedtuple("RowPredicateInfo", ["predicate", "predicate_kwargs_maker",
                                                    "predicate_failure_response"])
 
+class RowPredicateExpression(object):
+    """
+    A row predicate written as a restricted expression over the fields of a table, such as
+    "Min Nutrition <= Max Nutrition" or "Quantity > 0 or Quantity is None".
+
+    The expression can use field names (field names that aren't simple identifiers can be enclosed in backticks),
+    number, string, True, False and None constants, the arithmetic operators + - * /, the comparison operators
+    < <= > >= == !=, "is None", "is not None", and "and", "or", "not" with parentheses.
+
+    Null values (None or nan) are handled the same by both forms of the expression. A comparison involving a
+    null value is False and arithmetic involving a null value is null. Division by zero is also null (so that
+    "a / b > 1" fails the rows where b is zero). Use "is None" to check for nulls.
+
+    A RowPredicateExpression is itself a one argument row predicate (i.e. it can be called on a row dict). It can also
+    be evaluated as a single vectorized mask over a DataFrame (see mask) and rendered as a SQL condition (see sql).
+    """
+    _comparisons = {ast.Lt: ("<", operator.lt), ast.LtE: ("<=", operator.le), ast.Gt: (">", operator.gt),
+                    ast.GtE: (">=", operator.ge), ast.Eq: ("==", operator.eq), ast.NotEq: ("!=", operator.ne)}
+    _arithmetic = {ast.Add: ("+", operator.add), ast.Sub: ("-", operator.sub), ast.Mult: ("*", operator.mul),
+                   ast.Div: ("/", operator.truediv)}
+    def __init__(self, expression, fields):
+        """
+        :param expression: the expression string
+        :param fields: the fields of the table (primary key fields and data fields) the expression can refer to
+        """
+        verify(stringish(expression) and expression.strip(), "expression should be a non-empty string")
+        self.expression = expression
+        self.fields = tuple(fields)
+        self._tree = self._parse(expression)
+        self._row_function = self._compile()
+    def __repr__(self):
+        return f"RowPredicateExpression({self.expression!r})"
+    def _parse(self, expression):
+        names = {}
+        def placeholder(f):
+            verify(f in self.fields, f"{f} is not a field in this table")
+            if f not in names:
+                names[f] = f"_ticdat_field_{len(names)}"
+            return names[f]
+        bare_fields = sorted((f for f in self.fields if f not in keyword.kwlist + ["None", "True", "False"]),
+                             key=lambda f: -len(f))
+        bare_pattern = re.compile(r"(?<![\w`])(" + "|".join(map(re.escape, bare_fields)) + r")(?![\w`])") \
+                       if bare_fields else None
+        segments = re.split(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""", expression)
+        for i in range(0, len(segments), 2): # the odd segments are string constants, and are left alone
+            segments[i] = re.sub(r"`([^`]*)`", lambda m: placeholder(m.group(1)), segments[i])
+            if bare_pattern:
+                segments[i] = bare_pattern.sub(lambda m: placeholder(m.group(1)), segments[i])
+        try:
+            tree = ast.parse("".join(segments).strip(), mode="eval").body
+        except SyntaxError as e:
+            raise TicDatError(f"Unable to parse expression {expression} : {e}")
+        self._field_of = {v: k for k, v in names.items()}
+        self._check(tree)
+        return tree
+    def _check(self, node):
+        if isinstance(node, ast.Name):
+            verify(node.id in self._field_of, f"{node.id} is not a field in this table")
+        elif isinstance(node, ast.Constant):
+            verify(node.value is None or isinstance(node.value, (bool, int, float, str)),
+                   f"Unsupported constant {node.value!r}")
+        elif isinstance(node, ast.BoolOp):
+            list(map(self._check, node.values))
+        elif isinstance(node, ast.UnaryOp):
+            verify(isinstance(node.op, (ast.Not, ast.USub, ast.UAdd)), "Unsupported unary operator")
+            self._check(node.operand)
+        elif isinstance(node, ast.BinOp):
+            verify(type(node.op) in self._arithmetic, "Unsupported arithmetic operator")
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.Compare):
+            for op, right in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.Is, ast.IsNot)):
+                    verify(isinstance(right, ast.Constant) and right.value is None and len(node.ops) == 1,
+                           "is and is not can only be used as 'is None' and 'is not None'")
+                else:
+                    verify(type(op) in self._comparisons, "Unsupported comparison operator")
+                    self._check(right)
+            self._check(node.left)
+        else:
+            raise TicDatError(f"Unsupported expression element {type(node).__name__} in {self.expression}")
+    def _compile(self):
+        """
+        compile the syntax tree into a function of a row dict, built from a closure for each node, so that the row by
+        row form doesn't dispatch on the node types for each row. The closures return None for null values (the
+        fields are normalized as they are read), and the comparisons and boolean operations return booleans.
+        """
+        def truthy(n):
+            f = to_function(n)
+            if isinstance(n, (ast.BoolOp, ast.Compare)) or (isinstance(n, ast.UnaryOp) and isinstance(n.op, ast.Not)):
+                return f
+            def truthy_(row):
+                v = f(row)
+                return v is not None and bool(v)
+            return truthy_
+        def to_function(n):
+            if isinstance(n, ast.Name):
+                field = self._field_of[n.id]
+                def field_(row):
+                    v = row[field]
+                    return None if v is None or v != v else v # v != v for nan and NaT
+                return field_
+            if isinstance(n, ast.Constant):
+                value = n.value
+                return lambda row: value
+            if isinstance(n, ast.BoolOp):
+                functions, is_and = tuple(map(truthy, n.values)), isinstance(n.op, ast.And)
+                if len(functions) == 2: # the common case
+                    f, g = functions
+                    return (lambda row: f(row) and g(row)) if is_and else (lambda row: f(row) or g(row))
+                def bool_op(row):
+                    for f in functions:
+                        if bool(f(row)) != is_and:
+                            return not is_and
+                    return is_and
+                return bool_op
+            if isinstance(n, ast.UnaryOp):
+                if isinstance(n.op, ast.Not):
+                    operand = truthy(n.operand)
+                    return lambda row: not operand(row)
+                operand, op = to_function(n.operand), operator.neg if isinstance(n.op, ast.USub) else operator.pos
+                def unary_op(row):
+                    v = operand(row)
+                    return None if v is None else op(v)
+                return unary_op
+            if isinstance(n, ast.BinOp):
+                left, right, op = to_function(n.left), to_function(n.right), self._arithmetic[type(n.op)][1]
+                is_div = isinstance(n.op, ast.Div)
+                def bin_op(row):
+                    x, y = left(row), right(row)
+                    if x is None or y is None or (is_div and y == 0):
+                        return None
+                    v = op(x, y)
+                    return None if v != v else v
+                return bin_op
+            assert isinstance(n, ast.Compare)
+            if isinstance(n.ops[0], (ast.Is, ast.IsNot)):
+                operand = to_function(n.left)
+                if isinstance(n.ops[0], ast.Is):
+                    return lambda row: operand(row) is None
+                return lambda row: operand(row) is not None
+            first = to_function(n.left)
+            rest = tuple((self._comparisons[type(op)][1], to_function(c)) for op, c in zip(n.ops, n.comparators))
+            if len(rest) == 1: # the common case, which is worth a faster closure
+                op, c = self._comparisons[type(n.ops[0])][1], n.comparators[0]
+                if isinstance(c, ast.Constant) and c.value is not None:
+                    value = c.value
+                    def compare_constant(row):
+                        x = first(row)
+                        return x is not None and bool(op(x, value))
+                    return compare_constant
+                second = rest[0][1]
+                def compare_one(row):
+                    x, y = first(row), second(row)
+                    return x is not None and y is not None and bool(op(x, y))
+                return compare_one
+            def compare(row):
+                x = first(row)
+                for op, f in rest:
+                    y = f(row)
+                    if x is None or y is None or not op(x, y):
+                        return False
+                    x = y
+                return True
+            return compare
+        return truthy(self._tree)
+    def __call__(self, row):
+        return bool(self._row_function(row))
+    def mask(self, df):
+        """
+        :param df: a DataFrame with columns for the fields of the table
+        :return: a boolean Series, indexed like df, that is True for the rows that pass the predicate
+        """
+        rtn = self._evaluate(self._tree, df, _series_ops)
+        if not isinstance(rtn, pd.Series):
+            return pd.Series(bool(rtn) and not _series_ops.isnull(rtn), index=df.index)
+        return _series_ops.truthy(rtn)
+    def sql(self, field_names=None):
+        """
+        :param field_names: optional. A dictionary mapping field names to the column names used by the database.
+                            (For example, the PostgreSQL column names are typically different from the field names).
+        :return: a SQL condition string (suitable for both SQLite and PostgreSQL) that is true for the rows that
+                 pass the predicate. Thus, "WHERE NOT (...)" selects the failing rows.
+        """
+        field_names = field_names or {}
+        quote = lambda f: '"%s"' % field_names.get(f, f).replace('"', '""')
+        def constant(v):
+            if v is None:
+                return "NULL"
+            if isinstance(v, bool):
+                return "TRUE" if v else "FALSE"
+            if stringish(v):
+                return "'%s'" % v.replace("'", "''")
+            return repr(float(v)) if isinstance(v, float) else repr(v)
+        def truthy(n): # fields, constants and arithmetic used as booleans need to be compared to zero
+            if isinstance(n, (ast.BoolOp, ast.Compare)) or (isinstance(n, ast.UnaryOp) and isinstance(n.op, ast.Not))\
+                    or (isinstance(n, ast.Constant) and isinstance(n.value, bool)):
+                return to_sql(n)
+            return f"COALESCE(({to_sql(n)}) <> 0, FALSE)"
+        def to_sql(n):
+            if isinstance(n, ast.Name):
+                return quote(self._field_of[n.id])
+            if isinstance(n, ast.Constant):
+                return constant(n.value)
+            if isinstance(n, ast.BoolOp):
+                return "(%s)" % (" AND " if isinstance(n.op, ast.And) else " OR ").join(map(truthy, n.values))
+            if isinstance(n, ast.UnaryOp):
+                return f"(NOT {truthy(n.operand)})" if isinstance(n.op, ast.Not) else \
+                       f"({'-' if isinstance(n.op, ast.USub) else '+'}{to_sql(n.operand)})"
+            if isinstance(n, ast.BinOp):
+                left, right = to_sql(n.left), to_sql(n.right)
+                if isinstance(n.op, ast.Div): # avoid integer division, and make division by zero null
+                    left, right = f"({left} * 1.0)", f"NULLIF({right}, 0)"
+                return f"({left} {self._arithmetic[type(n.op)][0]} {right})"
+            assert isinstance(n, ast.Compare)
+            if isinstance(n.ops[0], (ast.Is, ast.IsNot)):
+                return f"({to_sql(n.left)} IS {'NOT ' if isinstance(n.ops[0], ast.IsNot) else ''}NULL)"
+            comparisons, left = [], n.left
+            for op, right in zip(n.ops, n.comparators):
+                symbol = {ast.Eq: "=", ast.NotEq: "<>"}.get(type(op), self._comparisons[type(op)][0])
+                comparisons.append(f"COALESCE(({to_sql(left)} {symbol} {to_sql(right)}), FALSE)")
+                left = right
+            return comparisons[0] if len(comparisons) == 1 else "(%s)" % " AND ".join(comparisons)
+        return truthy(self._tree)
+    def _evaluate(self, node, data, ops):
+        evaluate = lambda n: self._evaluate(n, data, ops)
+        if isinstance(node, ast.Name):
+            return ops.field(data, self._field_of[node.id])
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.BoolOp):
+            combine = ops.and_ if isinstance(node.op, ast.And) else ops.or_
+            rtn = ops.truthy(evaluate(node.values[0]))
+            for value in node.values[1:]:
+                rtn = combine(rtn, ops.truthy(evaluate(value)))
+            return rtn
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.Not):
+                return ops.not_(ops.truthy(evaluate(node.operand)))
+            operand = evaluate(node.operand)
+            return ops.arithmetic(operator.neg if isinstance(node.op, ast.USub) else operator.pos, operand)
+        if isinstance(node, ast.BinOp):
+            return ops.arithmetic(self._arithmetic[type(node.op)][1], evaluate(node.left), evaluate(node.right))
+        assert isinstance(node, ast.Compare)
+        if isinstance(node.ops[0], (ast.Is, ast.IsNot)):
+            rtn = ops.isnull(evaluate(node.left))
+            return rtn if isinstance(node.ops[0], ast.Is) else ops.not_(rtn)
+        rtn, left = None, evaluate(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = evaluate(comparator)
+            this = ops.compare(self._comparisons[type(op)][1], left, right)
+            rtn, left = this if rtn is None else ops.and_(rtn, this), right
+        return rtn
+
+class _RowOps(object):
+    """
+    the scalar operations used to evaluate a RowPredicateExpression (or an AggregateCheck) on Python values
+    """
+    _nat = pd.NaT if pd else None
+    @staticmethod
+    def isnull(x):
+        return x is None or x is _RowOps._nat or (isinstance(x, Number) and x != x)
+    @staticmethod
+    def compare(op, x, y):
+        return not (_RowOps.isnull(x) or _RowOps.isnull(y)) and op(x, y)
+
+class _SeriesOps(object):
+    """
+    the vectorized operations used to evaluate a RowPredicateExpression on a DataFrame
+    """
+    @staticmethod
+    def isnull(x):
+        return pd.isnull(x)
+    def field(self, df, f):
+        return df[f]
+    def truthy(self, x):
+        if isinstance(x, pd.Series):
+            return x.where(x.notnull(), False).astype(bool)
+        return (not self.isnull(x)) and bool(x)
+    def and_(self, x, y):
+        return x & y
+    def or_(self, x, y):
+        return x | y
+    def not_(self, x):
+        return ~x if isinstance(x, pd.Series) else not x
+    def arithmetic(self, op, *args):
+        if op is operator.truediv: # division by zero is null, as it is for the row dict form
+            zero = args[1] == 0
+            if not isinstance(zero, pd.Series):
+                return (pd.Series(numpy.nan, index=args[0].index) if isinstance(args[0], pd.Series) else None) \
+                       if zero else op(*args)
+            return op(*args).where(~zero)
+        return op(*args)
+    def compare(self, op, x, y):
+        rtn = op(x, y)
+        if isinstance(rtn, pd.Series):
+            return rtn.where(~(self._null_mask(x) | self._null_mask(y)), False).astype(bool)
+        return not (self.isnull(x) or self.isnull(y)) and bool(rtn)
+    def _null_mask(self, x):
+        return x.isnull() if isinstance(x, pd.Series) else bool(self.isnull(x))
+
+_row_ops, _series_ops = _RowOps(), _SeriesOps()
+
+def _expression_failures(predicate, df, max_failures):
+    """
+    :param predicate: a row predicate
+    :param df: a DataFrame
+    :param max_failures: the maximum number of failing rows to flag
+    :return: None if predicate isn't a RowPredicateExpression that can be evaluated as a mask for df, otherwise
+             a boolean Series indicating the (first max_failures) failing rows of df
+    """
+    if not isinstance(predicate, RowPredicateExpression):
+        return None
+    try:
+        rtn = ~predicate.mask(df)
+    except Exception: # the row by row evaluation will either handle this or raise a more informative exception
+        return None
+    if max_failures < float("inf"):
+        rtn &= rtn.cumsum() <= max_failures
+    return rtn
+
+class AggregateCheck(object):
+    """
+    A check that groups the rows of a child table, aggregates each group and compares the aggregate to a bound.
+    The bound can itself be an aggregate over the rows of a parent table (grouped to match the child groups).
+    See TicDatFactory.add_aggregate_check for details.
+    """
+    _aggs = {"count": "COUNT", "sum": "SUM", "min": "MIN", "max": "MAX", "mean": "AVG"}
+    _comparisons = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "==": operator.eq,
+                    "!=": operator.ne}
+    def __init__(self, factory, child_table, group_by, agg, parent_table, comparison, parent_group_by=None):
+        """
+        :param factory: the TicDatFactory or PanDatFactory
+        see TicDatFactory.add_aggregate_check for the other arguments
+        """
+        fields = lambda t: factory.primary_key_fields.get(t, ()) + factory.data_fields.get(t, ())
+        for t in [child_table] + ([parent_table] if parent_table is not None else []):
+            verify(t in factory.all_tables, "Unrecognized table name %s"%t)
+            verify(t not in factory.generic_tables, "aggregate checks can't be used with generic tables")
+        self.child_table, self.parent_table = child_table, parent_table
+        self.group_by = (group_by,) if stringish(group_by) else tuple(group_by or ())
+        verify(self.group_by and all(f in fields(child_table) for f in self.group_by),
+               f"group_by should be one or more fields of {child_table}")
+        self.agg, self.agg_field = (agg, None) if stringish(agg) else tuple(agg)
+        verify(self.agg in self._aggs, f"agg should be one of {sorted(self._aggs)}")
+        verify((self.agg == "count") == (self.agg_field is None),
+               "agg should be either 'count' or an (aggregation, field) pair")
+        verify(self.agg_field is None or self.agg_field in fields(child_table),
+               f"{self.agg_field} is not a field of {child_table}")
+        verify(parent_table is not None or parent_group_by is None, "parent_group_by requires a parent_table")
+        if parent_table is not None:
+            pk_fields = factory.primary_key_fields.get(parent_table, ())
+            self.parent_fields = (parent_group_by,) if stringish(parent_group_by) else \
+                                 tuple(parent_group_by or pk_fields)
+            verify(all(f in fields(parent_table) for f in self.parent_fields),
+                   f"parent_group_by should be one or more fields of {parent_table}")
+            verify(len(self.parent_fields) == len(self.group_by),
+                   f"group_by should match the {'parent_group_by' if parent_group_by else 'primary key'} fields "
+                   f"of {parent_table}")
+        verify(stringish(comparison), "comparison should be a string such as '> 0' or '<= Max Supply'")
+        match = re.match(r"\s*(<=|>=|==|!=|<|>)\s*(.*?)\s*$", comparison)
+        verify(match and match.group(2), f"Unable to parse comparison {comparison}")
+        self.comparison, bound = match.groups()
+        self.bound, self.bound_field, self.bound_agg = safe_apply(float)(bound), None, None
+        if self.bound is None:
+            agg_match = re.match(r"(sum|min|max|mean)\s*\((.*)\)$", bound)
+            if agg_match:
+                self.bound_agg, bound = agg_match.group(1), agg_match.group(2).strip()
+            self.bound_field = bound[1:-1] if bound[0:1] == bound[-1:] == "`" else bound
+            verify(parent_table is not None and self.bound_field in (fields(parent_table) if self.bound_agg else
+                                                                     factory.data_fields.get(parent_table, ())),
+                   f"{match.group(2)} should either be a number, a data field of the parent table, or an aggregation "
+                   f"of a field of the parent table")
+            verify(self.bound_agg or self.parent_fields == pk_fields,
+                   f"{self.bound_field} should be aggregated (as in 'sum({self.bound_field})') since parent_group_by "
+                   f"isn't the primary key of {parent_table}")
+    def _default(self, agg=None):
+        return 0 if (agg or self.agg) in ["count", "sum"] else None
+    def _key(self, row, fields):
+        return row[fields[0]] if len(fields) == 1 else tuple(row[f] for f in fields)
+    def _aggregate(self, rows, group_by, agg, agg_field):
+        acc = {}
+        for row in rows:
+            k = self._key(row, group_by)
+            if agg == "count":
+                acc[k] = acc.get(k, 0) + 1
+                continue
+            v, current = row[agg_field], acc.get(k, (0, 0) if agg == "mean" else self._default(agg))
+            if _row_ops.isnull(v):
+                acc[k] = current
+            elif agg == "sum":
+                acc[k] = current + v
+            elif agg == "mean":
+                acc[k] = (current[0] + v, current[1] + 1)
+            else:
+                acc[k] = v if current is None else (min if agg == "min" else max)(current, v)
+        if agg == "mean":
+            acc = {k: s / n if n else None for k, (s, n) in acc.items()}
+        return acc
+    def failures(self, child_rows, parent_rows=None):
+        """
+        :param child_rows: iterable of full row dicts for the child table
+        :param parent_rows: iterable of (primary key, full row dict) for the parent table (only needed for
+                            aggregate checks with a parent table)
+        :return: a list of (group key, aggregate value) for the groups that fail the check
+        """
+        acc = self._aggregate(child_rows, self.group_by, self.agg, self.agg_field)
+        compare = lambda v, bound: _row_ops.compare(self._comparisons[self.comparison], v, bound)
+        if self.parent_table is None:
+            return [(k, v) for k, v in acc.items() if not compare(v, self.bound)]
+        if self.bound_agg:
+            bounds = self._aggregate((row for _, row in parent_rows), self.parent_fields, self.bound_agg,
+                                     self.bound_field).items()
+        else:
+            bounds = {self._key(row, self.parent_fields): self.bound if self.bound_field is None
+                      else row[self.bound_field] for _, row in parent_rows}.items()
+        return [(k, acc.get(k, self._default())) for k, bound in bounds
+                if not compare(acc.get(k, self._default()), bound)]
+    def failures_df(self, child_df, parent_df=None, value_column="Aggregate Value"):
+        """
+        :param child_df: the DataFrame for the child table
+        :param parent_df: the DataFrame for the parent table (only needed for aggregate checks with a parent table)
+        :param value_column: the name of the aggregate value column in the returned DataFrame
+        :return: a DataFrame with the group_by fields and the aggregate value for the groups that fail the check
+        """
+        keys = list(self.group_by)
+        grouped = child_df.groupby(keys, dropna=False)
+        rtn = (grouped.size() if self.agg == "count" else grouped[self.agg_field].agg(self.agg))
+        rtn = rtn.rename(value_column).reset_index()
+        bound = self.bound
+        if self.parent_table is not None:
+            if self.bound_agg:
+                parents = parent_df.groupby(list(self.parent_fields), dropna=False, sort=False)[self.bound_field]
+                parents = parents.agg(self.bound_agg).rename("_bound").reset_index()
+                bound = None
+            else:
+                parents = parent_df[list(self.parent_fields)].copy()
+                if self.bound_field is not None:
+                    parents["_bound"] = bound = parent_df[self.bound_field].values
+                else:
+                    parents = parents.drop_duplicates()
+            parents.columns = keys + list(parents.columns[len(keys):])
+            rtn = parents.merge(rtn, on=keys, how="left")
+            if self._default() is not None:
+                rtn[value_column] = rtn[value_column].fillna(self._default())
+            if self.bound_field is not None:
+                bound = rtn.pop("_bound")
+        passes = _series_ops.compare(self._comparisons[self.comparison], rtn[value_column], bound)
+        return rtn[~passes].reset_index(drop=True)
+    def sql(self, table_names=None, field_names=None, schema=None):
+        """
+        :param table_names: optional. A dictionary mapping table names to the table names used by the database.
+        :param field_names: optional. A dictionary mapping field names to the column names used by the database.
+        :param schema: optional. The name of the (PostgreSQL) schema that holds the tables.
+        :return: a SQL SELECT statement (suitable for both SQLite and PostgreSQL) that selects the group_by fields and
+                 the aggregate value (as "Aggregate Value") for the groups that fail the check.
+        """
+        table_names, field_names = table_names or {}, field_names or {}
+        quote = lambda s: '"%s"' % s.replace('"', '""')
+        table = lambda t: (f"{quote(schema)}." if schema else "") + quote(table_names.get(t, t))
+        field = lambda f: quote(field_names.get(f, f))
+        group_by = ", ".join(map(field, self.group_by))
+        agg = "COUNT(*)" if self.agg == "count" else f"{self._aggs[self.agg]}({field(self.agg_field)})"
+        op = {"==": "=", "!=": "<>"}.get(self.comparison, self.comparison)
+        def fails(value, bound):
+            value = f"COALESCE({value}, 0)" if self._default() is not None else value
+            return f"NOT COALESCE(({value} {op} {bound}), FALSE)", value
+        if self.parent_table is None:
+            condition, value = fails(agg, repr(self.bound))
+            return (f"SELECT {group_by}, {value} AS \"Aggregate Value\" FROM {table(self.child_table)} "
+                    f"GROUP BY {group_by} HAVING {condition}")
+        parents, bound = table(self.parent_table), repr(self.bound)
+        if self.bound_agg:
+            parent_group_by = ", ".join(map(field, self.parent_fields))
+            bound_agg = f"{self._aggs[self.bound_agg]}({field(self.bound_field)})"
+            bound_agg = f"COALESCE({bound_agg}, 0)" if self._default(self.bound_agg) is not None else bound_agg
+            parents, bound = (f"(SELECT {parent_group_by}, {bound_agg} AS _bound FROM {parents} "
+                              f"GROUP BY {parent_group_by})"), "p._bound"
+        elif self.bound_field is not None:
+            bound = f"p.{field(self.bound_field)}"
+        else:
+            parents = f"(SELECT DISTINCT {', '.join(map(field, self.parent_fields))} FROM {parents})"
+        condition, value = fails("c._value", bound)
+        join = " AND ".join(f"p.{field(pf)} = c.{field(g)}" for pf, g in zip(self.parent_fields, self.group_by))
+        return (f"SELECT {', '.join(f'p.{field(pf)} AS {field(g)}' for pf, g in zip(self.parent_fields, self.group_by))}"
+                f", {value} AS \"Aggregate Value\" FROM {parents} AS p LEFT JOIN "
+                f"(SELECT {group_by}, {agg} AS _value FROM {table(self.child_table)} GROUP BY {group_by}) AS c "
+                f"ON {join} WHERE {condition}")
+
+RowPredicateStats = namedtuple("RowPredicateStats", ["wall_time", "calls", "failures", "exceptions"])
+
+def _add_row_predicate_stats(stats, table, predicate_name, wall_time, calls, failures, exceptions):
+    """
+    accumulates the statistics of one row predicate evaluation pass into the stats dictionary
+    """
+    new_stats = RowPredicateStats(wall_time, calls, failures, exceptions)
+    old_stats = stats.get((table, predicate_name))
+    if old_stats:
+        new_stats = RowPredicateStats(*(a + b for a, b in zip(old_stats, new_stats)))
+    stats[table, predicate_name] = new_stats
+
+def _row_predicates_ordered_by_stats(table_predicate_names, stats):
+    """
+    sorts (table, predicate name) pairs so that the cheapest and most selective row predicates come first.
+    Pairs with no statistics yet come first of all (preserving their order) so that they get measured.
+    """
+    def score(tpn):
+        _ = stats.get(tuple(tpn))
+        if not _ or not _.calls:
+            return (0, 0)
+        # seconds per call, per (smoothed) failure rate
+        return (1, (_.wall_time / _.calls) * (_.calls + 1) / (_.failures + 1))
+    return sorted(table_predicate_names, key=score)
+
+def _check_row_predicate_stats_args(stats, order_by_stats):
+    verify(stats is None or dictish(stats), "stats should be a dictionary")
+    verify(not order_by_stats or stats is not None, "order_by_stats requires a stats dictionary")
+
+def _check_kwargs_cache_arg(kwargs_cache):
+    verify(kwargs_cache is None or dictish(kwargs_cache), "kwargs_cache should be a dictionary")
+
+def _cached_predicate_kwargs(kwargs_cache, content_stamp, key, make_kwargs):
+    """
+    returns make_kwargs(), reusing the result stored in kwargs_cache when the data hasn't changed since it was stored
+    :param kwargs_cache: None (no caching) or a dictionary owned by the caller
+    :param content_stamp: a no argument function returning a summary of the data contents (or None if the
+                          contents can't be summarized, in which case nothing is cached)
+    :param key: the kwargs_cache key
+    :param make_kwargs: a no argument function that calls the predicate_kwargs_maker
+    :return: the predicate_kwargs_maker result. Only dict results are cached.
+    """
+    if kwargs_cache is None or content_stamp() is None:
+        return make_kwargs()
+    if key in kwargs_cache and kwargs_cache[key][0] == content_stamp():
+        return kwargs_cache[key][1]
+    rtn = make_kwargs()
+    if isinstance(rtn, dict):
+        kwargs_cache[key] = (content_stamp(), rtn)
+    return rtn
+
 def does_new_fk_complete_circle(native_tbl, foreign_tbl, tdf):
     fks = defaultdict(set)
     for fk in tdf.foreign_keys:
@@ -57,26 +57,30 @@ class _OpenPyxlSheetWrapper(object):
     '''
     This file initially used xlrd for xls and xlsx files. This class allows an openpyxl.sheet to present as a
     limited xlrd.sheet. Although this choice of abstractions is historical, the resulting code is at least
-    free from lots of "if/else" silliness
+    free from lots of "if/else" silliness.
+    The sheet is expected to come from a read_only workbook. Random access into such a sheet re-parses the
+    underlying xml, so the rows are read in a single pass on __init__ (which also finds the trailing empty rows).
+    The dimensions recorded in the file can be stale (and read_only iteration would stop at them), so they are reset
+    before reading.
     '''
     def __init__(self, sheet, prune_trailing_empty_rows):
-        self._sheet = sheet
-        self._max_col = sheet.max_column # for performance reasons, need to capture the range on __init__
-        self._max_row = sheet.max_row
-        if prune_trailing_empty_rows:
-            i = self.nrows-1
-            while i >= 0 and all(x is None for x in self.row_values(i)):
-                i -= 1
-            self._max_row = i+1
+        if hasattr(sheet, "reset_dimensions"):
+            sheet.reset_dimensions()
+        rows, max_col, last_non_empty = [], 0, 0
+        for row in sheet.iter_rows(values_only=True):
+            rows.append(tuple(row)) # without dimensions, gaps between rows are yielded as empty lists
+            max_col = max(max_col, len(row))
+            if any(x is not None for x in row):
+                last_non_empty = len(rows)
+        self._rows = [row + (None,) * (max_col - len(row)) if len(row) < max_col else row for row in rows]
+        self._max_row = last_non_empty if prune_trailing_empty_rows else len(self._rows)
     @property
     def nrows(self):
-        return self._sheet.max_row-self._sheet.min_row+1
-    def row_values(self, row_index): # openpyxl used 1 based indexing
-        return tuple(x.value for x in next(iter(self._sheet.iter_rows(min_row=row_index+1, max_row=row_index+1,
-                                                                      min_col=1, max_col=self._max_col))))
-    def col_values(self, col_index): # openpyxl used 1 based indexing
-        return tuple(x.value for x in next(iter(self._sheet.iter_cols(min_col=col_index+1, max_col=col_index+1,
-                                                                      min_row=1, max_row=self._max_row))))
+        return len(self._rows)
+    def row_values(self, row_index):
+        return self._rows[row_index]
+    def col_values(self, col_index):
+        return tuple(row[col_index] for row in self._rows[:self._max_row])
 
 class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
     """
@@ -155,6 +159,27 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
                    "headers_present, treat_inf_as_infinity and row_offsets must all be at default values\n" +
                    "to use generic tables")
         rtn = self._create_tic_dat_dict(xls_file_path, row_offsets or {}, headers_present, treat_inf_as_infinity)
+        rtn = self._finish_tic_dat(xls_file_path, rtn)
+        if freeze_it:
+            return self.tic_dat_factory.freeze_me(rtn)
+        return rtn
+    def _find_duplicates_and_create_tic_dat(self, xls_file_path):
+        # a single read of the file that serves both find_duplicates and create_tic_dat (for standard_main)
+        self._verify_differentiable_sheet_names()
+        verify(utils.safe_apply(os.path.isfile)(xls_file_path), f"{xls_file_path} not a file path")
+        if xls_file_path.endswith(".xls"):
+            verify(xlrd, "xlrd needs to be installed to use this subroutine")
+        else:
+            verify(openpyxl, "openpyxl needs to be installed to use this subroutine")
+        verify(not self.tic_dat_factory.generator_tables,
+               "treat_inf_as_infinity not implemented for generator tables")
+        duplicates = {}
+        rtn = self._create_tic_dat_dict(xls_file_path, {}, True, True, duplicates)
+        if duplicates:
+            return duplicates, None
+        return {}, self._finish_tic_dat(xls_file_path, rtn)
+    def _finish_tic_dat(self, xls_file_path, rtn):
+        tdf = self.tic_dat_factory
         if self.tic_dat_factory.generic_tables:
             if xls_file_path.endswith(".xls"):
                 print("** Warning : pandas doesn't always play well with older Excel formats.")
@@ -162,10 +187,7 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
             pandat = pdf.xls.create_pan_dat(xls_file_path)
             for t in self.tic_dat_factory.generic_tables:
                 rtn[t] = getattr(pandat, t)
-        rtn = tdf._parameter_table_post_read_adjustment(tdf.TicDat(**rtn))
-        if freeze_it:
-            return self.tic_dat_factory.freeze_me(rtn)
-        return rtn
+        return tdf._parameter_table_post_read_adjustment(tdf.TicDat(**rtn))
     def _verify_differentiable_sheet_names(self):
         rtn = defaultdict(set)
         for t in self.tic_dat_factory.all_tables:
@@ -179,9 +201,17 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
                "xls_file_path argument %s is not a valid file path."%xls_file_path)
         try :
             book = xlrd.open_workbook(xls_file_path) if xls_file_path.endswith(".xls") else \
-                openpyxl.load_workbook(xls_file_path, data_only=True)
+                openpyxl.load_workbook(xls_file_path, read_only=True, data_only=True)
         except Exception as e:
             raise TicDatError("Unable to open %s as xls file : %s"%(xls_file_path, e))
+        try:
+            return self._get_sheets_and_fields_from_book(xls_file_path, book, all_tables, row_offsets,
+                                                         headers_present, print_missing_tables)
+        finally:
+            if not xls_file_path.endswith(".xls"):
+                book.close() # read_only openpyxl workbooks hold the file open until closed
+    def _get_sheets_and_fields_from_book(self, xls_file_path, book, all_tables, row_offsets, headers_present,
+                                         print_missing_tables):
         sheet_name = lambda sheet: sheet.name if xls_file_path.endswith(".xls") else sheet.title
         sheets = defaultdict(list)
         book_sheets = lambda: book.sheets() if xls_file_path.endswith(".xls") else book.worksheets
@@ -225,7 +255,8 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
                                           field_indicies[table], treat_inf_as_infinity, sheet)(x)
         return tableObj
 
-    def _create_tic_dat_dict(self, xls_file_path, row_offsets, headers_present, treat_inf_as_infinity):
+    def _create_tic_dat_dict(self, xls_file_path, row_offsets, headers_present, treat_inf_as_infinity,
+                             duplicates=None):
         tiai = treat_inf_as_infinity
         verify(utils.dictish(row_offsets) and
                set(row_offsets).issubset(self.tic_dat_factory.all_tables) and
@@ -245,10 +276,16 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
             table_len = min(len(sheet.col_values(indicies[field]))
                             for field in (fields or indicies))
             if tdf.primary_key_fields.get(tbl, ()) :
-                tableObj = {self._sub_tuple(tbl, tdf.primary_key_fields[tbl], indicies, tiai, sheet)(x):
-                            self._sub_tuple(tbl, tdf.data_fields.get(tbl, ()), indicies, tiai, sheet)(x)
-                            for x in (sheet.row_values(i) for i in
-                                        range(table_len)[row_offsets[tbl]+ho:])}
+                pk_tuple = self._sub_tuple(tbl, tdf.primary_key_fields[tbl], indicies, tiai, sheet)
+                data_tuple = self._sub_tuple(tbl, tdf.data_fields.get(tbl, ()), indicies, tiai, sheet)
+                tableObj, dups = {}, {}
+                for x in (sheet.row_values(i) for i in range(table_len)[row_offsets[tbl]+ho:]):
+                    pk = pk_tuple(x)
+                    if pk in tableObj:
+                        dups[pk] = dups.get(pk, 1) + 1
+                    tableObj[pk] = data_tuple(x)
+                if dups and duplicates is not None:
+                    duplicates[tbl] = dups
             elif tbl in tdf.generic_tables:
                 tableObj = None # will be read via PanDatFactory
             else :
@@ -298,7 +335,7 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
         row_offsets = dict({t:0 for t in self.tic_dat_factory.all_tables}, **row_offsets)
         tdf = self.tic_dat_factory
         pk_tables = tuple(t for t,_ in tdf.primary_key_fields.items() if _)
-        rtn = {t:defaultdict(int) for t in pk_tables}
+        rtn = {}
         sheets, fieldIndicies  = self._get_sheets_and_fields(xls_file_path, pk_tables,
                                         row_offsets, headers_present)
         ho = 1 if headers_present else 0
@@ -306,13 +343,12 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
             fields = tdf.primary_key_fields[table] + tdf.data_fields.get(table, ())
             indicies = fieldIndicies[table]
             table_len = min(len(sheet.col_values(indicies[field])) for field in fields)
-            for x in (sheet.row_values(i) for i in range(table_len)[row_offsets[table]+ho:]) :
-                rtn[table][self._sub_tuple(table, tdf.primary_key_fields[table],
-                                           indicies, treat_inf_as_infinity=True, sheet=sheet)(x)] += 1
-        for t in list(rtn.keys()):
-            rtn[t] = {k:v for k,v in rtn[t].items() if v > 1}
-            if not rtn[t]:
-                del(rtn[t])
+            sub_tuple = self._sub_tuple(table, tdf.primary_key_fields[table], indicies,
+                                        treat_inf_as_infinity=True, sheet=sheet)
+            rtn[table] = utils.count_duplicate_keys(sub_tuple(sheet.row_values(i)) for i in
+                                                    range(table_len)[row_offsets[table]+ho:])
+            if not rtn[table]:
+                del(rtn[table])
         return rtn
     def _get_dv_dt(self, table, field):
         # reminder - data fields have a default default of zero, primary keys don't get a default default
@@ -394,6 +430,8 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
         :return:
 
         caveats: None may be written out as an empty string. This reflects the behavior of xlwt.
+                 .xlsx files are written row by row in xlsxwriter's constant_memory mode, so that memory
+                 use doesn't grow with the size of the tables.
         """
         self._verify_differentiable_sheet_names()
         verify(utils.stringish(file_path) and
@@ -420,27 +458,15 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
     def _xls_write(self, tic_dat, file_path, tbl_name_mapping):
         verify(xlwt, "Can't write .xls files because xlwt package isn't installed.")
         tdf = self.tic_dat_factory
-        def clean_for_write(t, f, x):
-            if isinstance(x, datetime.datetime):
-                return str(x)
-            return self.tic_dat_factory._infinity_flag_write_cell(t, f, x)
         book = xlwt.Workbook()
         for t in  sorted(sorted(tdf.all_tables),
                          key=lambda x: len(tdf.primary_key_fields.get(x, ()))) :
-            all_flds = self.tic_dat_factory.primary_key_fields.get(t, ()) + self.tic_dat_factory.data_fields.get(t, ())
             sheet = book.add_sheet(tbl_name_mapping[t][:_longest_sheet])
             for i,f in enumerate(tdf.primary_key_fields.get(t,()) + tdf.data_fields.get(t, ())) :
                 sheet.write(0, i, f)
-            _t = getattr(tic_dat, t)
-            if utils.dictish(_t) :
-                for row_ind, (p_key, data) in enumerate(_t.items()) :
-                    for field_ind, cell in enumerate( (p_key if containerish(p_key) else (p_key,)) +
-                                        tuple(data[_f] for _f in tdf.data_fields.get(t, ()))):
-                        sheet.write(row_ind+1, field_ind, clean_for_write(t, all_flds[field_ind], cell))
-            else :
-                for row_ind, data in enumerate(_t if containerish(_t) else _t()) :
-                    for field_ind, cell in enumerate(tuple(data[_f] for _f in tdf.data_fields[t])) :
-                        sheet.write(row_ind+1, field_ind, clean_for_write(t, all_flds[field_ind], cell))
+            for row_ind, row in enumerate(tdf._write_rows(t, getattr(tic_dat, t))) :
+                for field_ind, cell in enumerate(row) :
+                    sheet.write(row_ind+1, field_ind, str(cell) if isinstance(cell, datetime.datetime) else cell)
         if os.path.exists(file_path):
             os.remove(file_path)
         book.save(file_path)
@@ -449,29 +475,17 @@ class XlsTicFactory(freezable_factory(object, "_isFrozen")) :
         tdf = self.tic_dat_factory
         if os.path.exists(file_path):
             os.remove(file_path)
-        book = xlsx.Workbook(file_path)
-        def clean_for_write(t, f, x):
-            if self.tic_dat_factory.infinity_io_flag != "N/A" or \
-               (t == "parameters" and self.tic_dat_factory.parameters):
-                x = self.tic_dat_factory._infinity_flag_write_cell(t, f, x)
-            if x in [float("inf"), -float("inf")] or isinstance(x, datetime.datetime):
+        # constant_memory flushes each row to disk once the next row is started, so rows need to be written in order
+        book = xlsx.Workbook(file_path, {"constant_memory": True})
+        infinities = (float("inf"), -float("inf"))
+        def clean_for_write(x):
+            if x in infinities or isinstance(x, datetime.datetime):
                 return str(x)
             return x
         for t in sorted(sorted(tdf.all_tables),
                          key=lambda x: len(tdf.primary_key_fields.get(x, ()))) :
-            all_flds = self.tic_dat_factory.primary_key_fields.get(t, ()) + self.tic_dat_factory.data_fields.get(t, ())
             sheet = book.add_worksheet(tbl_name_mapping[t][:_longest_sheet])
-            for i,f in enumerate(tdf.primary_key_fields.get(t,()) + tdf.data_fields.get(t, ())) :
-                sheet.write(0, i, f)
-            _t = getattr(tic_dat, t)
-            if utils.dictish(_t) :
-                for row_ind, (p_key, data) in enumerate(_t.items()) :
-                    for field_ind, cell in enumerate( (p_key if containerish(p_key) else (p_key,)) +
-                                        tuple(data[_f] for _f in tdf.data_fields.get(t, ()))):
-                        write_cell =  clean_for_write(t, all_flds[field_ind], cell)
-                        sheet.write(row_ind+1, field_ind, write_cell)
-            else :
-                for row_ind, data in enumerate(_t if containerish(_t) else _t()) :
-                    for field_ind, cell in enumerate(tuple(data[_f] for _f in tdf.data_fields[t])) :
-                        sheet.write(row_ind+1, field_ind, clean_for_write(t, all_flds[field_ind], cell))
+            sheet.write_row(0, 0, tdf.primary_key_fields.get(t,()) + tdf.data_fields.get(t, ()))
+            for row_ind, row in enumerate(tdf._write_rows(t, getattr(tic_dat, t))) :
+                sheet.write_row(row_ind+1, 0, tuple(map(clean_for_write, row)))
         book.close()